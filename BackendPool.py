@@ -0,0 +1,299 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .Tracing import bind_trace_dream
+
+_LOGGER = logging.getLogger(__name__)
+
+# Number of chunks sent in advance to a server so that it never waits for the next one
+DEFAULT_MAX_IN_FLIGHT = 2
+
+
+class BackendError(Exception):
+    """
+    Failure of a server (unreachable, timed out, connection lost...), the chunk can be retried on another one
+    """
+    pass
+
+
+class JobError(Exception):
+    """
+    Failure of the request itself, retrying it on another server would fail the same way
+    """
+    pass
+
+
+class Backend:
+    def __init__(self, url):
+        """
+        Constructor
+        :param url: root url of an Automatic1111 server
+        """
+        self.__url = url.rstrip("/")
+        self.__healthy = True
+        self.__idle = True
+        self.__outstanding_chunks = 0
+        self.__outstanding_images = 0
+        self.__nb_chunks = 0
+        self.__nb_images = 0
+        self.__nb_failures = 0
+        self.__busy_time = 0.0
+        self.__busy_since = None
+
+    def get_url(self):
+        """
+        Getter of the url
+        :return: url
+        """
+        return self.__url
+
+    def is_healthy(self):
+        """
+        Getter of whether the server answered the last health check and didn't fail since
+        :return: is healthy
+        """
+        return self.__healthy
+
+    def is_idle(self):
+        """
+        Getter of whether the server had no job running at the last health check
+        :return: is idle
+        """
+        return self.__idle
+
+    def get_outstanding_chunks(self):
+        """
+        Getter of the number of chunks sent and not yet received
+        :return: outstanding chunks
+        """
+        return self.__outstanding_chunks
+
+    def get_outstanding_images(self):
+        """
+        Getter of the number of images sent and not yet received
+        :return: outstanding images
+        """
+        return self.__outstanding_images
+
+    def get_throughput(self):
+        """
+        Getter of the number of images generated by second
+        :return: throughput
+        """
+        return self.__nb_images / self.__busy_time if self.__busy_time > 0 else 0.0
+
+    def set_health(self, healthy, idle=True):
+        """
+        Setter of the health state
+        :param healthy
+        :param idle
+        :return:
+        """
+        self.__healthy = healthy
+        self.__idle = idle
+
+    def on_chunk_sent(self, nb_images):
+        """
+        Count a chunk sent to the server
+        :param nb_images
+        :return:
+        """
+        if self.__outstanding_chunks == 0:
+            self.__busy_since = time.perf_counter()
+        self.__outstanding_chunks += 1
+        self.__outstanding_images += nb_images
+
+    def on_chunk_ended(self, nb_images, succeeded, backend_failed=False):
+        """
+        Count a chunk ended on the server
+        :param nb_images
+        :param succeeded
+        :param backend_failed: whether the server itself failed (it won't receive new chunks)
+        :return:
+        """
+        self.__outstanding_chunks -= 1
+        self.__outstanding_images -= nb_images
+        if self.__outstanding_chunks == 0:
+            self.__busy_time += time.perf_counter() - self.__busy_since
+        if succeeded:
+            self.__nb_chunks += 1
+            self.__nb_images += nb_images
+        elif backend_failed:
+            self.__nb_failures += 1
+            self.__healthy = False
+
+    def get_stats(self):
+        """
+        Get the statistics of the server
+        :return: dict of stats
+        """
+        return {
+            "url": self.__url,
+            "chunks": self.__nb_chunks,
+            "images": self.__nb_images,
+            "busy_time": self.__busy_time,
+            "throughput": self.get_throughput(),
+            "failures": self.__nb_failures,
+        }
+
+
+class BackendPool:
+    def __init__(self, urls, session, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Constructor
+        :param urls: url or list of urls of Automatic1111 servers
+        :param session: SDSession used for the health checks
+        :param max_in_flight: max number of chunks sent to a server at the same time
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        self.__backends = [Backend(url) for url in urls]
+        self.__session = session
+        self.__max_in_flight = max_in_flight
+
+    def get_backends(self):
+        """
+        Getter of the backends
+        :return: backends
+        """
+        return self.__backends
+
+    def get_main_url(self):
+        """
+        Getter of the url of the first server
+        :return: url
+        """
+        return self.__backends[0].get_url()
+
+    def __check_backend_health(self, backend):
+        """
+        Check whether a server answers and is idle
+        :param backend
+        :return:
+        """
+        try:
+            response = self.__session.get("progress", backend.get_url() + "/sdapi/v1/progress")
+            if response.status_code != 200:
+                backend.set_health(False)
+                return
+            state = response.json().get("state", {})
+            backend.set_health(True, state.get("job_count", 0) == 0)
+        except (requests.exceptions.RequestException, ValueError):
+            backend.set_health(False)
+
+    def check_health(self):
+        """
+        Check all the servers in parallel
+        :return: healthy backends, the idle ones first
+        """
+        with ThreadPoolExecutor(max_workers=len(self.__backends)) as executor:
+            list(executor.map(self.__check_backend_health, self.__backends))
+        healthy = [backend for backend in self.__backends if backend.is_healthy()]
+        # Busy servers (other artists' jobs) are used only when no idle one is available
+        idle = [backend for backend in healthy if backend.is_idle()]
+        return idle if len(idle) > 0 else healthy
+
+    def run(self, chunks, run_chunk, chunk_done=None, chunk_weight=None, cancel_event=None):
+        """
+        Run the chunks on the servers, each chunk is given to the server with the least outstanding work.
+        The chunks of a failing server go back in the queue
+        :param chunks: list of chunks
+        :param run_chunk: function(backend, chunk) -> result, raises BackendError or JobError
+        :param chunk_done: function(index, result) called on each chunk end (on a worker thread)
+        :param chunk_weight: function(chunk) -> number of images of the chunk
+        :param cancel_event: threading.Event, once set no new chunk is sent
+        :return: list of results in the order of the chunks (None if not run), error message or None
+        """
+        results = [None] * len(chunks)
+        if len(chunks) == 0:
+            return results, None
+        weights = [chunk_weight(chunk) if chunk_weight is not None else 1 for chunk in chunks]
+        backends = self.check_health()
+        if len(backends) == 0:
+            return results, "The server couldn't be found."
+
+        pending = deque(range(len(chunks)))
+        condition = threading.Condition()
+        state = {"in_flight": 0, "error": None, "backend_error": None}
+
+        def work(backend, index):
+            succeeded = False
+            backend_failed = False
+            try:
+                results[index] = run_chunk(backend, chunks[index])
+                succeeded = True
+                if chunk_done is not None:
+                    chunk_done(index, results[index])
+            except BackendError as e:
+                _LOGGER.warning("Server %s failed, its chunk goes back in the queue : %s", backend.get_url(), e)
+                backend_failed = True
+                with condition:
+                    pending.appendleft(index)
+                    state["backend_error"] = str(e)
+            except JobError as e:
+                with condition:
+                    state["error"] = state["error"] or str(e)
+            except Exception as e:
+                _LOGGER.exception("Chunk %d failed on %s", index, backend.get_url())
+                with condition:
+                    state["error"] = state["error"] or str(e)
+            finally:
+                with condition:
+                    backend.on_chunk_ended(weights[index], succeeded, backend_failed)
+                    state["in_flight"] -= 1
+                    condition.notify_all()
+
+        with ThreadPoolExecutor(max_workers=len(backends) * self.__max_in_flight,
+                                thread_name_prefix="style_dreamer_backend") as executor:
+            with condition:
+                while True:
+                    if state["error"] is not None or (cancel_event is not None and cancel_event.is_set()):
+                        pending.clear()
+                    healthy = [backend for backend in backends if backend.is_healthy()]
+                    if len(healthy) == 0:
+                        pending.clear()
+                    if len(pending) == 0 and state["in_flight"] == 0:
+                        break
+                    available = [backend for backend in healthy
+                                 if backend.get_outstanding_chunks() < self.__max_in_flight]
+                    if len(pending) > 0 and len(available) > 0:
+                        # Least outstanding work first, then the fastest server
+                        backend = min(available, key=lambda b: (b.get_outstanding_images(), -b.get_throughput()))
+                        index = pending.popleft()
+                        backend.on_chunk_sent(weights[index])
+                        state["in_flight"] += 1
+                        executor.submit(bind_trace_dream(work), backend, index)
+                        continue
+                    # Timeout to notice the cancellation
+                    condition.wait(0.5)
+
+        self.log_stats()
+        if cancel_event is not None and cancel_event.is_set():
+            return results, None
+        if state["error"] is not None:
+            return results, state["error"]
+        if any(result is None for result in results):
+            return results, state["backend_error"] or "The server couldn't be found."
+        return results, None
+
+    def log_stats(self):
+        """
+        Log the throughput of each server
+        :return:
+        """
+        for backend in self.__backends:
+            stats = backend.get_stats()
+            _LOGGER.info("Server %s : %d images in %d chunks, %.2f images/s, %d failures", stats["url"],
+                         stats["images"], stats["chunks"], stats["throughput"], stats["failures"])
+
+    def get_stats(self):
+        """
+        Get the statistics of each server
+        :return: list of dict of stats
+        """
+        return [backend.get_stats() for backend in self.__backends]
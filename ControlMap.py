@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+from .PayloadOptimizer import optimize_png
+from .Tracing import trace_span
+
+_LOGGER = logging.getLogger(__name__)
+
+# Size of the blocks read from the maps, multiple of 3 so that each block is encoded in base64 without padding
+_READ_BLOCK_SIZE = 3 * 256 * 1024
+
+
+def _remove_file(path):
+    """
+    Remove a file if it still exists
+    :param path
+    :return:
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_snapshot_paths(value):
+    """
+    Get the files of the snapshots held by request parameters
+    :param value: request parameters
+    :return: set of snapshot paths
+    """
+    if isinstance(value, ControlMapSnapshot):
+        return {value.get_path()}
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return set(path for item in value for path in get_snapshot_paths(item))
+    return set()
+
+
+class ControlMapSnapshot:
+    def __init__(self, path, size, digest, original_size=None):
+        """
+        Constructor. The snapshot file is removed when the snapshot isn't referenced anymore
+        :param path: path of the frozen copy of the map
+        :param size: size of the file in bytes
+        :param digest: sha256 of the file
+        :param original_size: size in bytes of the map before its optimization
+        """
+        self.__path = path
+        self.__size = size
+        self.__digest = digest
+        self.__original_size = original_size if original_size is not None else size
+        weakref.finalize(self, _remove_file, path)
+
+    def get_path(self):
+        """
+        Getter of the path of the frozen copy
+        :return: path
+        """
+        return self.__path
+
+    def get_digest(self):
+        """
+        Getter of the sha256 of the map
+        :return: digest
+        """
+        return self.__digest
+
+    def get_base64_length(self, original=False):
+        """
+        Getter of the length of the map encoded in base64
+        :param original: whether the length is the one of the map before its optimization
+        :return: base64 length
+        """
+        size = self.__original_size if original else self.__size
+        return 4 * ((size + 2) // 3)
+
+    def iter_base64(self):
+        """
+        Read the map and encode it in base64 block by block
+        :return: generator of base64 bytes
+        """
+        with open(self.__path, "rb") as file:
+            while True:
+                block = file.read(_READ_BLOCK_SIZE)
+                if not block:
+                    break
+                yield base64.b64encode(block)
+
+    def get_base64(self):
+        """
+        Get the whole map encoded in base64
+        :return: base64 string
+        """
+        return b"".join(self.iter_base64()).decode()
+
+
+class ControlMap:
+    def __init__(self, path, snapshot_dir, optimize=True):
+        """
+        Constructor
+        :param path: path of the rendered map
+        :param snapshot_dir: folder of the frozen copies sent to the server
+        :param optimize: whether the copies are re-encoded in the smallest lossless PNG
+        """
+        self.__path = path
+        self.__snapshot_dir = snapshot_dir
+        self.__optimize = optimize
+        self.__lock = threading.Lock()
+        self.__snapshot = None
+        self.__file_state = None
+
+    def get_path(self):
+        """
+        Getter of the path
+        :return: path
+        """
+        return self.__path
+
+    def exists(self):
+        """
+        Getter of whether the map file exists
+        :return: exists
+        """
+        return os.path.isfile(self.__path)
+
+    def __get_file_state(self):
+        """
+        Get the modification time and the size of the map file
+        :return: (mtime, size)
+        """
+        stat = os.stat(self.__path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def __create_snapshot(self):
+        """
+        Copy the map, optimize the copy and hash it
+        :return: snapshot
+        """
+        os.makedirs(self.__snapshot_dir, exist_ok=True)
+        fd, snapshot_path = tempfile.mkstemp(suffix=".png", dir=self.__snapshot_dir)
+        try:
+            with open(self.__path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, _READ_BLOCK_SIZE)
+            if self.__optimize:
+                original_size, size = optimize_png(snapshot_path)
+            else:
+                original_size = size = os.path.getsize(snapshot_path)
+            sha256 = hashlib.sha256()
+            with open(snapshot_path, "rb") as file:
+                for block in iter(lambda: file.read(_READ_BLOCK_SIZE), b""):
+                    sha256.update(block)
+        except OSError:
+            _remove_file(snapshot_path)
+            raise
+        _LOGGER.debug("Control map %s frozen in %s (%d bytes, %d before optimization)", self.__path,
+                      snapshot_path, size, original_size)
+        return ControlMapSnapshot(snapshot_path, size, sha256.hexdigest(), original_size)
+
+    def get_snapshot(self):
+        """
+        Get a frozen copy of the map, so that a new render doesn't change the dreams already queued.
+        It is created on the first call and again only if the file changed
+        :return: snapshot
+        """
+        with self.__lock:
+            file_state = self.__get_file_state()
+            # The copy is made again if the storage cleanup removed it
+            if self.__snapshot is None or file_state != self.__file_state or \
+                    not os.path.isfile(self.__snapshot.get_path()):
+                with trace_span("freeze control map", "dream", path=self.__path):
+                    self.__snapshot = self.__create_snapshot()
+                self.__file_state = file_state
+            return self.__snapshot
+
+    def get_snapshot_path(self):
+        """
+        Getter of the path of the frozen copy held, without making one
+        :return: snapshot path or None
+        """
+        snapshot = self.__snapshot
+        return snapshot.get_path() if snapshot is not None else None
+
+    def is_frozen(self):
+        """
+        Getter of whether a frozen copy of the map is held
+        :return: is frozen
+        """
+        return self.__snapshot is not None
+
+    def release_if_changed(self):
+        """
+        Free the frozen copy if the file changed or was deleted since it was made
+        :return:
+        """
+        with self.__lock:
+            if self.__snapshot is None:
+                return
+            try:
+                changed = self.__get_file_state() != self.__file_state
+            except OSError:
+                changed = True
+            if changed:
+                self.__snapshot = None
+                self.__file_state = None
+
+    def release(self):
+        """
+        Free the frozen copy (it stays on the disk while a queued dream uses it)
+        :return:
+        """
+        with self.__lock:
+            self.__snapshot = None
+            self.__file_state = None
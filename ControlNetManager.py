@@ -1,13 +1,14 @@
 import os
 import re
-import base64
 import requests
 import json
 import tempfile
 import time
 import datetime
+import logging
 import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import pymel.core as pm
@@ -16,6 +17,45 @@ import mtoa.aovs as aovs
 
 from .StyleDreamer import *
 from .StyleVisualizer import *
+from .SDSession import *
+from .ImageWriter import *
+from .DreamPlanner import *
+from .BackendPool import *
+from .DreamQueue import *
+from .ProgressPoller import *
+from .ResultCache import *
+from .ControlMap import *
+from .RequestBody import *
+from .DreamParams import *
+from .DreamClient import *
+from .DreamSweep import *
+from .SweepUI import *
+from .Tracing import *
+from .Telemetry import *
+from .OutputStore import *
+from .StorageManager import *
+from .ThumbnailCache import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# Interval between two interrupt requests while the chunks of a cancelled dream are still running
+_INTERRUPT_INTERVAL = 0.5
+# Max time spent interrupting a cancelled dream
+_INTERRUPT_TIMEOUT = 120
+
+
+def _get_server_job_timestamp(response_dict):
+    """
+    Get the timestamp of the current job of a server from its progress
+    :param response_dict: progress response dict, or an int (error code) if the request failed
+    :return: timestamp (None if the server is idle or didn't answer)
+    """
+    if type(response_dict) is int:
+        return None
+    job_str_timestamp = response_dict["state"]["job_timestamp"]
+    if job_str_timestamp == "0":
+        return None
+    return int(time.mktime(datetime.datetime.strptime(job_str_timestamp, "%Y%m%d%H%M%S").timetuple()))
 
 
 class ControlNetManager:
@@ -90,124 +130,16 @@ class ControlNetManager:
         for render_layer in render_layers:
             render_layer.renderable.set(render_layer.name() == "defaultRenderLayer")
 
-    #
-    @staticmethod
-    def __request_controlnet_api(params, request_url, output_dir):
-        """
-        Inspired from https://github.com/coolzilj/Blender-ControlNet
-        Request the Stable Diffusion Controlnet API
-        :param params
-        :param request_url
-        :param output_dir
-        :return:
-        """
-        # create headers
-        headers = {
-            "User-Agent": "",
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate, br",
-        }
-
-        # send API request
-        try:
-            response = requests.post(request_url, json=params, headers=headers, timeout=10000)
-        except requests.exceptions.ConnectionError:
-            return None, -1, "The server couldn't be found."
-        except requests.exceptions.MissingSchema:
-            return None, -1, "The url for the server is invalid."
-        except requests.exceptions.ReadTimeout:
-            return None, -1, "The server timed out."
-
-        # handle the response
-        if response.status_code == 200:
-            return ControlNetManager.handle_api_success(response, output_dir)
-        else:
-            return ControlNetManager.handle_api_error(response)
-
-    @staticmethod
-    def handle_api_error(response):
-        """
-        Handle Stable Diffusion API Response Error
-        :param response
-        :return:
-        """
-        if response.status_code == 404:
-            try:
-                response_obj = response.json()
-                if response_obj.get("detail") and response_obj["detail"] == "Not Found":
-                    msg = "It looks like the server is running, but it's not in API mode."
-                elif (
-                        response_obj.get("detail")
-                        and response_obj["detail"] == "Sampler not found"
-                ):
-                    msg = "The sampler you selected is not available."
-                else:
-                    msg = f"An error occurred in the server. Full server response: {json.dumps(response_obj)}"
-            except:
-                msg = "The server couldn't be found."
-        elif response.status_code == 504:
-            msg = "Gateway Timeout"
-        else:
-            msg = "An error occurred in the server : \n\n" + str(response.content)
-        return None, -1, msg
-
-    @staticmethod
-    def handle_api_success(response, output_dir):
-        """
-        Handle Stable Diffusion API Response Success
-        :param response
-        :param output_dir
-        :return:
-        """
-        try:
-            response_obj = response.json()
-            infos = json.loads(response_obj["info"])
-            seed = infos["seed"]
-            nb_gen_img = response_obj["parameters"]["batch_size"] * response_obj["parameters"]["n_iter"]
-            base64_imgs = response_obj["images"]
-        except:
-            return None, -1, "Server response content : \n\n" + str(response.content)
-
-        # decode base64 image
-        try:
-            imgs_binary = []
-            for base64_img in base64_imgs:
-                imgs_binary.append(base64.b64decode(base64_img.replace("data:image/png;base64,", "")))
-        except:
-            return None, -1, "Couldn't decode base64 image."
-
-        # save the image to the temp file
-        try:
-            output_file_prefix = time.strftime(output_dir + "/output_%d%m%Y_%H%M%S")
-            output_files = []
-            for i in range(nb_gen_img):
-                if nb_gen_img > 1:
-                    output_filepath = output_file_prefix + "_" + str(i) + ".png"
-                else:
-                    output_filepath = output_file_prefix + ".png"
-                with open(output_filepath, "wb") as file:
-                    file.write(imgs_binary[i])
-                output_files.append(output_filepath)
-        except:
-            return None, -1, "Couldn't write to output file."
-
-        # return the temp file
-        return output_files, seed, "Success"
-
-    @staticmethod
-    def __request_eta_api(request_url):
+    def __request_eta_api(self, request_url):
         """
         Request the Stable Diffusion for the ETA
         :param request_url
         :return:
         """
-        # create headers
-        headers = {"User-Agent": "", "Accept": "*/*", "Accept-Encoding": "gzip, deflate, br"}
-
         # send API request
         try:
-            response = requests.get(request_url, headers=headers, timeout=10)
-        except requests.exceptions.ConnectionError:
+            response = self.__session.get("progress", request_url)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             return -1
 
         # handle the response
@@ -216,27 +148,82 @@ class ControlNetManager:
         else:
             return response.status_code
 
-    def __init__(self, url_server, callback_dream):
+    def __init__(self, url_server, callback_dream, callback_queue=None, pool_size=DEFAULT_POOL_SIZE, timeouts=None,
+                 stream_response=True, nb_writer_workers=DEFAULT_NB_WRITER_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_running_jobs=1, cache_size=DEFAULT_CACHE_SIZE, gzip_request=False, telemetry=True,
+                 storage_quota=None, storage_max_age=None, image_cache_size=DEFAULT_IMAGE_CACHE_SIZE):
         """
         Constructor
-        :param url_server
-        :param callback_dream
+        :param url_server: url or list of urls of the servers sharing the dreams
+        :param callback_dream: function(seed) called at the end of each dream job
+        :param callback_queue: function() called when the dream queue changes
+        :param pool_size: max number of kept-alive connections to the server
+        :param timeouts: dict endpoint kind -> (connect, read) timeout
+        :param stream_response: whether the dream responses are parsed incrementally
+        :param nb_writer_workers: number of threads decoding and writing the generated images
+        :param chunk_size: max number of images by server call (0 to send each dream in a single call)
+        :param max_running_jobs: number of dream jobs running at the same time
+        :param cache_size: max size in bytes of the cached dream results
+        :param gzip_request: whether the dream requests are compressed (the server must decode gzip bodies)
+        :param telemetry: whether a record of each dream job is appended to ~/style_dreamer/telemetry.jsonl
+        :param storage_quota: max size in bytes of the generated images, the least recently used dreams are removed
+        after each job (None for no cleanup)
+        :param storage_max_age: max age in seconds of the dreams since their last use (None for no limit)
+        :param image_cache_size: max size in bytes of the last generated images kept in memory for the visualizer
+        (0 to always read them from the disk)
         """
         self.__datas = []
-        self.__url_server = url_server
+        self.__session = SDSession(pool_size, timeouts)
+        self.__backend_pool = BackendPool(url_server, self.__session)
+        self.__url_server = self.__backend_pool.get_main_url()
+        # The images just generated are displayed from the memory
+        self.__image_cache = ImageBytesCache(image_cache_size)
+        self.__writer_pool = ImageWriterPool(nb_writer_workers, image_cache=self.__image_cache)
+        self.__dream_client = DreamClient(self.__session, self.__writer_pool, stream_response, gzip_request)
+        self.__chunk_size = chunk_size
         self.__callback_dream = callback_dream
+        self.__callback_queue = callback_queue
         self.__output_dir = os.path.expanduser("~") + "/style_dreamer"
         self.__render_dir = os.path.join(self.__output_dir, "renders")
-        self.__requesting_dream = False
-        self.__launch_timestamp = None
-        self.__job_timestamp = None
+        self.__snapshot_dir = os.path.join(self.__output_dir, SNAPSHOTS_DIRNAME)
+        self.__result_cache = ResultCache(os.path.join(self.__output_dir, "cache"), cache_size)
+        self.__output_store = OutputStore(os.path.join(self.__output_dir, OUTPUTS_DIRNAME))
+        self.__storage_manager = StorageManager(self.__output_dir, storage_quota, storage_max_age,
+                                                self.__output_store) if storage_quota is not None else None
+        self.__running_job_dirs = set()
+        self.__running_job_dirs_lock = threading.Lock()
+        # The finished jobs are indexed after their slot in the queue is freed
+        self.__record_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="style_dreamer_record")
+        self.__telemetry_log = TelemetryLog(os.path.join(self.__output_dir, TELEMETRY_FILENAME)) \
+            if telemetry else None
         self.__created_objects = []
-        self.__controlnet_img = {}
+        self.__control_maps = {}
         self.__outputs = []
-        self.__style_visualizer = StyleVisualizer(self)
+        self.__displayed_job = None
+        # Start of the last render, written in the trace of the next dream
+        self.__render_trace_start = None
+        # Sweeps : job id -> (grid window, row, column)
+        self.__sweep_cells = {}
+        self.__sweep_windows = []
+        # Thumbnails of the strips of the visualizer, kept on the disk between the sessions
+        self.__thumbnail_cache = ThumbnailCache(os.path.join(self.__output_dir, THUMBNAILS_DIRNAME),
+                                                image_cache=self.__image_cache)
+        self.__style_visualizer = StyleVisualizer(self, self.__image_cache, self.__thumbnail_cache)
+        self.__request_job_start_callback = CallbackThread(self.__on_request_job_started)
         self.__request_dream_callback = CallbackThread(self.__on_request_dream_finished)
+        self.__request_chunk_callback = CallbackThread(self.__on_request_chunk_finished)
         self.__request_eta_callback = CallbackThread(self.__on_request_eta_finished)
-        self.__request_eta_run = CallbackThread(self.__run_observer_eta)
+        self.__queue_changed_callback = CallbackThread(self.__on_queue_changed)
+        self.__dream_queue = DreamQueue(self.__run_dream_job, max_running_jobs,
+                                        self.__queue_changed_callback.run_callback,
+                                        self.__request_dream_callback.run_callback)
+
+    def get_url_server(self):
+        """
+        Getter of the url of the main server
+        :return: url server
+        """
+        return self.__url_server
 
     def get_render_dir(self):
         """
@@ -264,12 +251,37 @@ class ControlNetManager:
         pm.setAttr("defaultRenderGlobals.periodInExt", 1)
         pm.setAttr("defaultRenderGlobals.putFrameBeforeExt", True)
 
+    def set_stream_response(self, stream_response):
+        """
+        Setter of whether the dream responses are parsed incrementally (low memory) or all at once
+        :param stream_response
+        :return:
+        """
+        self.__dream_client.set_stream_response(stream_response)
+
+    def set_gzip_request(self, gzip_request):
+        """
+        Setter of whether the dream requests are compressed, only for servers decoding gzip bodies
+        (behind a proxy for instance)
+        :param gzip_request
+        :return:
+        """
+        self.__dream_client.set_gzip_request(gzip_request)
+
+    def set_chunk_size(self, chunk_size):
+        """
+        Setter of the max number of images by server call (0 to send each dream in a single call)
+        :param chunk_size
+        :return:
+        """
+        self.__chunk_size = chunk_size
+
     def is_requesting_dream(self):
         """
         Getter of whether a request is pending
         :return: is requesting dream
         """
-        return self.__requesting_dream
+        return self.__dream_queue.is_running()
 
     def __delete_created_objects(self):
         """
@@ -383,151 +395,6 @@ class ControlNetManager:
         pm.connectAttr(contour_filter + ".message", aov_node_name + '.outputs[0].filter', f=True)
         sde_toon_shader_node.outColor >> node_aov.defaultValue
 
-    def __params_txt2img(self):
-        """
-        Get the txt2img parameters
-        :return: txt2img parameters
-        """
-        return {
-            "enable_hr": False,
-            "firstphase_width": 0,
-            "firstphase_height": 0,
-        }
-
-    def __params_img2img(self):
-        """
-        Get the img2img parameters
-        :return: img2img parameters
-        """
-        return {
-            "denoising_strength": self.__datas["denoising_strength"],
-            "init_images": [
-                self.__controlnet_img[BEAUTY_NAME][1]
-            ],
-            "resize_mode": 0,
-        }
-
-    def __get_request_url(self):
-        """
-        Get the correct URL for the dream request
-        :return: request url
-        """
-        if self.__datas["denoising_strength"] < 1.0:
-            return self.__url_server + "/sdapi/v1/img2img"
-        else:
-            return self.__url_server + "/sdapi/v1/txt2img"
-
-    def __generate_params(self):
-        """
-        Generate the params dict
-        :return:
-        """
-        # COMMON PARAMETERS
-        params = {
-            "prompt": self.__datas["prompt"],
-            "styles": [],
-            "seed": self.__datas["seed"],
-            "subseed": -1,
-            "subseed_strength": 0,
-            "seed_resize_from_h": -1,
-            "seed_resize_from_w": -1,
-            "sampler_name": "Euler",
-            "batch_size": self.__datas["batch_size"],
-            "n_iter": self.__datas["batch_count"],
-            "steps": self.__datas["sampling_steps"],
-            "cfg_scale": self.__datas["cfg_scale"],
-            "width": self.__datas["width"],
-            "height": self.__datas["height"],
-            "restore_faces": False,
-            "tiling": False,
-            "do_not_save_samples": False,
-            "do_not_save_grid": False,
-            "negative_prompt": self.__datas["negative_prompt"],
-            "eta": 0,
-            "s_churn": 0,
-            "s_tmax": 0,
-            "s_tmin": 0,
-            "s_noise": 1,
-            "override_settings": {},
-            "override_settings_restore_afterwards": True,
-            "script_args": [],
-            "sampler_index": "DDIM",
-            "script_name": "",
-            "send_images": True,
-            "save_images": False,
-            "include_init_images": False,
-            "alwayson_scripts": {"controlnet": {"args": []}},
-        }
-
-        # SPECIAL PARAMETERS
-        if self.__datas["denoising_strength"] < 1.0:
-            params.update(self.__params_img2img())
-        else:
-            params.update(self.__params_txt2img())
-
-        # CONTROLNET PARAMETERS
-
-        if self.__datas["weight_depth"] > 0:
-            params["alwayson_scripts"]["controlnet"]["args"].append(
-                {
-                    "input_image": self.__controlnet_img[DEPTH_NAME][1],
-                    "mask": "",
-                    "module": "none",
-                    "model": "control_v11f1p_sd15_depth",
-                    "weight": self.__datas["weight_depth"],
-                    "resize_mode": 0,
-                    "lowvram": False,
-                    "processor_res": 64,
-                    "threshold_a": 64,
-                    "threshold_b": 64,
-                    "guidance": 1,
-                    "guidance_start": 0,
-                    "guidance_end": 1,
-                    "guessmode": False,
-                    "rgbbgr_mode": False
-                })
-
-        if self.__datas["weight_normal"] > 0:
-            params["alwayson_scripts"]["controlnet"]["args"].append(
-                {
-                    "input_image": self.__controlnet_img[NORMAL_NAME][1],
-                    "mask": "",
-                    "module": "none",
-                    "model": "control_v11p_sd15_normalbae",
-                    "weight": self.__datas["weight_normal"],
-                    "resize_mode": 0,
-                    "lowvram": False,
-                    "processor_res": 64,
-                    "threshold_a": 64,
-                    "threshold_b": 64,
-                    "guidance": 1,
-                    "guidance_start": 0,
-                    "guidance_end": 1,
-                    "guessmode": False,
-                    "rgbbgr_mode": True
-                })
-
-        if self.__datas["weight_edges"] > 0:
-            params["alwayson_scripts"]["controlnet"]["args"].append(
-                {
-                    "input_image": self.__controlnet_img[EDGES_NAME][1],
-                    "mask": "",
-                    "module": "none",
-                    "model": "control_v11p_sd15_canny",
-                    "weight": self.__datas["weight_edges"],
-                    "resize_mode": 0,
-                    "lowvram": False,
-                    "processor_res": 64,
-                    "threshold_a": 64,
-                    "threshold_b": 64,
-                    "guidance": 1,
-                    "guidance_start": 0,
-                    "guidance_end": 1,
-                    "guessmode": False,
-                    "rgbbgr_mode": False
-                })
-        return params
-
     def set_datas(self, datas):
         """
         Setter of the datas
@@ -536,6 +403,7 @@ class ControlNetManager:
         """
         self.__datas = datas
 
+    @traced("prepare render", "maya")
     def prepare_cn_render(self):
         """
         Prepare for a render
@@ -557,7 +425,19 @@ class ControlNetManager:
         :return:
         """
         self.__style_visualizer.close()
+        self.__style_visualizer.release()
         self.__style_visualizer.deleteLater()
+        for window in self.__sweep_windows:
+            window.release()
+        self.__session.log_stats()
+        self.__session.close()
+        self.__writer_pool.shutdown()
+        self.__record_executor.shutdown(wait=True)
+        self.__result_cache.flush()
+        self.__image_cache.clear()
+        self.__thumbnail_cache.clear_memory()
+        for control_map in self.__control_maps.values():
+            control_map.release()
 
     def __retrieve_render(self, render_name, render_filename):
         """
@@ -567,16 +447,19 @@ class ControlNetManager:
         :return:
         """
         path = os.path.join(self.__render_dir, render_filename)
-        if os.path.exists(path):
-            with open(path, "rb") as file:
-                self.__controlnet_img[render_name] = (path, base64.b64encode(file.read()).decode())
+        if not os.path.exists(path):
+            self.__control_maps.pop(render_name, None)
+        elif render_name in self.__control_maps:
+            # The map is copied again only when a dream uses it
+            self.__control_maps[render_name].release_if_changed()
+        else:
+            self.__control_maps[render_name] = ControlMap(path, self.__snapshot_dir)
 
     def retrieve_renders(self):
         """
         Retrieve existing renders
         :return:
         """
-        self.__controlnet_img.clear()
         self.__retrieve_render(BEAUTY_NAME, "beauty_1.png")
         self.__retrieve_render(DEPTH_NAME, DEPTH_NAME + ".png")
         self.__retrieve_render(NORMAL_NAME, NORMAL_NAME + ".png")
@@ -587,10 +470,14 @@ class ControlNetManager:
         Generate ControlNet Render with AOV created
         :return:
         """
-        pm.mel.eval("arnoldRender -seq 1")
-        self.retrieve_renders()
+        self.__render_trace_start = get_trace_start()
+        with trace_span("arnold render", "maya"):
+            pm.mel.eval("arnoldRender -seq 1")
+        with trace_span("retrieve renders", "maya"):
+            self.retrieve_renders()
         self.__delete_created_objects()
 
+    @traced("display render", "visualizer")
     def display_render(self, reinit_output_files=True, show = True):
         """
         Display the Visualizer
@@ -600,23 +487,23 @@ class ControlNetManager:
         """
         used_input_filepaths = []
         input_files_and_names = []
-        if BEAUTY_NAME in self.__controlnet_img:
-            beauty_file = self.__controlnet_img[BEAUTY_NAME][0]
+        if BEAUTY_NAME in self.__control_maps:
+            beauty_file = self.__control_maps[BEAUTY_NAME].get_path()
             input_files_and_names.append(("Beauty", beauty_file))
             if self.__datas["denoising_strength"] < 1:
                 used_input_filepaths.append(beauty_file)
-        if DEPTH_NAME in self.__controlnet_img:
-            depth_file = self.__controlnet_img[DEPTH_NAME][0]
+        if DEPTH_NAME in self.__control_maps:
+            depth_file = self.__control_maps[DEPTH_NAME].get_path()
             input_files_and_names.append(("Depth Map", depth_file))
             if self.__datas["weight_depth"] > 0:
                 used_input_filepaths.append(depth_file)
-        if NORMAL_NAME in self.__controlnet_img:
-            normal_file = self.__controlnet_img[NORMAL_NAME][0]
+        if NORMAL_NAME in self.__control_maps:
+            normal_file = self.__control_maps[NORMAL_NAME].get_path()
             input_files_and_names.append(("Normal Map", normal_file))
             if self.__datas["weight_normal"] > 0:
                 used_input_filepaths.append(normal_file)
-        if EDGES_NAME in self.__controlnet_img:
-            edges_file = self.__controlnet_img[EDGES_NAME][0]
+        if EDGES_NAME in self.__control_maps:
+            edges_file = self.__control_maps[EDGES_NAME].get_path()
             input_files_and_names.append(("Edge Map", edges_file))
             if self.__datas["weight_edges"] > 0:
                 used_input_filepaths.append(edges_file)
@@ -627,102 +514,604 @@ class ControlNetManager:
             self.__style_visualizer.set_output_files([])
         self.__style_visualizer.refresh_input_files()
         self.__style_visualizer.refresh_output_files()
-        if not self.__style_visualizer.isVisible() and show:
+        if show:
+            if not self.__style_visualizer.isVisible():
+                self.__style_visualizer.show()
+            self.__style_visualizer.set_focus_input()
+
+    def __on_queue_changed(self):
+        """
+        Callback Dream queue changed
+        :return:
+        """
+        if self.__callback_queue is not None:
+            self.__callback_queue()
+
+    def __on_request_job_started(self, job):
+        """
+        Callback Dream job start, display its progress and its images in the visualizer
+        :param job
+        :return:
+        """
+        if job.get_id() in self.__sweep_cells:
+            grid_window, cells = self.__sweep_cells[job.get_id()]
+            for row, column, _, _ in cells:
+                grid_window.set_cell_status(row, column, "Dream #%d running" % job.get_id())
+        self.__displayed_job = job
+        self.__outputs = []
+        self.__style_visualizer.set_output_files([])
+        self.__style_visualizer.refresh_output_files()
+        self.__style_visualizer.set_eta(0)
+        self.__style_visualizer.refresh_progress_bar()
+
+    def __on_request_chunk_finished(self, job, output_filepaths):
+        """
+        Callback Dream chunk end, add the new images to the visualizer
+        :param job
+        :param output_filepaths
+        :return:
+        """
+        if job is not self.__displayed_job:
+            return
+        if job.get_id() in self.__sweep_cells:
+            grid_window, cells = self.__sweep_cells[job.get_id()]
+            received_filepaths = self.__outputs + list(output_filepaths)
+            for row, column, cell_filepaths in get_sweep_cells_files(job, cells, received_filepaths):
+                grid_window.set_cell_files(row, column, cell_filepaths, "Dream #%d running" % job.get_id())
+        first_chunk = len(self.__outputs) == 0
+        self.__outputs.extend(output_filepaths)
+        self.__style_visualizer.set_output_files(list(self.__outputs))
+        self.__style_visualizer.refresh_output_files()
+        if not self.__style_visualizer.isVisible():
             self.__style_visualizer.show()
-        self.__style_visualizer.set_focus_input()
+        if first_chunk:
+            self.__style_visualizer.set_focus_output()
 
-    def __on_request_dream_finished(self, output_filepaths, seed, error_msg):
+    def __on_request_dream_finished(self, job):
         """
         Callback Dream Request end, display the visualizer
-        :param output_filepaths
-        :param seed
-        :param error_msg
+        :param job
         :return:
         """
-        self.__requesting_dream = False
-        self.__job_timestamp = None
-        if output_filepaths is None:
-            self.__style_visualizer.set_eta(0)
+        output_filepaths = job.get_output_filepaths()
+        error_msg = job.get_error_msg()
+        displayed = job is self.__displayed_job
+        if displayed:
+            self.__style_visualizer.set_eta(0 if len(output_filepaths) == 0 else 100)
+        sweep_cell = self.__sweep_cells.pop(job.get_id(), None)
+        if sweep_cell is not None:
+            # The errors of a sweep are displayed in its grid
+            grid_window, cells = sweep_cell
+            for row, column, cell_filepaths in get_sweep_cells_files(job, cells, output_filepaths):
+                grid_window.set_cell_files(row, column, cell_filepaths, error_msg or job.get_label())
+        elif error_msg is not None:
             msg = QMessageBox()
             msg.setWindowTitle("Error while requesting server")
             msg.setIcon(QMessageBox.Warning)
             msg.setText(error_msg)
+            msg.setInformativeText("Dream #%d : %s" % (job.get_id(), job.get_label()))
             msg.exec_()
-        else:
-            self.__style_visualizer.set_output_files(output_filepaths)
-            self.__style_visualizer.set_eta(100)
-            self.__style_visualizer.refresh_input_files()
-            self.__style_visualizer.refresh_output_files()
-            if not self.__style_visualizer.isVisible():
-                self.__style_visualizer.show()
-            self.__style_visualizer.set_focus_output()
+        if displayed and len(output_filepaths) > 0:
+            with trace_span("display images", "visualizer", dream=job.get_id(), nb_images=len(output_filepaths)):
+                self.__outputs = list(output_filepaths)
+                self.__style_visualizer.set_output_files(output_filepaths)
+                self.__style_visualizer.refresh_input_files()
+                self.__style_visualizer.refresh_output_files()
+                if not self.__style_visualizer.isVisible():
+                    self.__style_visualizer.show()
+                self.__style_visualizer.set_focus_output()
         self.__style_visualizer.refresh_progress_bar()
-        self.__callback_dream(seed)
+        if is_tracing_enabled():
+            self.__write_trace(job)
+        self.__callback_dream(job.get_seed())
+
+    def __write_trace(self, job):
+        """
+        Write the trace of a dream job next to its images
+        :param job
+        :return:
+        """
+        output_filepaths = job.get_output_filepaths()
+        trace_dir = os.path.dirname(output_filepaths[0]) if len(output_filepaths) > 0 else self.__output_dir
+        trace_filepath = os.path.join(trace_dir, time.strftime("trace_%d%m%Y_%H%M%S") + "_%d.json" % job.get_id())
+        write_trace(trace_filepath, job.get_trace_start(), job.get_id())
 
-    def __on_request_eta_finished(self, response_dict):
+    def __on_request_eta_finished(self, job, response_dict):
         """
         Callback ETA request, display on the visualizer
+        :param job
         :param response_dict
         :return:
         """
-        renew_eta_request = True
-        if type(response_dict) is int:
-            if not self.__requesting_dream:
-                renew_eta_request = False
-        else:
-            job_str_timestamp = response_dict["state"]["job_timestamp"]
-            if job_str_timestamp != "0":
-                job_timestamp = int(time.mktime(datetime.datetime.strptime(job_str_timestamp, "%Y%m%d%H%M%S").timetuple()))
-                # Check TimeStamp to take the eta from the correct job
-                if self.__launch_timestamp is not None and job_timestamp >= self.__launch_timestamp:
-                    self.__job_timestamp = job_timestamp
-                    self.__launch_timestamp = None
-                if self.__job_timestamp == job_timestamp:
-                    eta = response_dict["progress"] * 100
-                    if self.__requesting_dream and eta >= self.__style_visualizer.get_eta():
-                        self.__style_visualizer.set_eta(99 if eta == 100 else eta)
-                        self.__style_visualizer.refresh_progress_bar()
-                    else: renew_eta_request = False
-        if renew_eta_request:
-            threading.Thread(target=self.__request_eta).start()
-
-    def __run_observer_eta(self):
-        """
-        Run the process  observing the ETA requests
-        :return:
-        """
-        self.__launch_timestamp = int(time.time())
-        self.__job_timestamp = None
-        self.__style_visualizer.set_eta(0)
-        self.__style_visualizer.refresh_progress_bar()
-        self.__request_eta()
+        if job is not self.__displayed_job or job.is_cancel_requested():
+            return
+        job_timestamp = _get_server_job_timestamp(response_dict)
+        if job_timestamp is None:
+            return
+        # Check TimeStamp to take the eta from the correct job : the chunks in flight on the main server start one
+        # after the other
+        previous_job_timestamp = job.get_server_job_timestamp()
+        if job.track_server_job(self.__url_server, job_timestamp):
+            if job_timestamp != previous_job_timestamp:
+                add_trace_instant("server job started", "dream", {"dream": job.get_id()})
+            # Progress of the whole dream from the progress of the current chunk
+            progress = job.get_nb_done_images() + response_dict["progress"] * job.get_nb_chunk_images()
+            eta = progress / max(job.get_nb_images(), 1) * 100
+            if eta >= self.__style_visualizer.get_eta():
+                self.__style_visualizer.set_eta(min(eta, 99))
+                self.__style_visualizer.refresh_progress_bar()
+
+    def __request_interrupt_api(self, url_server):
+        """
+        Ask a server to interrupt and skip its current generation
+        :param url_server
+        :return: succeeded
+        """
+        succeeded = True
+        for endpoint in ("/sdapi/v1/interrupt", "/sdapi/v1/skip"):
+            try:
+                response = self.__session.post("interrupt", url_server + endpoint)
+                succeeded = succeeded and response.status_code == 200
+            except requests.exceptions.RequestException:
+                succeeded = False
+        return succeeded
+
+    def request_interrupt(self):
+        """
+        Ask the servers to interrupt the current generation
+        :return: succeeded
+        """
+        succeeded = True
+        for backend in self.__backend_pool.get_backends():
+            succeeded = self.__request_interrupt_api(backend.get_url()) and succeeded
+        return succeeded
+
+    def __interrupt_job(self, job):
+        """
+        Interrupt the servers generating the chunks of a cancelled job until they all returned (a chunk queued on
+        a server starts after the interruption of the previous one so it has to be interrupted too). A server is
+        only interrupted while its current job is a chunk of the cancelled job, not once it started another one
+        :param job
+        :return:
+        """
+        start = time.time()
+        while time.time() - start < _INTERRUPT_TIMEOUT:
+            urls = job.get_running_chunk_urls()
+            if len(urls) == 0:
+                break
+            for url in urls:
+                job_timestamp = _get_server_job_timestamp(self.__request_eta_api(url + "/sdapi/v1/progress"))
+                if job_timestamp is not None and job.identify_server_job(url, job_timestamp) is not None:
+                    self.__request_interrupt_api(url)
+            time.sleep(_INTERRUPT_INTERVAL)
+
+    def request_controlnet_models(self):
+        """
+        Request the list of ControlNet models available on the server
+        :return: list of model names (None if the server couldn't be reached)
+        """
+        try:
+            response = self.__session.get("model_list", self.__url_server + "/controlnet/model_list")
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        try:
+            return response.json()["model_list"]
+        except (ValueError, KeyError):
+            return None
+
+    def get_backend_stats(self):
+        """
+        Getter of the throughput statistics of each server
+        :return: list of backend stats
+        """
+        return self.__backend_pool.get_stats()
+
+    def get_session_stats(self):
+        """
+        Getter of the HTTP session statistics (connection reuse counts)
+        :return: session stats
+        """
+        return self.__session.get_stats()
+
+    def get_storage_report(self, dry_run=True):
+        """
+        Clean up the generated images above the storage quota
+        :param dry_run: only report what would be removed
+        :return: report (see StorageManager.cleanup), None if there is no quota
+        """
+        if self.__storage_manager is None:
+            return None
+        return self.__storage_manager.cleanup(dry_run, self.__get_protected_paths())
+
+    def __get_running_job_dirs(self):
+        """
+        Getter of the folders of the running dreams, kept by the storage cleanups
+        :return: list of job dirs
+        """
+        with self.__running_job_dirs_lock:
+            return list(self.__running_job_dirs)
+
+    def __get_protected_paths(self):
+        """
+        Getter of what the storage cleanups keep : the folders of the running dreams and the snapshots of the queued
+        dreams and of the frozen control maps
+        :return: list of paths
+        """
+        protected_paths = set(self.__get_running_job_dirs())
+        for job in self.__dream_queue.get_jobs():
+            protected_paths |= get_snapshot_paths(job.get_params())
+        for control_map in list(self.__control_maps.values()):
+            snapshot_path = control_map.get_snapshot_path()
+            if snapshot_path is not None:
+                protected_paths.add(snapshot_path)
+        return list(protected_paths)
+
+    def __get_output_job_dir(self, output_filepath):
+        """
+        Get the dream folder of a generated image
+        :param output_filepath
+        :return: job dir or None if the image isn't in a dream folder
+        """
+        job_dir = os.path.dirname(os.path.abspath(output_filepath))
+        if os.path.dirname(job_dir) != os.path.abspath(self.__output_store.get_root_dir()):
+            return None
+        return job_dir
+
+    def is_output_pinned(self, output_filepath):
+        """
+        Getter of whether the dream of a generated image is pinned (never removed by the storage quota)
+        :param output_filepath
+        :return: is pinned
+        """
+        job_dir = self.__get_output_job_dir(output_filepath)
+        return job_dir is not None and is_pinned(job_dir)
+
+    def set_output_pinned(self, output_filepath, pinned):
+        """
+        Pin or unpin the dream of a generated image
+        :param output_filepath
+        :param pinned
+        :return: whether the dream could be pinned
+        """
+        job_dir = self.__get_output_job_dir(output_filepath)
+        if job_dir is None:
+            return False
+        set_pinned(job_dir, pinned)
+        return True
 
-    def request_controlnet(self):
+    def mark_output_used(self, output_filepath):
         """
-        Launch the Controlnet Stable Diffusion Request
+        Mark the dream of a generated image as used now, the least recently used dreams are removed first by the
+        storage quota (indexed on the record thread)
+        :param output_filepath
         :return:
         """
-        self.__requesting_dream = True
+        job_dir = self.__get_output_job_dir(output_filepath)
+        if job_dir is not None:
+            self.__record_executor.submit(self.__output_store.mark_job_used, job_dir)
+
+    def get_cache_stats(self):
+        """
+        Getter of the result cache statistics (hits and misses)
+        :return: cache stats
+        """
+        return self.__result_cache.get_stats()
+
+    def __request_chunks(self, job, job_dir, requests_stats):
+        """
+        Request the dream in several calls of bounded size shared between the servers, each chunk is displayed
+        as soon as it is received. The seed of each chunk follows the previous ones so the images are the same
+        as with a single call. With a fixed seed, the chunks already generated are taken from the result cache
+        :param job
+        :param job_dir: folder of the images of the job
+        :param requests_stats: list filled with the stats of each server call
+        :return: output filepaths, seed, message, number of images taken from the cache
+        """
+        params = job.get_params()
+        request_path = job.get_request_path()
+        all_output_filepaths = get_output_filepaths(job_dir, job.get_nb_images())
+        job.set_planned_filepaths(all_output_filepaths)
+        seed, dream_chunks = plan_dream_chunks(params, all_output_filepaths, self.__chunk_size)
+
+        # With a fixed seed the images only depend on the request, the cached chunks are not sent
+        use_cache = params["seed"] != -1
+        cache_keys = [make_cache_key({"path": request_path, "params": chunk_params})
+                      for chunk_params, _ in dream_chunks] if use_cache else [None] * len(dream_chunks)
+        cached_results = [None] * len(dream_chunks)
+        if use_cache:
+            with trace_span("cache lookup", "dream", nb_chunks=len(dream_chunks)):
+                for index, (_, chunk_filepaths) in enumerate(dream_chunks):
+                    cached_results[index] = self.__result_cache.get(cache_keys[index], chunk_filepaths)
+                    if cached_results[index] is not None:
+                        job.add_done_images(len(chunk_filepaths))
+                        if len(dream_chunks) > 1:
+                            self.__request_chunk_callback.run_callback(job, cached_results[index])
+        missing_indexes = [index for index, result in enumerate(cached_results) if result is None]
+        nb_cached_images = sum(len(result) for result in cached_results if result is not None)
+
+        def run_chunk(backend, dream_chunk):
+            chunk_params, chunk_filepaths, cache_key = dream_chunk
+            if job.is_cancel_requested():
+                return [], None
+            # Its progress is tracked once the poller sees its server job start
+            running_chunk = job.add_running_chunk(backend.get_url(), len(chunk_filepaths))
+            try:
+                # A short or failed response keeps its images and doesn't stop the other chunks
+                output_filepaths, error_msg = \
+                    self.__dream_client.request_chunk(chunk_params, backend.get_url() + request_path,
+                                                      chunk_filepaths, requests_stats.append)
+            finally:
+                job.remove_running_chunk(running_chunk)
+            if job.is_cancel_requested():
+                # Keep the images generated before the interruption
+                return output_filepaths, None
+            if error_msg is None and cache_key is not None:
+                with trace_span("cache store", "dream"):
+                    self.__result_cache.put(cache_key, output_filepaths)
+            return output_filepaths, error_msg
+
+        def chunk_done(index, result):
+            output_filepaths = result[0]
+            job.add_done_images(len(output_filepaths))
+            if len(dream_chunks) > 1 and len(output_filepaths) > 0:
+                self.__request_chunk_callback.run_callback(job, output_filepaths)
+
+        missing_chunks = [dream_chunks[index] + (cache_keys[index],) for index in missing_indexes]
+        missing_results, error_msg = self.__backend_pool.run(missing_chunks, run_chunk, chunk_done,
+                                                             lambda dream_chunk: len(dream_chunk[1]),
+                                                             job.get_cancel_event())
+        chunk_results = [(result, None) if result is not None else None for result in cached_results]
+        for index, result in zip(missing_indexes, missing_results):
+            chunk_results[index] = result
+        self.__result_cache.log_stats()
+        output_filepaths, error_msg = merge_chunk_results(chunk_results, error_msg)
+        if error_msg is None:
+            return output_filepaths, seed, "Success", nb_cached_images
+        elif len(output_filepaths) == 0:
+            return None, -1, error_msg, nb_cached_images
+        return output_filepaths, seed, error_msg, nb_cached_images
+
+    def __run_dream_job(self, job):
+        """
+        Run a dream job of the queue (on its worker thread)
+        :param job
+        :return:
+        """
+        if is_tracing_enabled():
+            # The submit time is a wall clock time
+            now = trace_clock()
+            add_trace_span("queue wait", "dream", now - (time.time() - job.get_submit_time()) * 1e6, now,
+                           {"dream": job.get_id()})
+        with trace_dream(job.get_id()):
+            self.__run_dream(job)
+
+    def __run_dream(self, job):
+        """
+        Run a dream job, its events are tagged with its id
+        :param job
+        :return:
+        """
+        self.__request_job_start_callback.run_callback(job)
+        progress_poller = ProgressPoller(partial(self.__request_eta_api, self.__url_server + "/sdapi/v1/progress"),
+                                         partial(self.__request_eta_callback.run_callback, job))
+        progress_poller.start()
+        queue_wait = time.time() - job.get_submit_time()
+        start = time.perf_counter()
+        requests_stats = []
+        job_dir = self.__output_store.create_job_dir(job.get_id())
+        with self.__running_job_dirs_lock:
+            self.__running_job_dirs.add(job_dir)
+        try:
+            with trace_span("dream", "dream", dream=job.get_id(), nb_images=job.get_nb_images()):
+                output_filepaths, seed, error_msg, nb_cached_images = \
+                    self.__request_chunks(job, job_dir, requests_stats)
+        finally:
+            progress_poller.stop()
+        log_peak_memory(sum(stats.get("bytes_sent", 0) for stats in requests_stats))
+        job.set_result(output_filepaths, seed, error_msg)
+        self.__session.log_stats()
+        # The parameters are released with the slot of the job
+        self.__record_executor.submit(bind_trace_dream(self.__record_job), job, job.get_params(), job_dir, queue_wait,
+                                      time.perf_counter() - start, requests_stats, nb_cached_images)
+
+    def __record_job(self, job, params, job_dir, queue_wait, duration, requests_stats, nb_cached_images):
+        """
+        Describe a finished dream job in its folder, in the index of the outputs and in the telemetry, then clean up
+        the storage (on the record thread)
+        :param job
+        :param params: request parameters of the job
+        :param job_dir
+        :param queue_wait
+        :param duration
+        :param requests_stats
+        :param nb_cached_images
+        :return:
+        """
+        try:
+            self.__write_job_record(job, params, job_dir, queue_wait, duration, requests_stats, nb_cached_images)
+        except Exception:
+            _LOGGER.exception("Couldn't record the dream job %d", job.get_id())
+        with self.__running_job_dirs_lock:
+            self.__running_job_dirs.discard(job_dir)
+        if self.__storage_manager is not None:
+            self.__storage_manager.cleanup_in_background(self.__get_protected_paths())
+
+    def __write_job_record(self, job, params, job_dir, queue_wait, duration, requests_stats, nb_cached_images):
+        """
+        Describe a finished dream job in its folder, in the index of the outputs and in the telemetry
+        :param job
+        :param params
+        :param job_dir
+        :param queue_wait
+        :param duration
+        :param requests_stats
+        :param nb_cached_images
+        :return:
+        """
+        nb_images = len(job.get_output_filepaths())
+        if job.is_cancel_requested():
+            outcome = "cancelled"
+        elif job.get_error_msg() is None:
+            outcome = "success"
+        else:
+            outcome = "partial" if nb_images > 0 else "failed"
+        record = make_job_record(job.get_id(), params, job.get_request_path(), queue_wait, duration,
+                                 requests_stats, nb_cached_images, nb_images, outcome, job.get_error_msg())
+        files_digests = {}
+        for stats in requests_stats:
+            files_digests.update(stats.get("files", {}))
+        with trace_span("index outputs", "dream", nb_images=nb_images):
+            self.__output_store.record_job(job_dir, job.get_id(), job.get_label(), job.get_request_path(),
+                                           params, job.get_seed(), job.get_output_filepaths(), record,
+                                           outcome, job.get_error_msg(), files_digests)
+        if self.__telemetry_log is not None:
+            self.__telemetry_log.append(record)
+
+    def queue_dream(self):
+        """
+        Freeze the current datas and control images in a dream job and add it to the queue
+        :return: job
+        """
         os.makedirs(self.__output_dir, exist_ok=True)
-        params = self.__generate_params()
-        request_url = self.__get_request_url()
-        self.__request_eta_run.run_callback()
-        output_filepaths, seed, error_msg = ControlNetManager.__request_controlnet_api(params, request_url, self.__output_dir)
-        self.__request_dream_callback.run_callback(output_filepaths, seed, error_msg)
+        # The maps not sent don't need to stay frozen
+        used_map_names = get_used_map_names(self.__datas)
+        for name, control_map in self.__control_maps.items():
+            if name not in used_map_names:
+                control_map.release()
+        params = generate_params(self.__datas, self.__control_maps)
+        job = self.__dream_queue.submit(params, get_request_path(self.__datas), get_dream_label(params))
+        job.set_trace_start(self.__pop_trace_start())
+        return job
 
-    def __request_eta(self):
+    def __pop_trace_start(self):
+        """
+        Get the start of the trace of a new dream : the last render if it wasn't traced with a dream yet, the
+        action that queued the dream otherwise
+        :return: trace start
         """
-        Run the request for ETA
+        trace_start = get_trace_start()
+        if self.__render_trace_start is not None:
+            trace_start = min(trace_start, self.__render_trace_start)
+            self.__render_trace_start = None
+        return trace_start
+
+    def queue_sweep(self, values_by_field):
+        """
+        Queue the dreams of the combinations of the swept values, ordered so that consecutive server calls change as
+        little as possible, and display their images in a grid as they arrive. The combinations that only differ by
+        their seed and number of images are slices of a single dream
+        :param values_by_field: list of (field, values)
+        :return: jobs
+        """
+        os.makedirs(self.__output_dir, exist_ok=True)
+        combinations = expand_sweep(self.__datas, values_by_field)
+        used_map_names = set(name for combination in combinations
+                             for name in get_used_map_names(get_sweep_datas(self.__datas, combination)))
+        for name, control_map in self.__control_maps.items():
+            if name not in used_map_names:
+                control_map.release()
+
+        column_labels, row_labels, get_cell = get_grid_cells(values_by_field)
+        for window in self.__sweep_windows:
+            if not window.isVisible():
+                window.release()
+        self.__sweep_windows = [window for window in self.__sweep_windows if window.isVisible()]
+        grid_window = SweepGridWindow("Style Dreamer Sweep %d" % (len(self.__sweep_windows) + 1), column_labels,
+                                      row_labels, self.__on_sweep_cell_selected, self.__thumbnail_cache)
+        self.__sweep_windows.append(grid_window)
+        swept_fields = [field for field, _ in values_by_field]
+        trace_start = self.__pop_trace_start()
+        dreams = batch_sweep(self.__datas, combinations)
+        jobs = []
+        for index, (dream_combination, slices) in enumerate(dreams):
+            sweep_datas = get_sweep_datas(self.__datas, dream_combination)
+            params = generate_params(sweep_datas, self.__control_maps)
+            label = "Sweep %d/%d : %s" % (index + 1, len(dreams), get_combination_label(slices[0][0], swept_fields))
+            if len(slices) > 1:
+                label += " (+%d)" % (len(slices) - 1)
+            job = self.__dream_queue.submit(params, get_request_path(sweep_datas), label)
+            job.set_trace_start(trace_start)
+            cells = [get_cell(combination) + (offset, image_count) for combination, offset, image_count in slices]
+            self.__sweep_cells[job.get_id()] = (grid_window, cells)
+            for row, column, _, _ in cells:
+                grid_window.set_cell_status(row, column, "Dream #%d pending" % job.get_id())
+            jobs.append(job)
+        grid_window.show()
+        return jobs
+
+    def __on_sweep_cell_selected(self, output_filepaths):
+        """
+        Callback sweep cell clicked, display its images in the visualizer
+        :param output_filepaths
         :return:
         """
-        request_url = self.__url_server + "/sdapi/v1/progress"
-        response_dict = ControlNetManager.__request_eta_api(request_url)
-        self.__request_eta_callback.run_callback(response_dict)
+        if len(output_filepaths) == 0:
+            return
+        self.__style_visualizer.set_output_files(output_filepaths)
+        self.__style_visualizer.refresh_output_files()
+        if not self.__style_visualizer.isVisible():
+            self.__style_visualizer.show()
+        self.__style_visualizer.set_focus_output()
+
+    def get_dream_jobs(self):
+        """
+        Getter of the running then pending dream jobs
+        :return: jobs
+        """
+        return self.__dream_queue.get_jobs()
+
+    def move_dream_job(self, job_id, offset):
+        """
+        Move a pending dream job in the queue
+        :param job_id
+        :param offset: -1 to run it earlier, 1 to run it later
+        :return: whether the job moved
+        """
+        return self.__dream_queue.move(job_id, offset)
+
+    def cancel_dream_job(self, job_id):
+        """
+        Cancel a dream job : a pending one is removed from the queue, a running one is interrupted on the servers
+        and keeps the images already generated
+        :param job_id
+        :return: whether the job was cancelled
+        """
+        job, previous_status = self.__dream_queue.cancel(job_id)
+        if job is None:
+            return False
+        if previous_status == DreamJobStatus.Pending and job.get_id() in self.__sweep_cells:
+            # Pending job removed from the queue, the running ones end in __on_request_dream_finished
+            grid_window, cells = self.__sweep_cells.pop(job.get_id())
+            for row, column, _, _ in cells:
+                grid_window.set_cell_status(row, column, "Cancelled")
+        if previous_status == DreamJobStatus.Running:
+            # Returns at once if its chunks already returned
+            threading.Thread(target=self.__interrupt_job, args=(job,), daemon=True).start()
+        self.__style_visualizer.refresh_progress_bar()
+        return True
+
+    def cancel_displayed_dream(self):
+        """
+        Cancel the dream job displayed in the visualizer
+        :return: whether the job was cancelled
+        """
+        if self.__displayed_job is None:
+            return False
+        return self.cancel_dream_job(self.__displayed_job.get_id())
+
+    def is_displayed_dream_running(self):
+        """
+        Getter of whether the dream job displayed in the visualizer is running
+        :return: is displayed dream running
+        """
+        return self.__displayed_job is not None and self.__displayed_job.get_status() == DreamJobStatus.Running
 
 
 # Request executed on a distinct thread
 class CallbackThread(QThread):
-    __signal = Signal()
+    __signal = Signal(object)
 
     def __init__(self, callback):
         """
@@ -730,7 +1119,6 @@ class CallbackThread(QThread):
         :param callback:
         """
         super().__init__(None)
-        self.__args = None
         self.__callback_fct = callback
         self.__signal.connect(self.__callback)
 
@@ -739,12 +1127,12 @@ class CallbackThread(QThread):
         Emit the signal
         :return:
         """
-        self.__args = args
-        self.__signal.emit()
+        self.__signal.emit(args)
 
-    def __callback(self):
+    def __callback(self, args):
         """
         Callback function
+        :param args: arguments given to run_callback (passed through the signal so that queued calls keep theirs)
         :return:
         """
-        self.__callback_fct(*self.__args)
+        self.__callback_fct(*args)
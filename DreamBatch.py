@@ -0,0 +1,278 @@
+"""
+Headless dreams, without Maya nor PySide2
+
+Usage : python -m style_dreamer.DreamBatch job_file.json [--server URL] [--output-dir DIR] [--chunk-size N]
+
+Job file :
+{
+    "server": "http://localhost:7860/",          (url or list of urls)
+    "output_dir": "dreams",                       (relative to the job file)
+    "prompt": "...", "width": 768, ...            (defaults of every job)
+    "jobs": [
+        {
+            "name": "shot010",
+            "prompt": "...",
+            "negative_prompt": "...",
+            "seeds": [1, 2, 3],                   (or "seed": 1, -1 for a random seed)
+            "image_count": 4,
+            "sampling_steps": 15,
+            "cfg_scale": 7,
+            "denoising_strength": 1.0,
+            "weight_depth": 1.0,                  (1.0 if its map is given, 0 otherwise by default)
+            "weight_normal": 0.5,
+            "width": 512,
+            "height": 512,
+            "maps": {"beauty": "renders/beauty_1.png", "depth": "...", "normal": "..."}
+        }
+    ]
+}
+A file without "jobs" is a single job. Only the ControlNet units of the given maps are enabled by default. The images of each dream are written in output_dir/<name>_<seed>
+and every dream is described in output_dir/manifest.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from .BackendPool import BackendPool
+from .ControlMap import ControlMap
+from .DreamClient import DreamClient
+from .DreamParams import *
+from .DreamPlanner import DEFAULT_CHUNK_SIZE, MAX_SEED, get_batch_param, get_output_filepaths, merge_chunk_results, \
+    plan_dream_chunks
+from .ImageWriter import ImageWriterPool, write_file_atomic
+from .SDSession import SDSession
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SERVER = "http://localhost:7860/"
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Same defaults as the Style Dreamer window, except the ControlNet units that are disabled
+DEFAULT_DATAS = {
+    "prompt": "",
+    "negative_prompt": "",
+    "seed": -1,
+    "image_count": 1,
+    "sampling_steps": 15,
+    "cfg_scale": 7,
+    "denoising_strength": 1.0,
+    "weight_depth": 0.0,
+    "weight_normal": 0.0,
+    "weight_edges": 0.0,
+    "width": 512,
+    "height": 512,
+}
+
+# Keys of the maps in the job file
+_MAP_NAMES = {
+    "beauty": BEAUTY_NAME,
+    "depth": DEPTH_NAME,
+    "normal": NORMAL_NAME,
+    "edges": EDGES_NAME,
+}
+
+# Weight of a ControlNet unit whose map is given in the job file
+DEFAULT_MAP_WEIGHT = 1.0
+# Weight of each map
+_MAP_WEIGHTS = {
+    DEPTH_NAME: "weight_depth",
+    NORMAL_NAME: "weight_normal",
+    EDGES_NAME: "weight_edges",
+}
+
+# Keys of the job file that aren't dream datas
+_JOB_FILE_KEYS = ("server", "output_dir", "jobs")
+
+
+def load_dreams(job_file_path):
+    """
+    Read a job file and expand its jobs in one dream by seed
+    :param job_file_path
+    :return: job file dict, list of (name, datas, map paths)
+    """
+    with open(job_file_path, "r") as file:
+        job_file = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(job_file_path))
+    defaults = {key: value for key, value in job_file.items() if key not in _JOB_FILE_KEYS}
+    jobs = job_file.get("jobs", [{}])
+
+    dreams = []
+    for index, job in enumerate(jobs):
+        job = dict(defaults, **job)
+        # The units of the given maps are enabled unless their weight is set
+        for key in job.get("maps", {}):
+            weight_name = _MAP_WEIGHTS.get(_MAP_NAMES.get(key))
+            if weight_name is not None:
+                job.setdefault(weight_name, DEFAULT_MAP_WEIGHT)
+        job = dict(DEFAULT_DATAS, **job)
+        name = job.pop("name", "job_%d" % (index + 1))
+        seeds = job.pop("seeds", [job["seed"]])
+        maps = job.pop("maps", {})
+        unknown_maps = [key for key in maps if key not in _MAP_NAMES]
+        if len(unknown_maps) > 0:
+            raise ValueError("Unknown maps in job %s : %s" % (name, ", ".join(unknown_maps)))
+        map_paths = {_MAP_NAMES[key]: os.path.join(base_dir, path) for key, path in maps.items()}
+        if "batch_count" not in job or "batch_size" not in job:
+            job["batch_count"], job["batch_size"] = get_batch_param(job["image_count"])
+        for seed in seeds:
+            dreams.append((name, dict(job, seed=seed), map_paths))
+    return job_file, dreams
+
+
+class DreamBatch:
+    def __init__(self, url_server, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, stream_response=True,
+                 gzip_request=False, optimize_maps=True, stats_callback=None):
+        """
+        Constructor
+        :param url_server: url or list of urls of the servers
+        :param output_dir
+        :param chunk_size: max number of images by server call
+        :param stream_response: whether the dream responses are parsed incrementally
+        :param gzip_request: whether the dream requests are compressed
+        :param optimize_maps: whether the control maps are re-encoded in the smallest lossless PNG
+        :param stats_callback: function(stats) called after each server call with its sizes and timings
+        """
+        self.__output_dir = output_dir
+        self.__chunk_size = chunk_size
+        self.__optimize_maps = optimize_maps
+        self.__session = SDSession()
+        self.__backend_pool = BackendPool(url_server, self.__session)
+        self.__writer_pool = ImageWriterPool()
+        self.__dream_client = DreamClient(self.__session, self.__writer_pool, stream_response, gzip_request,
+                                          stats_callback)
+
+    def close(self):
+        """
+        Close the session and the writer threads
+        :return:
+        """
+        self.__session.log_stats()
+        self.__session.close()
+        self.__writer_pool.shutdown()
+
+    def run_dream(self, name, datas, map_paths):
+        """
+        Run a dream with the same payload and the same chunks as in Maya
+        :param name
+        :param datas
+        :param map_paths: dict map name -> path
+        :return: manifest entry
+        """
+        start_time = time.perf_counter()
+        entry = {
+            "name": name,
+            "datas": datas,
+            "maps": {key: map_paths[map_name] for key, map_name in _MAP_NAMES.items() if map_name in map_paths},
+            "request_path": get_request_path(datas),
+            "seed": -1,
+            "images": [],
+            "error": None,
+        }
+        missing_maps = [key for key, map_name in _MAP_NAMES.items() if map_name in get_used_map_names(datas)
+                        and (map_name not in map_paths or not os.path.isfile(map_paths[map_name]))]
+        if len(missing_maps) > 0:
+            entry["error"] = "Missing control maps : " + ", ".join(missing_maps)
+            return entry
+
+        snapshot_dir = os.path.join(self.__output_dir, ".snapshots")
+        control_maps = {map_name: ControlMap(path, snapshot_dir, self.__optimize_maps)
+                        for map_name, path in map_paths.items()}
+        if datas["seed"] == -1:
+            # The random seed is drawn here to name the folder of the images
+            datas = dict(datas, seed=random.randrange(MAX_SEED))
+            entry["datas"] = datas
+        params = generate_params(datas, control_maps)
+        nb_images = int(params["batch_size"]) * int(params["n_iter"])
+        dream_dir = os.path.join(self.__output_dir, "%s_%d" % (name, datas["seed"]))
+        os.makedirs(dream_dir, exist_ok=True)
+        seed, dream_chunks = plan_dream_chunks(params, get_output_filepaths(dream_dir, nb_images),
+                                               self.__chunk_size)
+
+        def run_chunk(backend, dream_chunk):
+            chunk_params, chunk_filepaths = dream_chunk
+            # A short or failed response keeps its images and doesn't stop the other chunks
+            return self.__dream_client.request_chunk(chunk_params, backend.get_url() + entry["request_path"],
+                                                     chunk_filepaths)
+
+        results, error_msg = self.__backend_pool.run(dream_chunks, run_chunk,
+                                                     chunk_weight=lambda dream_chunk: len(dream_chunk[1]))
+        output_filepaths, error_msg = merge_chunk_results(results, error_msg)
+        entry["seed"] = seed
+        entry["images"] = [os.path.relpath(path, self.__output_dir) for path in output_filepaths]
+        entry["error"] = error_msg
+        entry["duration"] = time.perf_counter() - start_time
+        return entry
+
+    def run(self, dreams):
+        """
+        Run the dreams one after another and write the manifest after each one
+        :param dreams: list of (name, datas, map paths)
+        :return: manifest
+        """
+        manifest = {
+            "created": datetime.datetime.now().isoformat(),
+            "servers": [backend.get_url() for backend in self.__backend_pool.get_backends()],
+            "dreams": [],
+        }
+        for index, (name, datas, map_paths) in enumerate(dreams):
+            _LOGGER.info("Dream %d/%d : %s (seed %s)", index + 1, len(dreams), name, datas["seed"])
+            entry = self.run_dream(name, datas, map_paths)
+            if entry["error"] is not None:
+                _LOGGER.error("Dream %s failed : %s", name, entry["error"])
+            manifest["dreams"].append(entry)
+            write_file_atomic(os.path.join(self.__output_dir, MANIFEST_FILENAME),
+                              json.dumps(manifest, indent=4).encode())
+        return manifest
+
+
+def main(argv=None):
+    """
+    Run the dreams of a job file
+    :param argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Run Style Dreamer dreams without Maya")
+    parser.add_argument("job_file", help="JSON job file")
+    parser.add_argument("--server", action="append", help="url of a server (repeat it to share the dreams)")
+    parser.add_argument("--output-dir", help="folder of the images and of the manifest")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="max number of images by server call (0 for a single call)")
+    parser.add_argument("--no-stream", action="store_true", help="parse the responses all at once")
+    parser.add_argument("--gzip", action="store_true", help="compress the requests (the server must decode them)")
+    parser.add_argument("--no-optimize", action="store_true", help="send the control maps as rendered")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s : %(message)s")
+
+    try:
+        job_file, dreams = load_dreams(args.job_file)
+    except (OSError, ValueError) as e:
+        _LOGGER.error("Couldn't read the job file %s : %s", args.job_file, e)
+        return 2
+    url_server = args.server or job_file.get("server", DEFAULT_SERVER)
+    output_dir = args.output_dir or os.path.join(os.path.dirname(os.path.abspath(args.job_file)),
+                                                 job_file.get("output_dir", "dreams"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    dream_batch = DreamBatch(url_server, output_dir, args.chunk_size, not args.no_stream, args.gzip,
+                             not args.no_optimize)
+    try:
+        manifest = dream_batch.run(dreams)
+    finally:
+        dream_batch.close()
+    nb_failed = len([entry for entry in manifest["dreams"] if entry["error"] is not None])
+    _LOGGER.info("%d dreams done, %d failed, manifest : %s", len(dreams) - nb_failed, nb_failed,
+                 os.path.join(output_dir, MANIFEST_FILENAME))
+    return 1 if nb_failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import binascii
+import json
+import logging
+import os
+import time
+
+import requests
+
+from .BackendPool import BackendError
+from .ImageWriter import log_timings
+from .RequestBody import StreamingJsonBody, GzipJsonBody, log_payload_sizes
+from .ResponseDecoder import StreamingResponseDecoder
+from .Tracing import trace_span
+
+_LOGGER = logging.getLogger(__name__)
+
+# Size of the chunks read from a streamed dream response
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class DreamClient:
+    def __init__(self, session, writer_pool, stream_response=True, gzip_request=False, stats_callback=None):
+        """
+        Constructor
+        :param session: SDSession sending the requests
+        :param writer_pool: ImageWriterPool decoding and writing the generated images
+        :param stream_response: whether the dream responses are parsed incrementally
+        :param gzip_request: whether the dream requests are compressed (the server must decode gzip bodies)
+        :param stats_callback: function(stats) called after each request (from its thread) with a dict of its
+        sizes and timings
+        """
+        self.__session = session
+        self.__writer_pool = writer_pool
+        self.__stream_response = stream_response
+        self.__gzip_request = gzip_request
+        self.__stats_callback = stats_callback
+
+    def set_stream_response(self, stream_response):
+        """
+        Setter of whether the dream responses are parsed incrementally (low memory) or all at once
+        :param stream_response
+        :return:
+        """
+        self.__stream_response = stream_response
+
+    def set_gzip_request(self, gzip_request):
+        """
+        Setter of whether the dream requests are compressed, only for servers decoding gzip bodies
+        (behind a proxy for instance)
+        :param gzip_request
+        :return:
+        """
+        self.__gzip_request = gzip_request
+
+    def request_dream(self, params, request_url, output_filepaths, stats_callback=None):
+        """
+        Inspired from https://github.com/coolzilj/Blender-ControlNet
+        Request the Stable Diffusion Controlnet API
+        :param params
+        :param request_url
+        :param output_filepaths: paths of the images to generate
+        :param stats_callback: function(stats) called with the stats of this request, after the one of the client
+        :return: output filepaths, seed, message
+        """
+        stats = {
+            "url": request_url,
+            "nb_images_requested": len(output_filepaths),
+            "nb_images": 0,
+            "start": time.perf_counter(),
+            "bytes_received": 0,
+            "decode": 0.0,
+            "write": 0.0,
+            "first_image": None,
+            "status": None,
+        }
+        try:
+            with trace_span("request", "dream", url=request_url, nb_images=len(output_filepaths)):
+                output_files, seed, msg = self.__request_dream(params, request_url, output_filepaths, stats)
+            stats["nb_images"] = len(output_files) if output_files is not None else 0
+            stats["status"] = msg
+            return output_files, seed, msg
+        except BackendError as e:
+            stats["status"] = str(e)
+            raise
+        finally:
+            stats["end"] = time.perf_counter()
+            if self.__stats_callback is not None:
+                self.__stats_callback(stats)
+            if stats_callback is not None:
+                stats_callback(stats)
+
+    def request_chunk(self, params, request_url, output_filepaths, stats_callback=None):
+        """
+        Request a chunk of a dream : the images received are kept even if the request failed partway (short
+        response), only the failures of the server itself are raised so the chunk can go to another server
+        :param params
+        :param request_url
+        :param output_filepaths: paths of the images of the chunk
+        :param stats_callback: function(stats) called with the stats of this request
+        :return: output filepaths (empty if none was received), error message (None if the chunk succeeded)
+        """
+        output_files, _, msg = self.request_dream(params, request_url, output_filepaths, stats_callback)
+        return (output_files or []), (None if msg == "Success" else msg)
+
+    def __request_dream(self, params, request_url, output_filepaths, stats):
+        """
+        Request the Stable Diffusion Controlnet API and fill the stats of the request
+        :param params
+        :param request_url
+        :param output_filepaths
+        :param stats
+        :return: output filepaths, seed, message
+        """
+        # send API request (failures of the server itself are raised so the chunk can go to another server)
+        try:
+            # The body is streamed, the control maps are read from the disk while they are sent
+            body = StreamingJsonBody(params)
+            headers = {"Content-Type": "application/json"}
+            data = body
+            gzip_request = self.__gzip_request
+            stream_response = self.__stream_response
+            if gzip_request:
+                data = GzipJsonBody(body)
+                headers["Content-Encoding"] = "gzip"
+            # Upload, queue and generation on the server until the response headers
+            with trace_span("send and generate", "dream", bytes=len(body)):
+                response = self.__session.post("dream", request_url, data=data, headers=headers,
+                                               stream=stream_response)
+            stats["response"] = time.perf_counter()
+            stats["bytes_original"] = body.get_original_length()
+            stats["bytes_optimized"] = len(body)
+            stats["bytes_sent"] = data.get_sent_length() if gzip_request else len(body)
+            log_payload_sizes(stats["bytes_original"], stats["bytes_optimized"], stats["bytes_sent"])
+        except requests.exceptions.ConnectionError:
+            raise BackendError("The server couldn't be found.")
+        except requests.exceptions.MissingSchema:
+            raise BackendError("The url for the server is invalid.")
+        except requests.exceptions.ReadTimeout:
+            raise BackendError("The server timed out.")
+
+        # handle the response
+        if response.status_code in (502, 503, 504):
+            raise BackendError(DreamClient.handle_api_error(response)[2])
+        elif response.status_code != 200:
+            return DreamClient.handle_api_error(response)
+        with trace_span("receive", "dream"):
+            if stream_response:
+                return DreamClient.handle_api_stream(response, output_filepaths, self.__writer_pool, stats)
+            return DreamClient.handle_api_success(response, output_filepaths, self.__writer_pool, stats)
+
+    @staticmethod
+    def handle_api_error(response):
+        """
+        Handle Stable Diffusion API Response Error
+        :param response
+        :return:
+        """
+        if response.status_code == 404:
+            try:
+                response_obj = response.json()
+                if response_obj.get("detail") and response_obj["detail"] == "Not Found":
+                    msg = "It looks like the server is running, but it's not in API mode."
+                elif (
+                        response_obj.get("detail")
+                        and response_obj["detail"] == "Sampler not found"
+                ):
+                    msg = "The sampler you selected is not available."
+                else:
+                    msg = f"An error occurred in the server. Full server response: {json.dumps(response_obj)}"
+            except:
+                msg = "The server couldn't be found."
+        elif response.status_code == 504:
+            msg = "Gateway Timeout"
+        else:
+            msg = "An error occurred in the server : \n\n" + str(response.content)
+        return None, -1, msg
+
+    @staticmethod
+    def __wait_written_images(futures, seed, stats=None):
+        """
+        Wait for the images queued in the writer pool
+        :param futures
+        :param seed
+        :param stats: dict filled with the decode and write timings, and the sha256 and size of each image
+        :return:
+        """
+        timings = []
+        error_msg = None
+        with trace_span("wait writes", "dream", nb_images=len(futures)):
+            for future in futures:
+                try:
+                    timings.append(future.result())
+                except (binascii.Error, ValueError):
+                    error_msg = error_msg or "Couldn't decode base64 image."
+                except OSError:
+                    error_msg = error_msg or "Couldn't write to output file."
+        log_timings(timings)
+        if stats is not None and len(timings) > 0:
+            stats["decode"] = sum(timing["decode"] for timing in timings)
+            stats["write"] = sum(timing["write"] for timing in timings)
+            stats["first_image"] = min(timing["written_at"] for timing in timings)
+            stats["files"] = {timing["path"]: {"sha256": timing["sha256"], "size": timing["size"]}
+                              for timing in timings}
+        if error_msg is not None:
+            # The images written aren't returned with the error, they are removed
+            DreamClient.__remove_files([timing["path"] for timing in timings], stats)
+            return None, -1, error_msg
+        return [timing["path"] for timing in timings], seed, "Success"
+
+    @staticmethod
+    def __remove_files(filepaths, stats=None):
+        """
+        Remove the images written by a failed request
+        :param filepaths
+        :param stats: dict of the request, its hashes of the images are removed too
+        :return:
+        """
+        for filepath in filepaths:
+            try:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            except OSError:
+                _LOGGER.warning("Couldn't remove the image %s of a failed request", filepath)
+        if stats is not None:
+            stats.pop("files", None)
+
+    @staticmethod
+    def handle_api_success(response, output_filepaths, writer_pool, stats=None):
+        """
+        Handle Stable Diffusion API Response Success
+        :param response
+        :param output_filepaths: paths of the generated images (the following images are grids or control maps)
+        :param writer_pool: ImageWriterPool decoding and writing the images
+        :param stats: dict filled with the sizes and timings of the response
+        :return:
+        """
+        try:
+            if stats is not None:
+                stats["bytes_received"] = len(response.content)
+            response_obj = response.json()
+            infos = json.loads(response_obj["info"])
+            seed = infos["seed"]
+            base64_imgs = response_obj["images"]
+        except:
+            return None, -1, "Server response content : \n\n" + str(response.content)
+
+        # decode base64 images and save them in parallel
+        futures = []
+        for output_filepath, base64_img in zip(output_filepaths, base64_imgs):
+            futures.append(writer_pool.submit(output_filepath, base64_img))
+        del response_obj, base64_imgs
+        output_files, seed, msg = DreamClient.__wait_written_images(futures, seed, stats)
+        if output_files is not None and len(output_files) < len(output_filepaths):
+            # Interrupted generation, the images received are kept
+            return output_files, seed, "The server returned less images than requested."
+        return output_files, seed, msg
+
+    @staticmethod
+    def handle_api_stream(response, output_filepaths, writer_pool, stats=None):
+        """
+        Handle Stable Diffusion API Response Success by parsing the body incrementally, each image is queued
+        to be decoded and written as soon as its base64 string is received
+        :param response: response requested with stream=True
+        :param output_filepaths: paths of the generated images (the following images are grids or control maps)
+        :param writer_pool: ImageWriterPool decoding and writing the images
+        :param stats: dict filled with the sizes and timings of the response
+        :return:
+        """
+        futures = []
+
+        def write_image(index, base64_img):
+            if index < len(output_filepaths):
+                futures.append(writer_pool.submit(output_filepaths[index], base64_img))
+
+        decoder = StreamingResponseDecoder(write_image)
+        error_msg = None
+        connection_lost = False
+        seed = -1
+        try:
+            for chunk in response.iter_content(chunk_size=_STREAM_CHUNK_SIZE):
+                if stats is not None:
+                    stats["bytes_received"] += len(chunk)
+                decoder.feed(chunk)
+            response_obj = decoder.close()
+            infos = json.loads(response_obj["info"])
+            seed = infos["seed"]
+        except requests.exceptions.RequestException:
+            # Raised once the images queued are written, so the chunk can go to another server
+            connection_lost = True
+            error_msg = "The connection to the server was lost."
+        except Exception as e:
+            error_msg = "Couldn't parse the server response : \n\n" + str(e)
+        finally:
+            response.close()
+
+        output_files, seed, msg = DreamClient.__wait_written_images(futures, seed, stats)
+        if error_msg is not None:
+            # The images received before the failure aren't returned (their seed is unknown), they are removed
+            DreamClient.__remove_files(output_filepaths[:len(futures)], stats)
+            if connection_lost:
+                raise BackendError(error_msg)
+            return None, -1, error_msg
+        if output_files is not None and len(output_files) < len(output_filepaths):
+            # Interrupted generation, the images received are kept
+            return output_files, seed, "The server returned less images than requested."
+        return output_files, seed, msg
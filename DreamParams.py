@@ -0,0 +1,186 @@
+DEPTH_NAME = "style_dreamer_depth"
+NORMAL_NAME = "style_dreamer_normal"
+EDGES_NAME = "style_dreamer_edges"
+BEAUTY_NAME = "beauty"
+
+# Length of the prompt displayed in the label of a dream
+_LABEL_PROMPT_LENGTH = 60
+
+
+def get_used_map_names(datas):
+    """
+    Get the names of the control maps sent with a dream
+    :param datas
+    :return: used map names
+    """
+    return [name for name, used in [
+        (BEAUTY_NAME, datas["denoising_strength"] < 1.0),
+        (DEPTH_NAME, datas["weight_depth"] > 0),
+        (NORMAL_NAME, datas["weight_normal"] > 0),
+        (EDGES_NAME, datas["weight_edges"] > 0)] if used]
+
+
+def get_dream_label(params):
+    """
+    Get the text describing a dream in the queue
+    :param params
+    :return: label
+    """
+    prompt = params["prompt"].replace("\n", " ")
+    if len(prompt) > _LABEL_PROMPT_LENGTH:
+        prompt = prompt[:_LABEL_PROMPT_LENGTH - 3] + "..."
+    return "%d images - %s" % (int(params["batch_size"]) * int(params["n_iter"]), prompt)
+
+
+def _params_txt2img():
+    """
+    Get the txt2img parameters
+    :return: txt2img parameters
+    """
+    return {
+        "enable_hr": False,
+        "firstphase_width": 0,
+        "firstphase_height": 0,
+    }
+
+
+def _params_img2img(datas, control_maps):
+    """
+    Get the img2img parameters
+    :param datas
+    :param control_maps: dict name -> ControlMap
+    :return: img2img parameters
+    """
+    return {
+        "denoising_strength": datas["denoising_strength"],
+        "init_images": [
+            control_maps[BEAUTY_NAME].get_snapshot()
+        ],
+        "resize_mode": 0,
+    }
+
+
+def get_request_path(datas):
+    """
+    Get the correct endpoint for the dream request
+    :param datas
+    :return: request path
+    """
+    if datas["denoising_strength"] < 1.0:
+        return "/sdapi/v1/img2img"
+    else:
+        return "/sdapi/v1/txt2img"
+
+
+def generate_params(datas, control_maps):
+    """
+    Generate the params dict
+    :param datas: dream parameters (see StyleDreamer.__get_datas)
+    :param control_maps: dict name -> ControlMap, only the used maps are frozen
+    :return: params
+    """
+    # COMMON PARAMETERS
+    params = {
+        "prompt": datas["prompt"],
+        "styles": [],
+        "seed": datas["seed"],
+        "subseed": -1,
+        "subseed_strength": 0,
+        "seed_resize_from_h": -1,
+        "seed_resize_from_w": -1,
+        "sampler_name": "Euler",
+        "batch_size": datas["batch_size"],
+        "n_iter": datas["batch_count"],
+        "steps": datas["sampling_steps"],
+        "cfg_scale": datas["cfg_scale"],
+        "width": datas["width"],
+        "height": datas["height"],
+        "restore_faces": False,
+        "tiling": False,
+        "do_not_save_samples": False,
+        "do_not_save_grid": False,
+        "negative_prompt": datas["negative_prompt"],
+        "eta": 0,
+        "s_churn": 0,
+        "s_tmax": 0,
+        "s_tmin": 0,
+        "s_noise": 1,
+        "override_settings": {},
+        "override_settings_restore_afterwards": True,
+        "script_args": [],
+        "sampler_index": "DDIM",
+        "script_name": "",
+        "send_images": True,
+        "save_images": False,
+        "include_init_images": False,
+        "alwayson_scripts": {"controlnet": {"args": []}},
+    }
+
+    # SPECIAL PARAMETERS
+    if datas["denoising_strength"] < 1.0:
+        params.update(_params_img2img(datas, control_maps))
+    else:
+        params.update(_params_txt2img())
+
+    # CONTROLNET PARAMETERS
+
+    if datas["weight_depth"] > 0:
+        params["alwayson_scripts"]["controlnet"]["args"].append(
+            {
+                "input_image": control_maps[DEPTH_NAME].get_snapshot(),
+                "mask": "",
+                "module": "none",
+                "model": "control_v11f1p_sd15_depth",
+                "weight": datas["weight_depth"],
+                "resize_mode": 0,
+                "lowvram": False,
+                "processor_res": 64,
+                "threshold_a": 64,
+                "threshold_b": 64,
+                "guidance": 1,
+                "guidance_start": 0,
+                "guidance_end": 1,
+                "guessmode": False,
+                "rgbbgr_mode": False
+            })
+
+    if datas["weight_normal"] > 0:
+        params["alwayson_scripts"]["controlnet"]["args"].append(
+            {
+                "input_image": control_maps[NORMAL_NAME].get_snapshot(),
+                "mask": "",
+                "module": "none",
+                "model": "control_v11p_sd15_normalbae",
+                "weight": datas["weight_normal"],
+                "resize_mode": 0,
+                "lowvram": False,
+                "processor_res": 64,
+                "threshold_a": 64,
+                "threshold_b": 64,
+                "guidance": 1,
+                "guidance_start": 0,
+                "guidance_end": 1,
+                "guessmode": False,
+                "rgbbgr_mode": True
+            })
+
+    if datas["weight_edges"] > 0:
+        params["alwayson_scripts"]["controlnet"]["args"].append(
+            {
+                "input_image": control_maps[EDGES_NAME].get_snapshot(),
+                "mask": "",
+                "module": "none",
+                "model": "control_v11p_sd15_canny",
+                "weight": datas["weight_edges"],
+                "resize_mode": 0,
+                "lowvram": False,
+                "processor_res": 64,
+                "threshold_a": 64,
+                "threshold_b": 64,
+                "guidance": 1,
+                "guidance_start": 0,
+                "guidance_end": 1,
+                "guessmode": False,
+                "rgbbgr_mode": False
+            })
+    return params
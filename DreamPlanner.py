@@ -0,0 +1,98 @@
+import random
+import time
+
+DEFAULT_CHUNK_SIZE = 8
+
+MAX_BATCH_SIZE = 8
+
+MAX_SEED = 2 ** 32
+
+
+def get_batch_param(image_count, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Compute the batch count and batch size according to the number of images
+    :param image_count
+    :param max_batch_size
+    :return: batch count, batch size
+    """
+    image_count = int(image_count)
+    if image_count <= max_batch_size:
+        return 1, image_count
+    else:
+        batch_size = 1
+        for bs in range(max_batch_size, 0, -1):
+            if image_count % bs == 0:
+                batch_size = bs
+                break
+        return image_count / batch_size, batch_size
+
+
+def get_output_filepaths(output_dir, nb_gen_img):
+    """
+    Get the paths of the images generated by a dream
+    :param output_dir
+    :param nb_gen_img
+    :return: output filepaths
+    """
+    output_file_prefix = time.strftime(output_dir + "/output_%d%m%Y_%H%M%S")
+    if nb_gen_img > 1:
+        return [output_file_prefix + "_" + str(i) + ".png" for i in range(nb_gen_img)]
+    else:
+        return [output_file_prefix + ".png"]
+
+
+def split_in_chunks(batch_count, batch_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Split a dream of batch_count x batch_size images in several server calls of at most chunk_size images
+    (but at least one batch)
+    :param batch_count
+    :param batch_size
+    :param chunk_size: max number of images by call, 0 or None to do a single call
+    :return: list of (n_iter, batch_size) for each call
+    """
+    batch_count = int(batch_count)
+    batch_size = int(batch_size)
+    if not chunk_size:
+        return [(batch_count, batch_size)]
+    iter_by_chunk = max(1, int(chunk_size) // batch_size)
+    chunks = []
+    remaining = batch_count
+    while remaining > 0:
+        n_iter = min(iter_by_chunk, remaining)
+        chunks.append((n_iter, batch_size))
+        remaining -= n_iter
+    return chunks
+
+
+def merge_chunk_results(results, error_msg=None):
+    """
+    Merge the results of the chunks of a dream : the images of all the chunks in their order and the first error
+    :param results: list of (output filepaths, error message or None) by chunk, None for the chunks not run
+    :param error_msg: error of the whole dream (no server available for instance), first reported
+    :return: output filepaths, error message (None if every chunk succeeded)
+    """
+    output_filepaths = [path for result in results if result is not None for path in result[0]]
+    if error_msg is None:
+        error_msg = next((result[1] for result in results if result is not None and result[1] is not None), None)
+    return output_filepaths, error_msg
+
+
+def plan_dream_chunks(params, output_filepaths, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Split the params of a dream in the params of its server calls. The seed of each chunk follows the previous
+    ones so the images are the same as with a single call
+    :param params
+    :param output_filepaths: paths of all the images of the dream
+    :param chunk_size
+    :return: seed of the first image, list of (chunk params, chunk output filepaths)
+    """
+    # A random seed is drawn here so that the chunks sent to different servers still follow each other
+    seed = params["seed"] if params["seed"] != -1 else random.randrange(MAX_SEED)
+    dream_chunks = []
+    offset = 0
+    for n_iter, batch_size in split_in_chunks(params["n_iter"], params["batch_size"], chunk_size):
+        nb_chunk_images = n_iter * batch_size
+        chunk_params = dict(params, n_iter=n_iter, batch_size=batch_size, seed=seed + offset)
+        dream_chunks.append((chunk_params, output_filepaths[offset:offset + nb_chunk_images]))
+        offset += nb_chunk_images
+    return seed, dream_chunks
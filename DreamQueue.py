@@ -0,0 +1,443 @@
+import itertools
+import logging
+import threading
+import time
+from enum import Enum
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DreamJobStatus(Enum):
+    Pending = "pending"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+
+class DreamJob:
+    def __init__(self, job_id, params, request_path, label):
+        """
+        Constructor
+        :param job_id
+        :param params: frozen request parameters (with the control images)
+        :param request_path: endpoint of the request
+        :param label: text displayed in the queue
+        """
+        self.__id = job_id
+        self.__params = params
+        self.__request_path = request_path
+        self.__label = label
+        self.__status = DreamJobStatus.Pending
+        self.__submit_time = time.time()
+        # Start of the events written in the trace of the job
+        self.__trace_start = None
+        self.__planned_filepaths = []
+        self.__output_filepaths = []
+        self.__seed = -1
+        self.__error_msg = None
+        # Progress of the job
+        self.__progress_lock = threading.Lock()
+        self.__nb_images = int(params["batch_size"]) * int(params["n_iter"])
+        self.__nb_done_images = 0
+        self.__nb_chunk_images = 0
+        self.__server_job_timestamp = None
+        # Cancellation of the job
+        self.__cancel_event = threading.Event()
+        # Chunks sent to the servers and not received yet
+        self.__running_chunks = []
+
+    def get_id(self):
+        """
+        Getter of the id
+        :return: id
+        """
+        return self.__id
+
+    def get_params(self):
+        """
+        Getter of the frozen request parameters
+        :return: params
+        """
+        return self.__params
+
+    def get_request_path(self):
+        """
+        Getter of the endpoint of the request
+        :return: request path
+        """
+        return self.__request_path
+
+    def get_label(self):
+        """
+        Getter of the label
+        :return: label
+        """
+        return self.__label
+
+    def get_status(self):
+        """
+        Getter of the status
+        :return: status
+        """
+        return self.__status
+
+    def set_status(self, status):
+        """
+        Setter of the status
+        :param status
+        :return:
+        """
+        self.__status = status
+
+    def get_submit_time(self):
+        """
+        Getter of the submit time
+        :return: submit time
+        """
+        return self.__submit_time
+
+    def get_trace_start(self):
+        """
+        Getter of the start of the events written in the trace of the job
+        :return: trace start
+        """
+        return self.__trace_start
+
+    def set_trace_start(self, trace_start):
+        """
+        Setter of the start of the events written in the trace of the job (the render before it for instance)
+        :param trace_start: trace_clock() value
+        :return:
+        """
+        self.__trace_start = trace_start
+
+    def get_nb_images(self):
+        """
+        Getter of the number of images to generate
+        :return: number of images
+        """
+        return self.__nb_images
+
+    def get_nb_done_images(self):
+        """
+        Getter of the number of images already received
+        :return: number of done images
+        """
+        return self.__nb_done_images
+
+    def add_done_images(self, nb_images):
+        """
+        Count images received (may be called from several threads)
+        :param nb_images
+        :return:
+        """
+        with self.__progress_lock:
+            self.__nb_done_images += nb_images
+
+    def get_nb_chunk_images(self):
+        """
+        Getter of the number of images of the chunk whose progress is tracked
+        :return: number of chunk images
+        """
+        return self.__nb_chunk_images
+
+    def get_server_job_timestamp(self):
+        """
+        Getter of the timestamp of the server job of the tracked chunk
+        :return: server job timestamp
+        """
+        return self.__server_job_timestamp
+
+    def track_server_job(self, url, server_job_timestamp):
+        """
+        Track the progress of the chunk generated by a server job of the main server
+        :param url: main server
+        :param server_job_timestamp: timestamp of the current job of the server
+        :return: whether the server job is a chunk of this job (the one tracked until now or a new one)
+        """
+        chunk = self.identify_server_job(url, server_job_timestamp)
+        if chunk is None:
+            return False
+        with self.__progress_lock:
+            self.__nb_chunk_images = chunk["nb_images"]
+            self.__server_job_timestamp = server_job_timestamp
+        return True
+
+    def request_cancel(self):
+        """
+        Ask the job to stop, no new chunk is sent after this
+        :return:
+        """
+        self.__cancel_event.set()
+
+    def is_cancel_requested(self):
+        """
+        Getter of whether the job was asked to stop
+        :return: is cancel requested
+        """
+        return self.__cancel_event.is_set()
+
+    def get_cancel_event(self):
+        """
+        Getter of the event set when the job is asked to stop
+        :return: cancel event
+        """
+        return self.__cancel_event
+
+    def add_running_chunk(self, url, nb_images):
+        """
+        Count a chunk sent to a server
+        :param url
+        :param nb_images: number of images of the chunk
+        :return: chunk
+        """
+        chunk = {"url": url, "nb_images": nb_images, "launch_timestamp": int(time.time()), "server_job": None}
+        with self.__progress_lock:
+            self.__running_chunks.append(chunk)
+        return chunk
+
+    def remove_running_chunk(self, chunk):
+        """
+        Count a chunk received from a server
+        :param chunk: returned by add_running_chunk
+        :return:
+        """
+        with self.__progress_lock:
+            self.__running_chunks.remove(chunk)
+
+    def identify_server_job(self, url, server_job_timestamp):
+        """
+        Find the running chunk generated by the current job of a server : the one already identified with this job,
+        otherwise the oldest chunk sent to the server before the job started and not identified yet (a server runs
+        its requests in order)
+        :param url
+        :param server_job_timestamp: timestamp of the current job of the server
+        :return: chunk (None if the server job isn't a chunk of this job)
+        """
+        with self.__progress_lock:
+            chunks = [chunk for chunk in self.__running_chunks if chunk["url"] == url]
+            for chunk in chunks:
+                if chunk["server_job"] == server_job_timestamp:
+                    return chunk
+            for chunk in chunks:
+                if chunk["server_job"] is None and chunk["launch_timestamp"] <= server_job_timestamp:
+                    chunk["server_job"] = server_job_timestamp
+                    return chunk
+        return None
+
+    def get_running_chunk_urls(self):
+        """
+        Getter of the servers generating a chunk of the job
+        :return: urls
+        """
+        with self.__progress_lock:
+            return sorted(set(chunk["url"] for chunk in self.__running_chunks))
+
+    def get_planned_filepaths(self):
+        """
+        Getter of the paths of all the images of the job in the order of their seeds, received or not
+        :return: planned filepaths
+        """
+        return self.__planned_filepaths
+
+    def set_planned_filepaths(self, planned_filepaths):
+        """
+        Setter of the paths of all the images of the job in the order of their seeds
+        :param planned_filepaths
+        :return:
+        """
+        self.__planned_filepaths = list(planned_filepaths)
+
+    def get_output_filepaths(self):
+        """
+        Getter of the generated images
+        :return: output filepaths
+        """
+        return self.__output_filepaths
+
+    def get_seed(self):
+        """
+        Getter of the seed of the first image
+        :return: seed
+        """
+        return self.__seed
+
+    def get_error_msg(self):
+        """
+        Getter of the error message
+        :return: error message (None if the job succeeded)
+        """
+        return self.__error_msg
+
+    def set_result(self, output_filepaths, seed, error_msg):
+        """
+        Setter of the result of the job
+        :param output_filepaths
+        :param seed
+        :param error_msg
+        :return:
+        """
+        self.__output_filepaths = output_filepaths if output_filepaths is not None else []
+        self.__seed = seed
+        self.__error_msg = None if error_msg == "Success" else error_msg
+
+    def release_params(self):
+        """
+        Free the frozen parameters (and their images) once they are not needed anymore
+        :return:
+        """
+        self.__params = None
+
+
+class DreamQueue:
+    def __init__(self, run_job, max_running_jobs=1, queue_changed_callback=None, job_done_callback=None):
+        """
+        Constructor
+        :param run_job: function(job) running a job and setting its result (called on a worker thread)
+        :param max_running_jobs: number of jobs running at the same time
+        :param queue_changed_callback: function() called when the queue changes (from any thread)
+        :param job_done_callback: function(job) called when a job ended (from its worker thread)
+        """
+        self.__run_job = run_job
+        self.__job_done_callback = job_done_callback
+        self.__max_running_jobs = max(1, max_running_jobs)
+        self.__queue_changed_callback = queue_changed_callback
+        self.__lock = threading.RLock()
+        self.__ids = itertools.count(1)
+        self.__pending = []
+        self.__running = []
+
+    def set_max_running_jobs(self, max_running_jobs):
+        """
+        Setter of the number of jobs running at the same time
+        :param max_running_jobs
+        :return:
+        """
+        with self.__lock:
+            self.__max_running_jobs = max(1, max_running_jobs)
+        self.__start_jobs()
+
+    def submit(self, params, request_path, label):
+        """
+        Add a job at the end of the queue
+        :param params
+        :param request_path
+        :param label
+        :return: job
+        """
+        with self.__lock:
+            job = DreamJob(next(self.__ids), params, request_path, label)
+            self.__pending.append(job)
+        self.__notify()
+        self.__start_jobs()
+        return job
+
+    def get_jobs(self):
+        """
+        Getter of the running then pending jobs
+        :return: jobs
+        """
+        with self.__lock:
+            return list(self.__running) + list(self.__pending)
+
+    def get_running_jobs(self):
+        """
+        Getter of the running jobs
+        :return: running jobs
+        """
+        with self.__lock:
+            return list(self.__running)
+
+    def is_running(self):
+        """
+        Getter of whether a job is running
+        :return: is running
+        """
+        with self.__lock:
+            return len(self.__running) > 0
+
+    def move(self, job_id, offset):
+        """
+        Move a pending job in the queue
+        :param job_id
+        :param offset: -1 to run it earlier, 1 to run it later
+        :return: whether the job moved
+        """
+        with self.__lock:
+            indexes = [i for i, job in enumerate(self.__pending) if job.get_id() == job_id]
+            if len(indexes) == 0:
+                return False
+            index = indexes[0]
+            new_index = min(max(index + offset, 0), len(self.__pending) - 1)
+            if new_index == index:
+                return False
+            self.__pending.insert(new_index, self.__pending.pop(index))
+        self.__notify()
+        return True
+
+    def cancel(self, job_id):
+        """
+        Remove a job from the queue. A running job is asked to stop and keeps its slot until its chunks returned,
+        so the next job doesn't start on a server still being interrupted
+        :param job_id
+        :return: the cancelled job and its status before the cancellation (Pending or Running), (None, None) if it
+        isn't pending nor running
+        """
+        with self.__lock:
+            jobs = [job for job in self.__pending + self.__running
+                    if job.get_id() == job_id and job.get_status() != DreamJobStatus.Cancelled]
+            if len(jobs) == 0:
+                return None, None
+            job = jobs[0]
+            previous_status = job.get_status()
+            job.request_cancel()
+            job.set_status(DreamJobStatus.Cancelled)
+            if job in self.__pending:
+                self.__pending.remove(job)
+                job.release_params()
+        self.__notify()
+        return job, previous_status
+
+    def __start_jobs(self):
+        """
+        Start pending jobs while there are free slots
+        :return:
+        """
+        with self.__lock:
+            while len(self.__pending) > 0 and len(self.__running) < self.__max_running_jobs:
+                job = self.__pending.pop(0)
+                job.set_status(DreamJobStatus.Running)
+                self.__running.append(job)
+                threading.Thread(target=self.__run, args=(job,), name="style_dreamer_job_%d" % job.get_id(),
+                                 daemon=True).start()
+        self.__notify()
+
+    def __run(self, job):
+        """
+        Run a job and start the next one
+        :param job
+        :return:
+        """
+        try:
+            self.__run_job(job)
+        except Exception as e:
+            _LOGGER.exception("Dream job %d failed", job.get_id())
+            job.set_result(None, -1, str(e))
+        with self.__lock:
+            if job.get_status() == DreamJobStatus.Running:
+                job.set_status(DreamJobStatus.Failed if job.get_error_msg() is not None else DreamJobStatus.Done)
+            job.release_params()
+            if job in self.__running:
+                self.__running.remove(job)
+        if self.__job_done_callback is not None:
+            self.__job_done_callback(job)
+        self.__start_jobs()
+
+    def __notify(self):
+        """
+        Call the queue changed callback
+        :return:
+        """
+        if self.__queue_changed_callback is not None:
+            self.__queue_changed_callback()
@@ -0,0 +1,234 @@
+import itertools
+
+from .DreamParams import get_request_path, get_used_map_names
+from .DreamPlanner import get_batch_param
+
+# Fields of the datas that can be swept and their type. The depth distances change the render, not the request,
+# so they can't be swept
+SWEEPABLE_FIELDS = {
+    "prompt": str,
+    "negative_prompt": str,
+    "seed": int,
+    "image_count": int,
+    "sampling_steps": int,
+    "cfg_scale": int,
+    "denoising_strength": float,
+    "weight_depth": float,
+    "weight_normal": float,
+    "weight_edges": float,
+    "width": int,
+    "height": int,
+}
+
+# Separator of the values of the text fields
+TEXT_SEPARATOR = "|"
+
+# Max number of dreams of a sweep
+MAX_SWEEP_SIZE = 256
+
+# Fields whose combinations share a server job when the rest of their datas are equal : the seeds of the images of
+# a dream follow each other
+_BATCHED_FIELDS = ("seed", "image_count")
+
+
+def _parse_number(field_type, text):
+    """
+    Parse a number of a sweep
+    :param field_type
+    :param text
+    :return: number
+    """
+    value = float(text)
+    if field_type is int:
+        if not value.is_integer():
+            raise ValueError("%s isn't an integer" % text)
+        return int(value)
+    return value
+
+
+def parse_sweep_values(field, text):
+    """
+    Parse the values of a field : "a, b, c" or a range "start:stop:step" (stop included) for the numbers,
+    "a | b | c" for the texts
+    :param field
+    :param text
+    :return: list of values
+    """
+    field_type = SWEEPABLE_FIELDS[field]
+    if field_type is str:
+        return [value.strip() for value in text.split(TEXT_SEPARATOR) if len(value.strip()) > 0]
+    values = []
+    for part in text.split(","):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        if ":" not in part:
+            values.append(_parse_number(field_type, part))
+            continue
+        bounds = part.split(":")
+        if len(bounds) != 3:
+            raise ValueError("The range %s must be start:stop:step" % part)
+        start, stop, step = [_parse_number(field_type, bound) for bound in bounds]
+        if step <= 0:
+            raise ValueError("The step of %s must be positive" % part)
+        nb_steps = int(round((stop - start) / step, 6)) + 1
+        for index in range(max(nb_steps, 0)):
+            value = start + index * step
+            values.append(value if field_type is int else round(value, 6))
+    # Duplicates removed, order kept
+    return list(dict.fromkeys(values))
+
+
+def _snake_product(values_by_field):
+    """
+    Expand the grid so that two consecutive combinations differ by a single field (the inner fields go back and
+    forth instead of starting again)
+    :param values_by_field: list of (field, values)
+    :return: list of combinations (dict field -> value)
+    """
+    combinations = [{}]
+    for field, values in values_by_field:
+        expanded = []
+        for index, combination in enumerate(combinations):
+            ordered_values = values if index % 2 == 0 else list(reversed(values))
+            expanded.extend(dict(combination, **{field: value}) for value in ordered_values)
+        combinations = expanded
+    return combinations
+
+
+def get_sweep_datas(datas, combination):
+    """
+    Get the datas of a combination of a sweep
+    :param datas: base datas
+    :param combination: dict field -> value
+    :return: datas
+    """
+    sweep_datas = dict(datas, **combination)
+    if "image_count" in combination:
+        sweep_datas["batch_count"], sweep_datas["batch_size"] = get_batch_param(combination["image_count"])
+    return sweep_datas
+
+
+def expand_sweep(datas, values_by_field):
+    """
+    Expand a sweep in its combinations, ordered so that each server call changes as little as possible :
+    the img2img and txt2img dreams are apart, the dreams with the same control maps are together and inside
+    a group two consecutive dreams differ by a single field
+    :param datas: base datas
+    :param values_by_field: list of (field, values), the first fields change the least often
+    :return: list of combinations (dict field -> value)
+    """
+    values_by_field = [(field, values) for field, values in values_by_field if len(values) > 0]
+    nb_combinations = 1
+    for _, values in values_by_field:
+        nb_combinations *= len(values)
+    if nb_combinations > MAX_SWEEP_SIZE:
+        raise ValueError("The sweep has %d dreams, the max is %d" % (nb_combinations, MAX_SWEEP_SIZE))
+    combinations = _snake_product(values_by_field)
+
+    def group_key(combination):
+        sweep_datas = get_sweep_datas(datas, combination)
+        return get_request_path(sweep_datas), tuple(get_used_map_names(sweep_datas))
+
+    # Stable sort, the order inside a group is kept
+    group_order = {}
+    for combination in combinations:
+        group_order.setdefault(group_key(combination), len(group_order))
+    return sorted(combinations, key=lambda combination: group_order[group_key(combination)])
+
+
+def batch_sweep(datas, combinations):
+    """
+    Group the combinations of a sweep that only differ by their seed and their number of images in the same dreams :
+    the images of a dream have consecutive seeds, so the combinations whose seeds overlap or follow each other are
+    slices of the images of a single dream. The combinations with a random seed aren't grouped
+    :param datas: base datas
+    :param combinations: list of combinations (see expand_sweep), the order of their groups is kept
+    :return: list of (dream combination, list of (combination, index of its first image, number of images))
+    """
+    # Combinations by group, a group is the combinations without the batched fields
+    groups = {}
+    for index, combination in enumerate(combinations):
+        sweep_datas = get_sweep_datas(datas, combination)
+        seed, image_count = int(sweep_datas["seed"]), int(sweep_datas["image_count"])
+        if seed == -1:
+            key = index
+        else:
+            key = tuple(sorted((field, value) for field, value in combination.items()
+                               if field not in _BATCHED_FIELDS))
+        groups.setdefault(key, []).append((seed, image_count, combination))
+
+    dreams = []
+    for group in groups.values():
+        # Runs of overlapping or consecutive seeds : [first seed, end seed, slices]
+        runs = []
+        for seed, image_count, combination in sorted(group, key=lambda item: (item[0], item[1])):
+            if len(runs) > 0 and seed != -1 and seed <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], seed + image_count)
+            else:
+                runs.append([seed, seed + image_count, []])
+            runs[-1][2].append((combination, seed - runs[-1][0], image_count))
+        for first_seed, end_seed, slices in runs:
+            dream_combination = {field: value for field, value in slices[0][0].items()
+                                 if field not in _BATCHED_FIELDS}
+            dream_combination.update(seed=first_seed, image_count=end_seed - first_seed)
+            dreams.append((dream_combination, slices))
+    return dreams
+
+
+def get_sweep_cells_files(job, cells, output_filepaths):
+    """
+    Split the images received by the dream of a sweep between its cells
+    :param job: DreamJob of the dream
+    :param cells: list of (row, column, index of the first image of the cell, number of images)
+    :param output_filepaths: images received
+    :return: list of (row, column, images of the cell)
+    """
+    received = set(output_filepaths)
+    planned_filepaths = job.get_planned_filepaths()
+    return [(row, column, [path for path in planned_filepaths[offset:offset + image_count] if path in received])
+            for row, column, offset, image_count in cells]
+
+
+def get_sweep_axes(values_by_field):
+    """
+    Get the fields displayed in the columns and in the rows of the grid of a sweep
+    :param values_by_field: list of (field, values)
+    :return: column fields, row fields
+    """
+    swept_fields = [field for field, values in values_by_field if len(values) > 1]
+    if len(swept_fields) == 0:
+        swept_fields = [field for field, values in values_by_field if len(values) > 0][:1]
+    return swept_fields[:1], swept_fields[1:]
+
+
+def get_combination_label(combination, fields):
+    """
+    Get the text describing some fields of a combination
+    :param combination
+    :param fields
+    :return: label
+    """
+    return ", ".join("%s=%s" % (field, combination[field]) for field in fields)
+
+
+def get_grid_cells(values_by_field):
+    """
+    Get the position of each combination in the grid of a sweep
+    :param values_by_field: list of (field, values)
+    :return: column labels, row labels, function(combination) -> (row, column)
+    """
+    column_fields, row_fields = get_sweep_axes(values_by_field)
+    values = dict(values_by_field)
+    column_combinations = [dict(zip(column_fields, combination))
+                           for combination in itertools.product(*[values[field] for field in column_fields])]
+    row_combinations = [dict(zip(row_fields, combination))
+                        for combination in itertools.product(*[values[field] for field in row_fields])]
+    column_labels = [get_combination_label(combination, column_fields) for combination in column_combinations]
+    row_labels = [get_combination_label(combination, row_fields) for combination in row_combinations]
+
+    def get_cell(combination):
+        return (row_labels.index(get_combination_label(combination, row_fields)),
+                column_labels.index(get_combination_label(combination, column_fields)))
+
+    return column_labels, row_labels, get_cell
@@ -0,0 +1,120 @@
+import collections
+import threading
+
+from PySide2.QtCore import QBuffer, QByteArray, QIODevice, QObject, QSize, Qt, Signal
+from PySide2.QtGui import QImageReader
+
+from .Tracing import trace_span
+
+DEFAULT_NB_LOADER_WORKERS = 2
+
+
+def read_scaled_image(device_or_path, size):
+    """
+    Read an image scaled down to fit in a size, the reader decodes it directly at this size when the format allows it
+    :param device_or_path: path or QIODevice
+    :param size: QSize, or longest side in pixels
+    :return: QImage (null if it couldn't be read)
+    """
+    if isinstance(size, int):
+        size = QSize(size, size)
+    reader = QImageReader(device_or_path)
+    image_size = reader.size()
+    if image_size.isValid() and (image_size.width() > size.width() or image_size.height() > size.height()):
+        reader.setScaledSize(image_size.scaled(size, Qt.KeepAspectRatio))
+    return reader.read()
+
+
+def read_image(path, size, image_cache=None):
+    """
+    Read an image scaled down to fit in a size, from its bytes in memory if it was just written
+    :param path
+    :param size: QSize, or longest side in pixels
+    :param image_cache: ImageBytesCache of the last written images
+    :return: QImage (null if it couldn't be read)
+    """
+    data = image_cache.get(path) if image_cache is not None else None
+    if data is not None:
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        image = read_scaled_image(buffer, size)
+        if not image.isNull():
+            return image
+    return read_scaled_image(path, size)
+
+
+class ImageLoader(QObject):
+    __signal = Signal(object)
+
+    def __init__(self, load_function, loaded_callback, nb_workers=DEFAULT_NB_LOADER_WORKERS, name="images"):
+        """
+        Constructor. Loads images on worker threads, the last requested first
+        :param load_function: function(key) returning a QImage, called on the workers
+        :param loaded_callback: function(key, QImage) called on the GUI thread when an image is loaded
+        :param nb_workers
+        :param name: name of the worker threads and of their trace spans
+        """
+        super(ImageLoader, self).__init__(None)
+        self.__load_function = load_function
+        self.__loaded_callback = loaded_callback
+        self.__name = name
+        self.__pending = collections.OrderedDict()
+        self.__condition = threading.Condition()
+        self.__stopped = False
+        self.__signal.connect(self.__on_loaded)
+        for index in range(nb_workers):
+            threading.Thread(target=self.__work, name="style_dreamer_%s_%d" % (name, index), daemon=True).start()
+
+    def request(self, key):
+        """
+        Ask for an image, it is loaded before the ones requested earlier
+        :param key: argument of the load function
+        :return:
+        """
+        with self.__condition:
+            self.__pending.pop(key, None)
+            self.__pending[key] = True
+            self.__condition.notify()
+
+    def cancel_pending(self):
+        """
+        Forget the images requested but not loaded yet
+        :return:
+        """
+        with self.__condition:
+            self.__pending.clear()
+
+    def shutdown(self):
+        """
+        Stop the workers
+        :return:
+        """
+        with self.__condition:
+            self.__stopped = True
+            self.__pending.clear()
+            self.__condition.notify_all()
+
+    def __work(self):
+        """
+        Load the requested images until the loader is stopped
+        :return:
+        """
+        while True:
+            with self.__condition:
+                while len(self.__pending) == 0 and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                key, _ = self.__pending.popitem(last=True)
+            with trace_span("load " + self.__name, "visualizer"):
+                image = self.__load_function(key)
+            self.__signal.emit((key, image))
+
+    def __on_loaded(self, args):
+        """
+        Give a loaded image to the callback on the GUI thread
+        :param args: key, QImage
+        :return:
+        """
+        self.__loaded_callback(*args)
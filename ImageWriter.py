@@ -0,0 +1,193 @@
+import base64
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .Tracing import trace_span, bind_trace_dream
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_NB_WRITER_WORKERS = min(4, os.cpu_count() or 1)
+# Max size of the images kept in memory for the visualizer : the last few images, the older ones are read from the
+# disk (their thumbnails are cached anyway)
+DEFAULT_IMAGE_CACHE_SIZE = 16 * 1024 ** 2
+
+_BASE64_PNG_PREFIX = "data:image/png;base64,"
+
+
+def write_file_atomic(filepath, data):
+    """
+    Write a file through a temporary file in the same folder so a reader never sees a partial file
+    :param filepath
+    :param data: bytes
+    :return:
+    """
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_filepath)
+        except OSError:
+            pass
+        raise
+
+
+def decode_and_write(filepath, base64_img, image_cache=None):
+    """
+    Decode a base64 image and write it atomically
+    :param filepath
+    :param base64_img
+    :param image_cache: ImageBytesCache keeping the written image in memory
+    :return: dict of the timings, size and sha256 of the image
+    """
+    start = time.perf_counter()
+    with trace_span("decode", "image"):
+        if base64_img.startswith(_BASE64_PNG_PREFIX):
+            base64_img = base64_img[len(_BASE64_PNG_PREFIX):]
+        img_binary = base64.b64decode(base64_img)
+        # Hashed while in memory so the image isn't read again to be indexed
+        digest = hashlib.sha256(img_binary).hexdigest()
+    decoded = time.perf_counter()
+    with trace_span("write", "image", size=len(img_binary)):
+        write_file_atomic(filepath, img_binary)
+    written = time.perf_counter()
+    if image_cache is not None:
+        image_cache.put(filepath, img_binary)
+    return {"path": filepath, "size": len(img_binary), "sha256": digest, "decode": decoded - start,
+            "write": written - decoded, "written_at": written}
+
+
+def log_timings(timings):
+    """
+    Log a summary of the decode/write timings of a batch of images
+    :param timings: list of timings returned by decode_and_write
+    :return:
+    """
+    if len(timings) == 0:
+        return
+    for timing in timings:
+        _LOGGER.debug("%s : decode %.1f ms, write %.1f ms (%d bytes)", timing["path"],
+                      timing["decode"] * 1000, timing["write"] * 1000, timing["size"])
+    for stage in ("decode", "write"):
+        values = sorted(timing[stage] for timing in timings)
+        _LOGGER.info("%d images %s : mean %.1f ms, p50 %.1f ms, p95 %.1f ms, max %.1f ms", len(values), stage,
+                     sum(values) / len(values) * 1000, values[len(values) // 2] * 1000,
+                     values[min(int(len(values) * 0.95), len(values) - 1)] * 1000, values[-1] * 1000)
+
+
+class ImageBytesCache:
+    def __init__(self, max_size=DEFAULT_IMAGE_CACHE_SIZE):
+        """
+        Constructor. Keeps the content of the last written images so that they are displayed without being read
+        again from the disk, the least recently used are dropped above the max size
+        :param max_size: max size in bytes
+        """
+        self.__max_size = max_size
+        self.__size = 0
+        self.__images = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def put(self, filepath, data):
+        """
+        Keep the content of an image (called from the writer threads)
+        :param filepath
+        :param data: bytes of the image file
+        :return:
+        """
+        if len(data) > self.__max_size:
+            return
+        with self.__lock:
+            previous = self.__images.pop(filepath, None)
+            if previous is not None:
+                self.__size -= len(previous)
+            self.__images[filepath] = data
+            self.__size += len(data)
+            while self.__size > self.__max_size:
+                _, dropped = self.__images.popitem(last=False)
+                self.__size -= len(dropped)
+
+    def get(self, filepath):
+        """
+        Get the content of an image
+        :param filepath
+        :return: bytes or None if it isn't in memory
+        """
+        with self.__lock:
+            data = self.__images.get(filepath)
+            if data is not None:
+                self.__images.move_to_end(filepath)
+            return data
+
+    def discard(self, filepath):
+        """
+        Forget an image (deleted from the disk for instance)
+        :param filepath
+        :return:
+        """
+        with self.__lock:
+            data = self.__images.pop(filepath, None)
+            if data is not None:
+                self.__size -= len(data)
+
+    def clear(self):
+        """
+        Forget all the images
+        :return:
+        """
+        with self.__lock:
+            self.__images.clear()
+            self.__size = 0
+
+
+class ImageWriterPool:
+    def __init__(self, nb_workers=DEFAULT_NB_WRITER_WORKERS, max_pending=None, image_cache=None):
+        """
+        Constructor
+        :param nb_workers: number of threads decoding and writing images
+        :param max_pending: max number of images waiting to be written (submit blocks above), 2 per worker by default
+        :param image_cache: ImageBytesCache keeping the written images in memory
+        """
+        self.__image_cache = image_cache
+        self.__nb_workers = max(1, nb_workers)
+        self.__max_pending = max_pending if max_pending is not None else 2 * self.__nb_workers
+        self.__slots = threading.BoundedSemaphore(self.__max_pending)
+        self.__executor = ThreadPoolExecutor(max_workers=self.__nb_workers, thread_name_prefix="style_dreamer_writer")
+
+    def get_nb_workers(self):
+        """
+        Getter of the number of workers
+        :return: number of workers
+        """
+        return self.__nb_workers
+
+    def submit(self, filepath, base64_img):
+        """
+        Queue an image to be decoded and written, blocks while too many images are pending
+        :param filepath
+        :param base64_img
+        :return: future of the timings of the image
+        """
+        self.__slots.acquire()
+        try:
+            future = self.__executor.submit(bind_trace_dream(decode_and_write), filepath, base64_img,
+                                            self.__image_cache)
+        except BaseException:
+            self.__slots.release()
+            raise
+        future.add_done_callback(lambda _: self.__slots.release())
+        return future
+
+    def shutdown(self):
+        """
+        Wait for the pending images and stop the workers
+        :return:
+        """
+        self.__executor.shutdown(wait=True)
@@ -0,0 +1,245 @@
+import collections
+import os
+
+from PySide2.QtWidgets import *
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+
+from .ImageLoader import ImageLoader
+
+# Icons kept by the gallery, the ones scrolled away the longest are dropped above it
+DEFAULT_MAX_GALLERY_ICONS = 300
+# QWIDGETSIZE_MAX
+_MAX_WIDGET_SIZE = 16777215
+
+
+class OutputGalleryModel(QAbstractListModel):
+    def __init__(self, thumbnail_cache, icon_size, max_icons=DEFAULT_MAX_GALLERY_ICONS, parent=None):
+        """
+        Constructor. Only the thumbnails of the displayed rows are loaded, off the GUI thread
+        :param thumbnail_cache: ThumbnailCache
+        :param icon_size: QSize of the icons
+        :param max_icons: number of icons kept
+        :param parent
+        """
+        super(OutputGalleryModel, self).__init__(parent)
+        self.__thumbnail_cache = thumbnail_cache
+        self.__files = []
+        self.__rows = {}
+        # path -> QIcon of the last displayed rows
+        self.__icons = collections.OrderedDict()
+        self.__max_icons = max_icons
+        self.__requested = set()
+        placeholder = QPixmap(icon_size)
+        placeholder.fill(QColor(60, 60, 60))
+        self.__placeholder_icon = QIcon(placeholder)
+        self.__loader = ImageLoader(thumbnail_cache.get, self.__on_thumbnail_loaded, name="thumbnails")
+
+    def set_files(self, file_paths):
+        """
+        Setter of the displayed images : only the rows added or removed are updated (the model is reset if the
+        images are reordered), so the selection and the loaded icons are kept
+        :param file_paths
+        :return:
+        """
+        file_paths = list(file_paths)
+        if file_paths == self.__files:
+            return
+        new_paths = set(file_paths)
+        row = len(self.__files) - 1
+        while row >= 0:
+            if self.__files[row] in new_paths:
+                row -= 1
+                continue
+            # Remove the run of rows ending here
+            first_row = row
+            while first_row > 0 and self.__files[first_row - 1] not in new_paths:
+                first_row -= 1
+            self.beginRemoveRows(QModelIndex(), first_row, row)
+            del self.__files[first_row:row + 1]
+            self.__update_rows()
+            self.endRemoveRows()
+            row = first_row - 1
+
+        kept_paths = set(self.__files)
+        if [path for path in file_paths if path in kept_paths] != self.__files:
+            self.beginResetModel()
+            self.__files = file_paths
+            self.__update_rows()
+            self.__loader.cancel_pending()
+            self.__requested.clear()
+            self.endResetModel()
+            return
+
+        row = 0
+        while row < len(file_paths):
+            if row < len(self.__files) and self.__files[row] == file_paths[row]:
+                row += 1
+                continue
+            # Insert the run of new rows starting here
+            last_row = row
+            while last_row + 1 < len(file_paths) and file_paths[last_row + 1] not in kept_paths:
+                last_row += 1
+            self.beginInsertRows(QModelIndex(), row, last_row)
+            self.__files[row:row] = file_paths[row:last_row + 1]
+            self.__update_rows()
+            self.endInsertRows()
+            row = last_row + 1
+
+    def __update_rows(self):
+        """
+        Index the rows by file path
+        :return:
+        """
+        self.__rows = {path: row for row, path in enumerate(self.__files)}
+
+    def get_files(self):
+        """
+        Getter of the displayed images
+        :return: file paths
+        """
+        return list(self.__files)
+
+    def cancel_pending(self):
+        """
+        Forget the thumbnails requested but not loaded yet, the displayed rows request theirs again when painted
+        :return:
+        """
+        self.__loader.cancel_pending()
+        self.__requested.clear()
+
+    def shutdown(self):
+        """
+        Stop loading the thumbnails and drop the icons
+        :return:
+        """
+        self.__loader.shutdown()
+        self.__icons.clear()
+
+    def rowCount(self, parent=QModelIndex()):
+        """
+        Number of images
+        :param parent
+        :return: row count
+        """
+        return 0 if parent.isValid() else len(self.__files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """
+        Data of an image, its thumbnail is requested when its icon is asked (only for the displayed rows)
+        :param index
+        :param role
+        :return: data
+        """
+        if not index.isValid() or index.row() >= len(self.__files):
+            return None
+        path = self.__files[index.row()]
+        if role == Qt.UserRole:
+            return path
+        if role == Qt.ToolTipRole:
+            return os.path.basename(path)
+        if role == Qt.DecorationRole:
+            return self.__get_icon(path)
+        return None
+
+    def __get_icon(self, path):
+        """
+        Get the icon of an image, a placeholder while its thumbnail is loading
+        :param path
+        :return: QIcon
+        """
+        icon = self.__icons.get(path)
+        if icon is not None:
+            self.__icons.move_to_end(path)
+            return icon
+        thumbnail = self.__thumbnail_cache.get_cached(path)
+        if thumbnail is not None:
+            return self.__add_icon(path, thumbnail)
+        if path not in self.__requested:
+            self.__requested.add(path)
+            self.__loader.request(path)
+        return self.__placeholder_icon
+
+    def __add_icon(self, path, thumbnail):
+        """
+        Keep the icon of a thumbnail, the least recently displayed are dropped
+        :param path
+        :param thumbnail: QImage
+        :return: QIcon
+        """
+        icon = QIcon(QPixmap.fromImage(thumbnail))
+        self.__icons[path] = icon
+        while len(self.__icons) > self.__max_icons:
+            self.__icons.popitem(last=False)
+        return icon
+
+    def __on_thumbnail_loaded(self, path, thumbnail):
+        """
+        On thumbnail loaded refresh its row
+        :param path
+        :param thumbnail: QImage
+        :return:
+        """
+        self.__requested.discard(path)
+        row = self.__rows.get(path)
+        if row is None or thumbnail.isNull():
+            return
+        self.__add_icon(path, thumbnail)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class OutputGalleryView(QListView):
+    def __init__(self, strip_height, icon_size, parent=None):
+        """
+        Constructor. Displays the images in a strip or in a grid
+        :param strip_height: height of the view in strip mode
+        :param icon_size: QSize of the icons
+        :param parent
+        """
+        super(OutputGalleryView, self).__init__(parent)
+        self.__strip_height = strip_height
+        self.setIconSize(icon_size)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(200)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setMovement(QListView.Static)
+        self.setResizeMode(QListView.Adjust)
+        self.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSpacing(2)
+        self.horizontalScrollBar().valueChanged.connect(self.__on_scrolled)
+        self.verticalScrollBar().valueChanged.connect(self.__on_scrolled)
+        self.set_grid_mode(False)
+
+    def set_grid_mode(self, grid_mode):
+        """
+        Display the images in a grid scrolling vertically, or in a strip scrolling horizontally
+        :param grid_mode
+        :return:
+        """
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(grid_mode)
+        if grid_mode:
+            self.setMinimumHeight(self.__strip_height * 3)
+            self.setMaximumHeight(_MAX_WIDGET_SIZE)
+        else:
+            self.setFixedHeight(self.__strip_height)
+        self.scrollTo(self.currentIndex())
+
+    def is_grid_mode(self):
+        """
+        Getter of whether the images are displayed in a grid
+        :return: is grid mode
+        """
+        return self.isWrapping()
+
+    def __on_scrolled(self):
+        """
+        On scroll forget the thumbnails of the rows scrolled away, the displayed ones are requested when painted
+        :return:
+        """
+        if self.model() is not None:
+            self.model().cancel_pending()
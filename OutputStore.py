@@ -0,0 +1,415 @@
+"""
+Store of the generated images : a folder by dream job and a SQLite index of the jobs
+
+Queries : python -m style_dreamer.OutputStore [--prompt TEXT | --contains TEXT | --seed SEED] [--last N]
+Rebuild : python -m style_dreamer.OutputStore --rebuild
+"""
+
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from .ImageWriter import write_file_atomic
+from .ResultCache import describe_params
+
+_LOGGER = logging.getLogger(__name__)
+
+OUTPUTS_DIRNAME = "outputs"
+INDEX_FILENAME = "index.sqlite"
+# Description of a job written in its folder, the index can be rebuilt from them
+JOB_FILENAME = "job.json"
+
+DEFAULT_QUERY_LIMIT = 50
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dir TEXT NOT NULL UNIQUE,
+    created TEXT NOT NULL,
+    label TEXT,
+    endpoint TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed INTEGER,
+    width INTEGER,
+    height INTEGER,
+    steps INTEGER,
+    cfg_scale REAL,
+    nb_images INTEGER,
+    duration REAL,
+    outcome TEXT,
+    error TEXT,
+    params TEXT,
+    timings TEXT,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+CREATE INDEX IF NOT EXISTS jobs_prompt ON jobs (prompt);
+CREATE INDEX IF NOT EXISTS jobs_seed ON jobs (seed);
+CREATE TABLE IF NOT EXISTS files (
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT,
+    size INTEGER,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+
+
+def hash_file(filepath):
+    """
+    Compute the sha256 of a file
+    :param filepath
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class OutputStore:
+    def __init__(self, root_dir):
+        """
+        Constructor
+        :param root_dir: folder of the job folders and of the index
+        """
+        self.__root_dir = root_dir
+        self.__index_path = os.path.join(root_dir, INDEX_FILENAME)
+        # The schema is created once, here or by the first connection if the index couldn't be opened yet
+        self.__schema_lock = threading.Lock()
+        self.__schema_created = False
+        try:
+            self.__create_schema()
+        except (OSError, sqlite3.Error) as e:
+            _LOGGER.warning("Couldn't create the index %s : %s", self.__index_path, e)
+
+    def get_root_dir(self):
+        """
+        Getter of the folder of the job folders
+        :return: root dir
+        """
+        return self.__root_dir
+
+    def __open(self):
+        """
+        Open a connection to the index
+        :return: connection
+        """
+        os.makedirs(self.__root_dir, exist_ok=True)
+        connection = sqlite3.connect(self.__index_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    def __create_schema(self):
+        """
+        Create the tables of the index and migrate the older indexes, once
+        :return:
+        """
+        with self.__schema_lock:
+            if self.__schema_created:
+                return
+            connection = self.__open()
+            try:
+                connection.executescript(_SCHEMA)
+                # Indexes created before the last use of the jobs was tracked
+                if "last_used" not in [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]:
+                    connection.execute("ALTER TABLE jobs ADD COLUMN last_used REAL")
+                connection.commit()
+            finally:
+                connection.close()
+            self.__schema_created = True
+
+    @contextlib.contextmanager
+    def __connect(self):
+        """
+        Open a connection to the index in a transaction (a connection by call, the jobs are recorded from their
+        own threads)
+        :return: connection
+        """
+        if not self.__schema_created:
+            self.__create_schema()
+        connection = self.__open()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create_job_dir(self, job_id):
+        """
+        Create the folder of a new job, unique even for jobs started in the same second
+        :param job_id
+        :return: job dir
+        """
+        os.makedirs(self.__root_dir, exist_ok=True)
+        name = time.strftime("%Y%m%d_%H%M%S") + "_%d" % job_id
+        suffix = 0
+        while True:
+            job_dir = os.path.join(self.__root_dir, name if suffix == 0 else "%s_%d" % (name, suffix))
+            try:
+                os.mkdir(job_dir)
+                return job_dir
+            except FileExistsError:
+                suffix += 1
+
+    def record_job(self, job_dir, job_id, label, request_path, params, seed, output_filepaths, timings, outcome,
+                   error_msg, files_digests=None):
+        """
+        Describe a finished job in its folder and in the index
+        :param job_dir
+        :param job_id
+        :param label
+        :param request_path
+        :param params: request parameters (the images are replaced by their hash)
+        :param seed: seed of the first image
+        :param output_filepaths: images of the job
+        :param timings: dict of the durations and sizes of the job (see Telemetry.make_job_record)
+        :param outcome
+        :param error_msg
+        :param files_digests: dict path -> {"sha256", "size"} of the images hashed when they were written, the
+        other images are read again to be hashed
+        :return: job description
+        """
+        files_digests = files_digests or {}
+        files = []
+        for output_filepath in output_filepaths:
+            digest = files_digests.get(output_filepath)
+            try:
+                if digest is None:
+                    digest = {"sha256": hash_file(output_filepath), "size": os.path.getsize(output_filepath)}
+            except OSError:
+                _LOGGER.warning("Couldn't hash the output %s", output_filepath)
+                continue
+            files.append({"name": os.path.relpath(output_filepath, job_dir), "sha256": digest["sha256"],
+                          "size": digest["size"]})
+        params = dict(describe_params(params), seed=seed)
+        job_desc = {
+            "job": job_id,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "label": label,
+            "request_path": request_path,
+            "params": params,
+            "files": files,
+            "timings": timings,
+            "outcome": outcome,
+            "error": error_msg,
+        }
+        try:
+            write_file_atomic(os.path.join(job_dir, JOB_FILENAME), json.dumps(job_desc, indent=4).encode())
+            with self.__connect() as connection:
+                self.__insert_job(connection, job_dir, job_desc)
+        except (OSError, sqlite3.Error) as e:
+            _LOGGER.warning("Couldn't index the job %s : %s", job_dir, e)
+        return job_desc
+
+    def __insert_job(self, connection, job_dir, job_desc, last_used=None):
+        """
+        Insert or replace a job in the index
+        :param connection
+        :param job_dir
+        :param job_desc: content of the job file
+        :param last_used: timestamp of the last use of the job (its creation by default)
+        :return:
+        """
+        relative_dir = os.path.relpath(job_dir, self.__root_dir)
+        params = job_desc["params"]
+        timings = job_desc.get("timings") or {}
+        connection.execute("DELETE FROM jobs WHERE dir = ?", (relative_dir,))
+        cursor = connection.execute(
+            "INSERT INTO jobs (dir, created, label, endpoint, prompt, negative_prompt, seed, width, height, steps, "
+            "cfg_scale, nb_images, duration, outcome, error, params, timings, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (relative_dir, job_desc["created"], job_desc.get("label"),
+             job_desc.get("request_path", "").rsplit("/", 1)[-1], params.get("prompt"),
+             params.get("negative_prompt"), params.get("seed"), params.get("width"), params.get("height"),
+             params.get("steps"), params.get("cfg_scale"), len(job_desc["files"]), timings.get("duration"),
+             job_desc.get("outcome"), job_desc.get("error"), json.dumps(params), json.dumps(timings),
+             last_used if last_used is not None else datetime.datetime.fromisoformat(job_desc["created"]).timestamp()))
+        connection.executemany(
+            "INSERT INTO files (job_id, idx, path, sha256, size) VALUES (?, ?, ?, ?, ?)",
+            [(cursor.lastrowid, index, os.path.join(relative_dir, file["name"]), file["sha256"], file["size"])
+             for index, file in enumerate(job_desc["files"])])
+
+    def __get_jobs(self, where, args, limit):
+        """
+        Query the jobs, the newest first
+        :param where: SQL condition
+        :param args: arguments of the condition
+        :param limit
+        :return: list of job dicts with their absolute "dir" and "files"
+        """
+        with self.__connect() as connection:
+            rows = connection.execute("SELECT * FROM jobs WHERE %s ORDER BY created DESC, id DESC LIMIT ?" % where,
+                                      tuple(args) + (limit,)).fetchall()
+            jobs = []
+            for row in rows:
+                job = dict(row)
+                job["dir"] = os.path.join(self.__root_dir, job["dir"])
+                job["params"] = json.loads(job["params"])
+                job["timings"] = json.loads(job["timings"])
+                job["files"] = [os.path.join(self.__root_dir, file_row["path"]) for file_row in connection.execute(
+                    "SELECT path FROM files WHERE job_id = ? ORDER BY idx", (row["id"],))]
+                jobs.append(job)
+        return jobs
+
+    def get_last_jobs(self, limit=DEFAULT_QUERY_LIMIT):
+        """
+        Get the last jobs
+        :param limit
+        :return: jobs
+        """
+        return self.__get_jobs("1", [], limit)
+
+    def find_jobs_by_prompt(self, prompt, limit=DEFAULT_QUERY_LIMIT):
+        """
+        Get the jobs with a prompt
+        :param prompt
+        :param limit
+        :return: jobs
+        """
+        return self.__get_jobs("prompt = ?", [prompt], limit)
+
+    def find_jobs_by_text(self, text, limit=DEFAULT_QUERY_LIMIT):
+        """
+        Get the jobs whose prompt contains a text
+        :param text
+        :param limit
+        :return: jobs
+        """
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return self.__get_jobs("prompt LIKE ? ESCAPE '\\'", ["%" + escaped + "%"], limit)
+
+    def find_jobs_by_seed(self, seed, limit=DEFAULT_QUERY_LIMIT):
+        """
+        Get the jobs with a seed
+        :param seed
+        :param limit
+        :return: jobs
+        """
+        return self.__get_jobs("seed = ?", [seed], limit)
+
+    def find_job_by_file(self, sha256):
+        """
+        Get the job that generated an image
+        :param sha256: hash of the image
+        :return: job or None
+        """
+        jobs = self.__get_jobs("id IN (SELECT job_id FROM files WHERE sha256 = ?)", [sha256], 1)
+        return jobs[0] if len(jobs) > 0 else None
+
+    def mark_job_used(self, job_dir):
+        """
+        Set the last use of a job to now (the least recently used jobs are removed first by the storage quota)
+        :param job_dir
+        :return:
+        """
+        try:
+            with self.__connect() as connection:
+                connection.execute("UPDATE jobs SET last_used = ? WHERE dir = ?",
+                                   (time.time(), os.path.relpath(job_dir, self.__root_dir)))
+        except sqlite3.Error as e:
+            _LOGGER.warning("Couldn't mark the job %s as used : %s", job_dir, e)
+
+    def get_jobs_last_used(self):
+        """
+        Getter of the last use of the indexed jobs
+        :return: dict absolute job dir -> timestamp
+        """
+        with self.__connect() as connection:
+            rows = connection.execute("SELECT dir, last_used FROM jobs WHERE last_used IS NOT NULL").fetchall()
+        return {os.path.join(self.__root_dir, row["dir"]): row["last_used"] for row in rows}
+
+    def remove_job(self, job_dir):
+        """
+        Remove a job from the index (its folder is left as is)
+        :param job_dir
+        :return:
+        """
+        try:
+            with self.__connect() as connection:
+                connection.execute("DELETE FROM jobs WHERE dir = ?", (os.path.relpath(job_dir, self.__root_dir),))
+        except sqlite3.Error as e:
+            _LOGGER.warning("Couldn't remove the job %s from the index : %s", job_dir, e)
+
+    def rebuild_index(self):
+        """
+        Rebuild the index from the job files of the folders
+        :return: number of jobs indexed
+        """
+        job_dirs = []
+        for name in sorted(os.listdir(self.__root_dir)) if os.path.isdir(self.__root_dir) else []:
+            job_filepath = os.path.join(self.__root_dir, name, JOB_FILENAME)
+            if os.path.isfile(job_filepath):
+                job_dirs.append(os.path.join(self.__root_dir, name))
+        with self.__connect() as connection:
+            # The last uses are only in the index
+            last_used = {row["dir"]: row["last_used"] for row in connection.execute("SELECT dir, last_used FROM jobs")}
+            connection.execute("DELETE FROM jobs")
+            for job_dir in job_dirs:
+                try:
+                    with open(os.path.join(job_dir, JOB_FILENAME), "r") as file:
+                        job_desc = json.load(file)
+                    # Only the images still on the disk are indexed
+                    job_desc["files"] = [file for file in job_desc.get("files", [])
+                                         if os.path.isfile(os.path.join(job_dir, file["name"]))]
+                    self.__insert_job(connection, job_dir, job_desc,
+                                      last_used.get(os.path.relpath(job_dir, self.__root_dir)))
+                except (OSError, ValueError, KeyError) as e:
+                    _LOGGER.warning("Couldn't index the job %s : %s", job_dir, e)
+        _LOGGER.info("Index of %s rebuilt : %d jobs", self.__root_dir, len(job_dirs))
+        return len(job_dirs)
+
+
+def main(argv=None):
+    """
+    Query or rebuild the index of the outputs
+    :param argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Query the index of the Style Dreamer outputs")
+    parser.add_argument("--root", default=os.path.join(os.path.expanduser("~"), "style_dreamer", OUTPUTS_DIRNAME),
+                        help="folder of the job folders")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index from the job folders")
+    parser.add_argument("--prompt", help="jobs with this prompt")
+    parser.add_argument("--contains", help="jobs whose prompt contains this text")
+    parser.add_argument("--seed", type=int, help="jobs with this seed")
+    parser.add_argument("--last", type=int, default=DEFAULT_QUERY_LIMIT, help="max number of jobs listed")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s : %(message)s")
+
+    output_store = OutputStore(args.root)
+    if args.rebuild:
+        output_store.rebuild_index()
+        return 0
+    if args.prompt is not None:
+        jobs = output_store.find_jobs_by_prompt(args.prompt, args.last)
+    elif args.contains is not None:
+        jobs = output_store.find_jobs_by_text(args.contains, args.last)
+    elif args.seed is not None:
+        jobs = output_store.find_jobs_by_seed(args.seed, args.last)
+    else:
+        jobs = output_store.get_last_jobs(args.last)
+    for job in jobs:
+        print("%s  %-9s %3d images  seed %-10s %s" % (job["created"], job["outcome"], job["nb_images"], job["seed"],
+                                                      job["dir"]))
+        print("    " + (job["prompt"] or ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
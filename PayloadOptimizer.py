@@ -0,0 +1,108 @@
+import importlib.util
+import logging
+import os
+
+# Optional image libraries, PIL is preferred and Qt (available in Maya) is the fallback. Qt is imported only
+# when it is used so that the headless tools start fast
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_LOGGER = logging.getLogger(__name__)
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def is_available():
+    """
+    Getter of whether an image library is available to optimize the maps
+    :return: is available
+    """
+    return Image is not None or importlib.util.find_spec("PySide2") is not None
+
+
+def _is_16_bits_png(path):
+    """
+    Getter of whether a PNG has 16 bits by channel (bit depth of its header), PIL reads their colors in 8 bits
+    :param path
+    :return: is 16 bits
+    """
+    with open(path, "rb") as file:
+        header = file.read(25)
+    return len(header) == 25 and header.startswith(_PNG_SIGNATURE) and header[24] == 16
+
+
+def _optimize_with_pil(src_path, dst_path):
+    """
+    Re-encode a PNG with PIL, in grayscale if its channels are equal and without alpha if it is opaque
+    :param src_path
+    :param dst_path
+    :return:
+    """
+    with Image.open(src_path) as image:
+        image.load()
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        if has_alpha:
+            image = image.convert("RGBA")
+            if image.getchannel("A").getextrema() == (255, 255):
+                image = image.convert("RGB")
+                has_alpha = False
+        if image.mode == "RGB":
+            red, green, blue = image.split()
+            if red.tobytes() == green.tobytes() == blue.tobytes():
+                image = red
+        image.save(dst_path, "PNG", optimize=True, compress_level=9)
+
+
+def _optimize_with_qt(src_path, dst_path):
+    """
+    Re-encode a PNG with Qt, in grayscale if its colors are gray and it has no alpha
+    :param src_path
+    :param dst_path
+    :return:
+    """
+    from PySide2.QtGui import QImage
+    image = QImage(src_path)
+    if image.isNull():
+        raise OSError("Couldn't read %s" % src_path)
+    # The 16 bits maps (depth) would lose their precision in Grayscale8
+    formats_16_bits = [getattr(QImage, name) for name in ("Format_Grayscale16", "Format_RGBX64", "Format_RGBA64",
+                                                          "Format_RGBA64_Premultiplied") if hasattr(QImage, name)]
+    is_16_bits = image.depth() > 32 or image.format() in formats_16_bits
+    if not is_16_bits and not image.hasAlphaChannel() and image.isGrayscale():
+        image = image.convertToFormat(QImage.Format_Grayscale8)
+    # Quality 0 is the max compression for PNG
+    if not image.save(dst_path, "PNG", 0):
+        raise OSError("Couldn't write %s" % dst_path)
+
+
+def optimize_png(path):
+    """
+    Re-encode a control map in place in the smallest lossless form accepted by ControlNet (grayscale when
+    the channels are equal, max PNG compression). The file is left unchanged if it wouldn't be smaller, or if it has
+    16 bits by channel and PIL would be used
+    :param path
+    :return: (size before, size after)
+    """
+    size_before = os.path.getsize(path)
+    if not is_available():
+        return size_before, size_before
+    tmp_path = path + ".opt.png"
+    try:
+        if Image is not None:
+            if _is_16_bits_png(path):
+                return size_before, size_before
+            _optimize_with_pil(path, tmp_path)
+        else:
+            _optimize_with_qt(path, tmp_path)
+        size_after = os.path.getsize(tmp_path)
+        if size_after < size_before:
+            os.replace(tmp_path, path)
+            return size_before, size_after
+    except Exception:
+        _LOGGER.warning("Couldn't optimize the control map %s", path, exc_info=True)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size_before, size_before
@@ -0,0 +1,76 @@
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+# Interval between two polls (in seconds) at the start and the end of a server job
+FAST_POLL_INTERVAL = 0.25
+# Interval between two polls (in seconds) in the middle of a server job
+SLOW_POLL_INTERVAL = 1.5
+# Progress below or above which the fast interval is used
+_EDGE_PROGRESS = 0.1
+# Max interval between two polls (in seconds) while the server doesn't answer
+MAX_BACKOFF_INTERVAL = 15.0
+
+
+class ProgressPoller(threading.Thread):
+    def __init__(self, poll_fct, callback):
+        """
+        Constructor
+        :param poll_fct: function() -> progress response dict, or an int (error code) if the poll failed
+        :param callback: function(response) called after each poll (from the poller thread)
+        """
+        super().__init__(name="style_dreamer_progress", daemon=True)
+        self.__poll_fct = poll_fct
+        self.__callback = callback
+        self.__stop_event = threading.Event()
+        self.__nb_errors = 0
+        self.__nb_polls = 0
+
+    def get_nb_polls(self):
+        """
+        Getter of the number of polls done
+        :return: number of polls
+        """
+        return self.__nb_polls
+
+    def stop(self):
+        """
+        Stop polling, no callback is called after this
+        :return:
+        """
+        self.__stop_event.set()
+
+    def __get_interval(self, response):
+        """
+        Compute the wait before the next poll : fast at the start and the end of a server job, slow in the middle,
+        and an exponential backoff while the server doesn't answer
+        :param response
+        :return: interval
+        """
+        if type(response) is int:
+            self.__nb_errors += 1
+            return min(FAST_POLL_INTERVAL * 2 ** self.__nb_errors, MAX_BACKOFF_INTERVAL)
+        self.__nb_errors = 0
+        progress = response.get("progress", 0) or 0
+        if progress < _EDGE_PROGRESS or progress > 1 - _EDGE_PROGRESS:
+            return FAST_POLL_INTERVAL
+        return SLOW_POLL_INTERVAL
+
+    def run(self):
+        """
+        Poll until stopped
+        :return:
+        """
+        while not self.__stop_event.is_set():
+            try:
+                response = self.__poll_fct()
+            except Exception:
+                _LOGGER.exception("Progress poll failed")
+                response = -1
+            self.__nb_polls += 1
+            if self.__stop_event.is_set():
+                break
+            self.__callback(response)
+            self.__stop_event.wait(self.__get_interval(response))
+        _LOGGER.debug("Progress poller stopped after %d polls", self.__nb_polls)
@@ -0,0 +1,195 @@
+import json
+import logging
+import sys
+import zlib
+
+from .ControlMap import ControlMapSnapshot
+
+_LOGGER = logging.getLogger(__name__)
+
+# Small JSON pieces are gathered in blocks of this size before being sent
+_SEND_BLOCK_SIZE = 64 * 1024
+
+
+class StreamingJsonBody:
+    def __init__(self, params):
+        """
+        Constructor. The body is serialized while it is sent, the control map snapshots of the params are read
+        from the disk and encoded block by block so that the whole payload is never in memory
+        :param params: request parameters, the images may be ControlMapSnapshot
+        """
+        self.__params = params
+        self.__length = StreamingJsonBody.__get_length(params)
+
+    def __len__(self):
+        """
+        Length of the body, sent as Content-Length
+        :return: length
+        """
+        return self.__length
+
+    @staticmethod
+    def __dumps(value):
+        """
+        Serialize a JSON value without image
+        :param value
+        :return: bytes
+        """
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def get_original_length(self):
+        """
+        Getter of the length the body would have with the control maps before their optimization
+        :return: length
+        """
+        return StreamingJsonBody.__get_length(self.__params, True)
+
+    @staticmethod
+    def __get_length(value, original=False):
+        """
+        Compute the length of a serialized value
+        :param value
+        :param original: whether the control maps are counted before their optimization
+        :return: length
+        """
+        if isinstance(value, ControlMapSnapshot):
+            return value.get_base64_length(original) + 2
+        if isinstance(value, dict):
+            # Braces, colons and commas
+            length = 1 + len(value) * 2 if len(value) > 0 else 2
+            for key, item in value.items():
+                length += len(StreamingJsonBody.__dumps(key)) + StreamingJsonBody.__get_length(item, original)
+            return length
+        if isinstance(value, (list, tuple)):
+            length = 1 + len(value) if len(value) > 0 else 2
+            for item in value:
+                length += StreamingJsonBody.__get_length(item, original)
+            return length
+        return len(StreamingJsonBody.__dumps(value))
+
+    @staticmethod
+    def __iter_value(value):
+        """
+        Serialize a value piece by piece
+        :param value
+        :return: generator of bytes
+        """
+        if isinstance(value, ControlMapSnapshot):
+            yield b'"'
+            yield from value.iter_base64()
+            yield b'"'
+        elif isinstance(value, dict):
+            yield b"{"
+            for index, (key, item) in enumerate(value.items()):
+                if index > 0:
+                    yield b","
+                yield StreamingJsonBody.__dumps(key) + b":"
+                yield from StreamingJsonBody.__iter_value(item)
+            yield b"}"
+        elif isinstance(value, (list, tuple)):
+            yield b"["
+            for index, item in enumerate(value):
+                if index > 0:
+                    yield b","
+                yield from StreamingJsonBody.__iter_value(item)
+            yield b"]"
+        else:
+            yield StreamingJsonBody.__dumps(value)
+
+    def __iter__(self):
+        """
+        Serialize the body in blocks (a new iteration starts again from the beginning, for a retry)
+        :return: generator of bytes
+        """
+        buffer = []
+        buffer_size = 0
+        for piece in StreamingJsonBody.__iter_value(self.__params):
+            buffer.append(piece)
+            buffer_size += len(piece)
+            if buffer_size >= _SEND_BLOCK_SIZE:
+                yield b"".join(buffer)
+                buffer = []
+                buffer_size = 0
+        if buffer_size > 0:
+            yield b"".join(buffer)
+
+
+class GzipJsonBody:
+    def __init__(self, body):
+        """
+        Constructor. The body is compressed while it is sent, its length isn't known in advance so it is sent
+        with a chunked transfer encoding
+        :param body: StreamingJsonBody
+        """
+        self.__body = body
+        self.__sent_length = 0
+
+    def get_sent_length(self):
+        """
+        Getter of the number of compressed bytes of the last iteration
+        :return: sent length
+        """
+        return self.__sent_length
+
+    def __iter__(self):
+        """
+        Compress the body in blocks
+        :return: generator of bytes
+        """
+        self.__sent_length = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for block in self.__body:
+            compressed = compressor.compress(block)
+            if compressed:
+                self.__sent_length += len(compressed)
+                yield compressed
+        compressed = compressor.flush()
+        self.__sent_length += len(compressed)
+        yield compressed
+
+
+def get_peak_memory():
+    """
+    Get the peak memory used by the process (psutil is used if available)
+    :return: peak memory in bytes, None if it can't be measured
+    """
+    try:
+        import psutil
+        memory_info = psutil.Process().memory_info()
+        # Only available on Windows
+        if hasattr(memory_info, "peak_wset"):
+            return memory_info.peak_wset
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def log_peak_memory(payload_size):
+    """
+    Log the peak memory used by the process after a request
+    :param payload_size: size of the request body in bytes
+    :return:
+    """
+    peak_memory = get_peak_memory()
+    if peak_memory is not None:
+        _LOGGER.info("Payload of %.1f MB sent, peak client memory %.1f MB", payload_size / 1024 ** 2,
+                     peak_memory / 1024 ** 2)
+
+
+def log_payload_sizes(original_length, optimized_length, sent_length):
+    """
+    Log the upload savings of a request
+    :param original_length: length of the body with the control maps before their optimization
+    :param optimized_length: length of the body with the optimized control maps
+    :param sent_length: length actually sent (compressed or not)
+    :return:
+    """
+    _LOGGER.info("Payload : %.2f MB before optimization, %.2f MB optimized, %.2f MB sent (%.0f%% saved)",
+                 original_length / 1024 ** 2, optimized_length / 1024 ** 2, sent_length / 1024 ** 2,
+                 100 * (1 - sent_length / original_length) if original_length > 0 else 0)
@@ -0,0 +1,241 @@
+import codecs
+import json
+import re
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_VALUE_SPECIAL = re.compile(r'["\\{}\[\],]')
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Parser states
+_START = 0
+_KEY_OR_END = 1
+_KEY = 2
+_COLON = 3
+_VALUE_START = 4
+_ARRAY_ITEM = 5
+_ARRAY_STRING = 6
+_RAW_VALUE = 7
+_AFTER_VALUE = 8
+_DONE = 9
+
+
+class StreamingResponseDecoder:
+    """
+    Incremental parser of a Stable Diffusion API response body.
+    The strings of the streamed array (the images) are handed one by one to a callback as soon as they are
+    complete, every other top-level value is parsed normally, so only one image is held in memory at a time.
+    """
+
+    def __init__(self, image_callback, streamed_key="images"):
+        """
+        Constructor
+        :param image_callback: function(index, string) called for each string of the streamed array
+        :param streamed_key: top-level key of the streamed array
+        """
+        self.__image_callback = image_callback
+        self.__streamed_key = streamed_key
+        self.__utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.__state = _START
+        self.__key_parts = []
+        self.__key = None
+        self.__nb_images = 0
+        self.__image_parts = []
+        self.__raw_parts = []
+        self.__raw_depth = 0
+        self.__raw_in_string = False
+        self.__pending_escape = False
+        self.__values = {}
+
+    def get_nb_images(self):
+        """
+        Getter of the number of images already handed to the callback
+        :return: number of images
+        """
+        return self.__nb_images
+
+    def feed(self, chunk):
+        """
+        Parse a new chunk of the body
+        :param chunk: bytes
+        :return:
+        """
+        text = self.__utf8_decoder.decode(chunk)
+        pos = 0
+        length = len(text)
+        while pos < length:
+            state = self.__state
+            if state == _ARRAY_STRING:
+                pos = self.__feed_array_string(text, pos)
+            elif state == _RAW_VALUE:
+                pos = self.__feed_raw_value(text, pos)
+            elif state == _KEY:
+                pos = self.__feed_key(text, pos)
+            else:
+                char = text[pos]
+                if char.isspace():
+                    pos += 1
+                    continue
+                pos = self.__feed_structure(char, text, pos)
+
+    def close(self):
+        """
+        End the parsing
+        :return: dict of the top-level values (without the streamed array)
+        """
+        self.feed(b"")
+        self.__utf8_decoder.decode(b"", final=True)
+        if self.__state != _DONE:
+            raise ValueError("Truncated response body")
+        return self.__values
+
+    def __feed_structure(self, char, text, pos):
+        """
+        Handle a structural character of the top-level object
+        :param char
+        :param text
+        :param pos
+        :return: next position
+        """
+        state = self.__state
+        if state == _START and char == "{":
+            self.__state = _KEY_OR_END
+        elif state == _KEY_OR_END and char == '"':
+            self.__key_parts = []
+            self.__state = _KEY
+        elif state in (_KEY_OR_END, _AFTER_VALUE) and char == "}":
+            self.__state = _DONE
+        elif state == _AFTER_VALUE and char == ",":
+            self.__state = _KEY_OR_END
+        elif state == _COLON and char == ":":
+            self.__state = _VALUE_START
+        elif state == _VALUE_START and self.__key == self.__streamed_key and char == "[":
+            self.__state = _ARRAY_ITEM
+        elif state == _VALUE_START:
+            self.__raw_parts = []
+            self.__raw_depth = 0
+            self.__raw_in_string = False
+            self.__state = _RAW_VALUE
+            return pos
+        elif state == _ARRAY_ITEM and char == '"':
+            self.__image_parts = []
+            self.__state = _ARRAY_STRING
+        elif state == _ARRAY_ITEM and char == ",":
+            pass
+        elif state == _ARRAY_ITEM and char == "]":
+            self.__state = _AFTER_VALUE
+        else:
+            raise ValueError("Unexpected character %r in response body" % char)
+        return pos + 1
+
+    def __feed_key(self, text, pos):
+        """
+        Parse a part of a top-level key
+        :param text
+        :param pos
+        :return: next position
+        """
+        end = text.find('"', pos)
+        if end == -1:
+            self.__key_parts.append(text[pos:])
+            return len(text)
+        self.__key_parts.append(text[pos:end])
+        self.__key = "".join(self.__key_parts)
+        self.__state = _COLON
+        return end + 1
+
+    def __feed_array_string(self, text, pos):
+        """
+        Parse a part of a string of the streamed array
+        :param text
+        :param pos
+        :return: next position
+        """
+        length = len(text)
+        while pos < length:
+            if self.__pending_escape:
+                escaped = _SIMPLE_ESCAPES.get(text[pos])
+                if escaped is None:
+                    raise ValueError("Unsupported escape sequence in streamed string")
+                self.__image_parts.append(escaped)
+                self.__pending_escape = False
+                pos += 1
+                continue
+            match = _STRING_SPECIAL.search(text, pos)
+            if match is None:
+                self.__image_parts.append(text[pos:])
+                return length
+            end = match.start()
+            self.__image_parts.append(text[pos:end])
+            if match.group() == "\\":
+                self.__pending_escape = True
+                pos = end + 1
+            else:
+                image = "".join(self.__image_parts)
+                self.__image_parts = []
+                self.__state = _ARRAY_ITEM
+                self.__image_callback(self.__nb_images, image)
+                self.__nb_images += 1
+                return end + 1
+        return pos
+
+    def __feed_raw_value(self, text, pos):
+        """
+        Parse a part of a non streamed top-level value
+        :param text
+        :param pos
+        :return: next position
+        """
+        length = len(text)
+        while pos < length:
+            if self.__pending_escape:
+                self.__raw_parts.append(text[pos])
+                self.__pending_escape = False
+                pos += 1
+                continue
+            regex = _STRING_SPECIAL if self.__raw_in_string else _VALUE_SPECIAL
+            match = regex.search(text, pos)
+            if match is None:
+                self.__raw_parts.append(text[pos:])
+                return length
+            end = match.start()
+            char = match.group()
+            if self.__raw_in_string:
+                self.__raw_parts.append(text[pos:end + 1])
+                if char == "\\":
+                    self.__pending_escape = True
+                else:
+                    self.__raw_in_string = False
+                    if self.__raw_depth == 0:
+                        return self.__end_raw_value(end + 1)
+                pos = end + 1
+            elif char == '"':
+                self.__raw_parts.append(text[pos:end + 1])
+                self.__raw_in_string = True
+                pos = end + 1
+            elif char in "{[":
+                self.__raw_parts.append(text[pos:end + 1])
+                self.__raw_depth += 1
+                pos = end + 1
+            elif self.__raw_depth > 0:
+                self.__raw_parts.append(text[pos:end + 1])
+                if char in "}]":
+                    self.__raw_depth -= 1
+                    if self.__raw_depth == 0:
+                        return self.__end_raw_value(end + 1)
+                pos = end + 1
+            else:
+                # Scalar ended by the separator or the end of the object which is parsed as structure
+                self.__raw_parts.append(text[pos:end])
+                return self.__end_raw_value(end)
+        return pos
+
+    def __end_raw_value(self, pos):
+        """
+        Store the completed top-level value
+        :param pos: position after the value
+        :return: pos
+        """
+        self.__values[self.__key] = json.loads("".join(self.__raw_parts))
+        self.__raw_parts = []
+        self.__state = _AFTER_VALUE
+        return pos
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+
+_INDEX_FILENAME = "index.json"
+# The access times updated by the hits are saved at most once in this delay (seconds), the other changes at once
+_INDEX_SAVE_DELAY = 30
+# Parameters holding images, they are replaced by the hash of their content in the key
+_IMAGE_KEYS = ("init_images", "input_image", "mask")
+
+
+def _normalize(value):
+    """
+    Replace the images of the parameters by the hash of their content
+    :param value
+    :return: normalized value
+    """
+    if isinstance(value, dict):
+        return {key: _normalize_image(item) if key in _IMAGE_KEYS else _normalize(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _normalize_image(value):
+    """
+    Replace an image (or list of images) by the hash of its content
+    :param value
+    :return: normalized value
+    """
+    if isinstance(value, (list, tuple)):
+        return [_normalize_image(item) for item in value]
+    if hasattr(value, "get_digest"):
+        # Control map snapshot, already hashed
+        return "sha256:" + value.get_digest()
+    if isinstance(value, str) and len(value) > 0:
+        return "sha256:" + hashlib.sha256(value.encode()).hexdigest()
+    return value
+
+
+def describe_params(params):
+    """
+    Get the parameters with their images replaced by the hash of their content, they can be serialized in JSON
+    :param params
+    :return: described params
+    """
+    return _normalize(params)
+
+
+def make_cache_key(params):
+    """
+    Compute the key of a request : hash of the normalized parameters and of the content of its images
+    :param params
+    :return: key
+    """
+    normalized = json.dumps(describe_params(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Constructor
+        :param cache_dir
+        :param max_size: max size of the cached images in bytes
+        """
+        self.__cache_dir = cache_dir
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        self.__nb_hits = 0
+        self.__nb_misses = 0
+        self.__index = {}
+        # Access times not saved yet
+        self.__index_dirty = False
+        self.__index_save_time = 0
+        self.__load_index()
+
+    def __get_index_path(self):
+        """
+        Get the path of the index file
+        :return: index path
+        """
+        return os.path.join(self.__cache_dir, _INDEX_FILENAME)
+
+    def __get_entry_dir(self, key):
+        """
+        Get the folder of the images of an entry
+        :param key
+        :return: entry dir
+        """
+        return os.path.join(self.__cache_dir, key[:2], key)
+
+    def __load_index(self):
+        """
+        Load the index file
+        :return:
+        """
+        try:
+            with open(self.__get_index_path(), "r") as file:
+                self.__index = json.load(file)
+        except (OSError, ValueError):
+            self.__index = {}
+
+    def __save_index(self):
+        """
+        Save the index file (called with the lock held)
+        :return:
+        """
+        try:
+            os.makedirs(self.__cache_dir, exist_ok=True)
+            tmp_path = self.__get_index_path() + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.__index, file)
+            os.replace(tmp_path, self.__get_index_path())
+        except OSError:
+            _LOGGER.warning("Couldn't save the index of the cache", exc_info=True)
+        self.__index_dirty = False
+        self.__index_save_time = time.time()
+
+    def flush(self):
+        """
+        Save the access times not saved yet
+        :return:
+        """
+        with self.__lock:
+            if self.__index_dirty:
+                self.__save_index()
+
+    @staticmethod
+    def __copy_file(src, dst):
+        """
+        Copy a file. The cache and the dream folders don't share their files (no hard links) so that the size of
+        each one is what removing it frees
+        :param src
+        :param dst
+        :return:
+        """
+        if os.path.exists(dst):
+            os.remove(dst)
+        shutil.copyfile(src, dst)
+
+    def get_stats(self):
+        """
+        Get the hits and misses of the cache
+        :return: dict of stats
+        """
+        with self.__lock:
+            return {
+                "hits": self.__nb_hits,
+                "misses": self.__nb_misses,
+                "entries": len(self.__index),
+                "size": sum(entry["size"] for entry in self.__index.values()),
+            }
+
+    def get(self, key, output_filepaths):
+        """
+        Copy the cached images of a request to the output filepaths. The copy is done without the lock so the other
+        chunks of the dream can be looked up or stored meanwhile
+        :param key
+        :param output_filepaths
+        :return: output filepaths or None if the request isn't cached
+        """
+        with self.__lock:
+            entry = self.__index.get(key)
+            if entry is None or entry["nb_images"] != len(output_filepaths):
+                self.__nb_misses += 1
+                return None
+        entry_dir = self.__get_entry_dir(key)
+        try:
+            for index, output_filepath in enumerate(output_filepaths):
+                ResultCache.__copy_file(os.path.join(entry_dir, "%d.png" % index), output_filepath)
+        except OSError:
+            with self.__lock:
+                self.__nb_misses += 1
+                # Images deleted from the disk, unless the entry was evicted or stored again meanwhile
+                if self.__index.get(key) is entry:
+                    del self.__index[key]
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    self.__save_index()
+            return None
+        with self.__lock:
+            entry["last_access"] = time.time()
+            self.__nb_hits += 1
+            self.__index_dirty = True
+            if time.time() - self.__index_save_time >= _INDEX_SAVE_DELAY:
+                self.__save_index()
+        return list(output_filepaths)
+
+    def put(self, key, output_filepaths):
+        """
+        Store the images of a request. They are copied without the lock in a folder of their own then moved in place
+        :param key
+        :param output_filepaths
+        :return:
+        """
+        entry_dir = self.__get_entry_dir(key)
+        tmp_dir = "%s.%d.tmp" % (entry_dir, threading.get_ident())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        size = 0
+        try:
+            os.makedirs(tmp_dir)
+            for index, output_filepath in enumerate(output_filepaths):
+                cached_path = os.path.join(tmp_dir, "%d.png" % index)
+                ResultCache.__copy_file(output_filepath, cached_path)
+                size += os.path.getsize(cached_path)
+        except OSError:
+            _LOGGER.warning("Couldn't store the result in the cache", exc_info=True)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self.__lock:
+            try:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+            except OSError:
+                _LOGGER.warning("Couldn't store the result in the cache", exc_info=True)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            self.__index[key] = {"nb_images": len(output_filepaths), "size": size, "last_access": time.time()}
+            self.__evict()
+            self.__save_index()
+
+    def __evict(self):
+        """
+        Remove the least recently used entries while the cache is too big
+        :return:
+        """
+        total_size = sum(entry["size"] for entry in self.__index.values())
+        for key in sorted(self.__index, key=lambda k: self.__index[k]["last_access"]):
+            if total_size <= self.__max_size:
+                break
+            total_size -= self.__index[key]["size"]
+            del self.__index[key]
+            shutil.rmtree(self.__get_entry_dir(key), ignore_errors=True)
+
+    def clear(self):
+        """
+        Remove every entry
+        :return:
+        """
+        with self.__lock:
+            for key in list(self.__index):
+                shutil.rmtree(self.__get_entry_dir(key), ignore_errors=True)
+            self.__index = {}
+            self.__save_index()
+
+    def log_stats(self):
+        """
+        Log the hits and misses of the cache
+        :return:
+        """
+        stats = self.get_stats()
+        _LOGGER.info("Result cache : %d hits, %d misses, %d entries (%.1f MB)", stats["hits"], stats["misses"],
+                     stats["entries"], stats["size"] / 1024 ** 2)
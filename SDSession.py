@@ -0,0 +1,141 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_LOGGER = logging.getLogger(__name__)
+
+# (connect timeout, read timeout) in seconds for each endpoint kind
+DEFAULT_TIMEOUTS = {
+    "dream": (10, 10000),
+    "progress": (5, 10),
+    "interrupt": (5, 10),
+    "model_list": (5, 30),
+}
+
+DEFAULT_POOL_SIZE = 4
+
+
+class SDSession:
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeouts=None):
+        """
+        Constructor
+        :param pool_size: max number of kept-alive connections per server
+        :param timeouts: dict endpoint kind -> (connect, read) timeout overriding the defaults
+        """
+        self.__pool_size = pool_size
+        self.__timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts is not None:
+            self.__timeouts.update(timeouts)
+        self.__lock = threading.Lock()
+        self.__nb_requests = {}
+        self.__session = None
+        self.__adapter = None
+        self.__open()
+
+    def __open(self):
+        """
+        Create the underlying pooled session
+        :return:
+        """
+        self.__adapter = HTTPAdapter(pool_connections=self.__pool_size, pool_maxsize=self.__pool_size)
+        self.__session = requests.Session()
+        self.__session.mount("http://", self.__adapter)
+        self.__session.mount("https://", self.__adapter)
+        self.__session.headers.update({
+            "User-Agent": "",
+            "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate, br",
+            "Connection": "keep-alive",
+        })
+
+    def get_timeout(self, endpoint):
+        """
+        Getter of the timeout of an endpoint kind
+        :param endpoint
+        :return: (connect, read) timeout
+        """
+        return self.__timeouts.get(endpoint, DEFAULT_TIMEOUTS["dream"])
+
+    def set_timeout(self, endpoint, timeout):
+        """
+        Setter of the timeout of an endpoint kind
+        :param endpoint
+        :param timeout: (connect, read) timeout or a single value for both
+        :return:
+        """
+        self.__timeouts[endpoint] = timeout
+
+    def request(self, endpoint, method, url, **kwargs):
+        """
+        Send a request through the pooled session
+        :param endpoint: endpoint kind used to choose the timeout
+        :param method
+        :param url
+        :param kwargs: forwarded to requests
+        :return: response
+        """
+        kwargs.setdefault("timeout", self.get_timeout(endpoint))
+        with self.__lock:
+            self.__nb_requests[endpoint] = self.__nb_requests.get(endpoint, 0) + 1
+        return self.__session.request(method, url, **kwargs)
+
+    def get(self, endpoint, url, **kwargs):
+        """
+        Send a GET request through the pooled session
+        :param endpoint
+        :param url
+        :param kwargs
+        :return: response
+        """
+        return self.request(endpoint, "GET", url, **kwargs)
+
+    def post(self, endpoint, url, **kwargs):
+        """
+        Send a POST request through the pooled session
+        :param endpoint
+        :param url
+        :param kwargs
+        :return: response
+        """
+        return self.request(endpoint, "POST", url, **kwargs)
+
+    def get_stats(self):
+        """
+        Get the connection reuse statistics of the session
+        :return: dict of stats
+        """
+        nb_connections = 0
+        nb_pool_requests = 0
+        pools = self.__adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            nb_connections += pool.num_connections
+            nb_pool_requests += pool.num_requests
+        with self.__lock:
+            requests_by_endpoint = dict(self.__nb_requests)
+        return {
+            "requests": sum(requests_by_endpoint.values()),
+            "requests_by_endpoint": requests_by_endpoint,
+            "connections": nb_connections,
+            "reused": max(nb_pool_requests - nb_connections, 0),
+        }
+
+    def log_stats(self):
+        """
+        Log the connection reuse statistics
+        :return:
+        """
+        stats = self.get_stats()
+        _LOGGER.info("HTTP session : %d requests, %d connections opened, %d reused (%s)",
+                     stats["requests"], stats["connections"], stats["reused"], stats["requests_by_endpoint"])
+
+    def close(self):
+        """
+        Close every pooled connection
+        :return:
+        """
+        self.__session.close()
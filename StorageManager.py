@@ -0,0 +1,346 @@
+"""
+Quota of the generated images : the least recently used dreams are removed above a size or an age,
+the pinned ones are kept. The control map snapshots left behind (by a crash for instance) are removed above an age
+
+Usage : python -m style_dreamer.StorageManager [--quota 20G] [--max-age DAYS] [--snapshot-max-age DAYS] [--legacy]
+[--dry-run]
+"""
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+from .OutputStore import OutputStore, OUTPUTS_DIRNAME
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_STORAGE_QUOTA = 20 * 1024 ** 3
+# Max age in seconds of the control map snapshots. They are removed once no dream uses them, the older ones were
+# left by a crash
+DEFAULT_SNAPSHOT_MAX_AGE = 24 * 3600
+# Folder of the control map snapshots in the style_dreamer folder
+SNAPSHOTS_DIRNAME = "snapshots"
+# Quota of the dreams of the Style Dreamer window (500M, 20G...), no cleanup if it isn't set
+STORAGE_QUOTA_ENV_VAR = "STYLE_DREAMER_STORAGE_QUOTA"
+# Marker of a pinned dream folder, never removed
+PINNED_FILENAME = ".pinned"
+# Images written directly in the style_dreamer folder before the output folders, only removed on demand
+_LEGACY_OUTPUT_PATTERN = re.compile(r"^output_\d{8}_\d{6}(_\d+)?\.png$")
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text):
+    """
+    Parse a size like 500M or 20G
+    :param text
+    :return: size in bytes
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", text.upper())
+    if match is None:
+        raise ValueError("Invalid size %s" % text)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def get_env_storage_quota():
+    """
+    Get the quota of the dreams set in the environment
+    :return: quota in bytes, None if it isn't set or is invalid
+    """
+    text = os.environ.get(STORAGE_QUOTA_ENV_VAR, "")
+    if text == "":
+        return None
+    try:
+        return parse_size(text)
+    except ValueError as e:
+        _LOGGER.warning("%s ignored : %s", STORAGE_QUOTA_ENV_VAR, e)
+        return None
+
+
+def is_pinned(path):
+    """
+    Getter of whether a dream folder is pinned
+    :param path: dream folder
+    :return: is pinned
+    """
+    return os.path.isfile(os.path.join(path, PINNED_FILENAME))
+
+
+def set_pinned(path, pinned):
+    """
+    Pin or unpin a dream folder
+    :param path: dream folder
+    :param pinned
+    :return:
+    """
+    marker_path = os.path.join(path, PINNED_FILENAME)
+    if pinned:
+        open(marker_path, "a").close()
+    elif os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def _get_file_size(stat, seen_inodes):
+    """
+    Get the size of a file, a file with several hard links is only counted once
+    :param stat: stat of the file
+    :param seen_inodes: set of the (device, inode) of the hard-linked files already counted
+    :return: size in bytes
+    """
+    if stat.st_nlink > 1:
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in seen_inodes:
+            return 0
+        seen_inodes.add(inode)
+    return stat.st_size
+
+
+def _get_size(path, seen_inodes):
+    """
+    Get the size of a file or of a folder
+    :param path
+    :param seen_inodes: set of the (device, inode) of the hard-linked files already counted
+    :return: size in bytes
+    """
+    if not os.path.isdir(path):
+        return _get_file_size(os.stat(path), seen_inodes)
+    size = 0
+    for dir_path, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += _get_file_size(os.stat(os.path.join(dir_path, filename)), seen_inodes)
+            except OSError:
+                continue
+    return size
+
+
+class StorageManager:
+    def __init__(self, output_dir, quota=DEFAULT_STORAGE_QUOTA, max_age=None, output_store=None,
+                 include_legacy=False, snapshot_max_age=DEFAULT_SNAPSHOT_MAX_AGE):
+        """
+        Constructor
+        :param output_dir: style_dreamer folder
+        :param quota: max size in bytes of the dreams
+        :param max_age: max age in seconds of the dreams since their last use (None for no limit)
+        :param output_store: OutputStore indexing the dream folders and their last use (updated when they are
+        removed)
+        :param include_legacy: whether the images of the older versions (output_*.png of the style_dreamer folder)
+        are removed too
+        :param snapshot_max_age: max age in seconds of the control map snapshots (None to keep them)
+        """
+        self.__output_dir = output_dir
+        self.__quota = quota
+        self.__max_age = max_age
+        self.__include_legacy = include_legacy
+        self.__snapshot_max_age = snapshot_max_age
+        self.__output_store = output_store or OutputStore(os.path.join(output_dir, OUTPUTS_DIRNAME))
+        self.__thread = None
+        self.__thread_lock = threading.Lock()
+        self.__last_report = None
+
+    def set_quota(self, quota):
+        """
+        Setter of the max size in bytes of the dreams
+        :param quota
+        :return:
+        """
+        self.__quota = quota
+
+    def set_max_age(self, max_age):
+        """
+        Setter of the max age in seconds of the dreams since their last use (None for no limit)
+        :param max_age
+        :return:
+        """
+        self.__max_age = max_age
+
+    def get_last_report(self):
+        """
+        Getter of the report of the last cleanup
+        :return: report or None
+        """
+        return self.__last_report
+
+    def __list_items(self):
+        """
+        List the removable items : the dream folders, and the images of the older versions if they are included.
+        The last use of a dream comes from the index, its folder modification time if it isn't indexed
+        :return: list of (path, size, last used, pinned)
+        """
+        items = []
+        seen_inodes = set()
+        outputs_dir = self.__output_store.get_root_dir()
+        if os.path.isdir(outputs_dir):
+            try:
+                jobs_last_used = self.__output_store.get_jobs_last_used()
+            except sqlite3.Error as e:
+                _LOGGER.warning("Couldn't read the last use of the dreams : %s", e)
+                jobs_last_used = {}
+            for name in os.listdir(outputs_dir):
+                path = os.path.join(outputs_dir, name)
+                if not os.path.isdir(path):
+                    # Index of the folders
+                    continue
+                try:
+                    last_used = jobs_last_used.get(path)
+                    if last_used is None:
+                        last_used = os.stat(path).st_mtime
+                    size = _get_size(path, seen_inodes)
+                except OSError:
+                    continue
+                items.append((path, size, last_used, is_pinned(path)))
+        if self.__include_legacy and os.path.isdir(self.__output_dir):
+            for name in os.listdir(self.__output_dir):
+                if _LEGACY_OUTPUT_PATTERN.match(name):
+                    path = os.path.join(self.__output_dir, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    items.append((path, _get_file_size(stat, seen_inodes), stat.st_mtime, False))
+        return items
+
+    def __list_snapshots(self):
+        """
+        List the control map snapshots
+        :return: list of (path, size, modification time)
+        """
+        snapshots = []
+        snapshot_dir = os.path.join(self.__output_dir, SNAPSHOTS_DIRNAME)
+        if os.path.isdir(snapshot_dir):
+            for name in os.listdir(snapshot_dir):
+                path = os.path.join(snapshot_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if os.path.isfile(path):
+                    snapshots.append((path, stat.st_size, stat.st_mtime))
+        return snapshots
+
+    def cleanup(self, dry_run=False, protected_paths=()):
+        """
+        Remove the least recently used dreams until they fit in the quota, and the ones older than the max age.
+        The snapshots older than their max age are removed too, they don't count in the quota
+        :param dry_run: only report what would be removed
+        :param protected_paths: dream folders and snapshots kept (the ones of the queued dreams for instance)
+        :return: report dict
+        """
+        start = time.perf_counter()
+        protected_paths = set(os.path.normpath(path) for path in protected_paths)
+        items = sorted(self.__list_items(), key=lambda item: item[2])
+        snapshots = self.__list_snapshots() if self.__snapshot_max_age is not None else []
+        dreams_size = sum(size for _, size, _, _ in items)
+        total_size = dreams_size + sum(size for _, size, _ in snapshots)
+        now = time.time()
+        size_left = total_size
+        removed = []
+        for path, size, modification_time in snapshots:
+            if now - modification_time <= self.__snapshot_max_age or os.path.normpath(path) in protected_paths:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    _LOGGER.warning("Couldn't remove %s : %s", path, e)
+                    continue
+            removed.append(path)
+            size_left -= size
+        dreams_size_left = dreams_size
+        for path, size, last_used, pinned in items:
+            if pinned or os.path.normpath(path) in protected_paths:
+                continue
+            too_old = self.__max_age is not None and now - last_used > self.__max_age
+            if not too_old and dreams_size_left <= self.__quota:
+                continue
+            if not dry_run:
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                        self.__output_store.remove_job(path)
+                    else:
+                        os.remove(path)
+                except OSError as e:
+                    _LOGGER.warning("Couldn't remove %s : %s", path, e)
+                    continue
+            removed.append(path)
+            size_left -= size
+            dreams_size_left -= size
+        report = {
+            "dry_run": dry_run,
+            "total_size": total_size,
+            "reclaimed": total_size - size_left,
+            "remaining_size": size_left,
+            "quota": self.__quota,
+            "nb_removed": len(removed),
+            "removed": removed,
+            "nb_pinned": len([item for item in items if item[3]]),
+            "duration": time.perf_counter() - start,
+        }
+        if len(removed) > 0 or dry_run:
+            _LOGGER.info("%s %.1f MB in %d items, %.1f MB used for a quota of %.1f MB",
+                         "Would reclaim" if dry_run else "Reclaimed", report["reclaimed"] / 1024 ** 2, len(removed),
+                         size_left / 1024 ** 2, self.__quota / 1024 ** 2)
+        self.__last_report = report
+        return report
+
+    def cleanup_in_background(self, protected_paths=()):
+        """
+        Run a cleanup on a thread, skipped if one is already running
+        :param protected_paths: dream folders and snapshots kept (the ones of the queued dreams for instance)
+        :return: whether a cleanup was started
+        """
+        with self.__thread_lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return False
+            self.__thread = threading.Thread(target=self.cleanup, kwargs={"protected_paths": list(protected_paths)},
+                                             name="style_dreamer_storage", daemon=True)
+            self.__thread.start()
+        return True
+
+
+def main(argv=None):
+    """
+    Remove the dreams above the quota
+    :param argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Remove the least recently used Style Dreamer dreams")
+    parser.add_argument("--dir", default=os.path.join(os.path.expanduser("~"), "style_dreamer"),
+                        help="style_dreamer folder")
+    parser.add_argument("--quota", default="%dG" % (DEFAULT_STORAGE_QUOTA // 1024 ** 3),
+                        help="max size of the dreams (500M, 20G...)")
+    parser.add_argument("--max-age", type=float, help="max number of days since the last use of a dream")
+    parser.add_argument("--snapshot-max-age", type=float, default=DEFAULT_SNAPSHOT_MAX_AGE / (24 * 3600),
+                        help="max number of days of the control map snapshots (the Style Dreamer window makes them "
+                             "again if needed)")
+    parser.add_argument("--legacy", action="store_true",
+                        help="also remove the output_*.png images written by the older versions")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be removed")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s : %(message)s")
+
+    try:
+        quota = parse_size(args.quota)
+    except ValueError as e:
+        _LOGGER.error(str(e))
+        return 2
+    max_age = args.max_age * 24 * 3600 if args.max_age is not None else None
+    report = StorageManager(args.dir, quota, max_age, include_legacy=args.legacy,
+                            snapshot_max_age=args.snapshot_max_age * 24 * 3600).cleanup(args.dry_run)
+    for path in report["removed"]:
+        print(("would remove " if args.dry_run else "removed ") + path)
+    print("%.1f MB %s, %.1f MB left, %d pinned dreams kept" % (
+        report["reclaimed"] / 1024 ** 2, "reclaimable" if args.dry_run else "reclaimed",
+        report["remaining_size"] / 1024 ** 2, report["nb_pinned"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
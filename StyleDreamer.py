@@ -33,16 +33,11 @@ from .DepthDetail import *
 
 _FILE_NAME_PREFS = "style_dreamer"
 
-DEPTH_NAME = "style_dreamer_depth"
-NORMAL_NAME = "style_dreamer_normal"
-EDGES_NAME = "style_dreamer_edges"
-
-_MAX_BATCH_SIZE = 8
-
 # ######################################################################################################################
 
-BEAUTY_NAME = "beauty"
-
+from .DreamParams import *
+from .DreamPlanner import *
+from .Tracing import *
 from .ControlNetManager import *
 
 
@@ -134,6 +129,11 @@ class StyleDreamer(QDialog):
         return arnold_renderer_loaded
 
     def __init__(self, url_server, prnt=wrapInstance(int(omui.MQtUtil.mainWindow()), QWidget)):
+        """
+        Constructor
+        :param url_server: url or list of urls of the servers sharing the dreams
+        :param prnt
+        """
         super(StyleDreamer, self).__init__(prnt)
 
         # Common Preferences (common preferences on all tools)
@@ -144,7 +144,8 @@ class StyleDreamer(QDialog):
         # Model attributes
         self.__refreshing = False
         self.__url_server = url_server
-        self.__controlnet_manager = ControlNetManager(self.__url_server, self.__on_dream_done)
+        self.__controlnet_manager = ControlNetManager(self.__url_server, self.__on_dream_done, self.__refresh_queue,
+                                                      storage_quota=get_env_storage_quota())
         self.__block_new_request = False
         self.__previous_seed = -1
         self.__depth_types = {
@@ -455,6 +456,32 @@ class StyleDreamer(QDialog):
         lyt_depth_type.addWidget(self.__ui_depth_type_cbb)
         option_layout.addLayout(lyt_depth_type, 1)
 
+        # Dream Queue
+        lyt_queue = QHBoxLayout()
+        lyt_queue.setSpacing(4)
+        self.__ui_queue_list = QListWidget()
+        self.__ui_queue_list.setFixedHeight(70)
+        self.__ui_queue_list.setToolTip("Dreams running and waiting for the server")
+        self.__ui_queue_list.itemSelectionChanged.connect(self.__refresh_queue_btn)
+        lyt_queue.addWidget(self.__ui_queue_list)
+        lyt_queue_btn = QVBoxLayout()
+        lyt_queue_btn.setSpacing(2)
+        self.__ui_queue_up_btn = QPushButton("Up")
+        self.__ui_queue_up_btn.setToolTip("Run the selected dream earlier")
+        self.__ui_queue_up_btn.clicked.connect(partial(self.__on_move_queued_dream, -1))
+        lyt_queue_btn.addWidget(self.__ui_queue_up_btn)
+        self.__ui_queue_down_btn = QPushButton("Down")
+        self.__ui_queue_down_btn.setToolTip("Run the selected dream later")
+        self.__ui_queue_down_btn.clicked.connect(partial(self.__on_move_queued_dream, 1))
+        lyt_queue_btn.addWidget(self.__ui_queue_down_btn)
+        self.__ui_queue_cancel_btn = QPushButton("Cancel")
+        self.__ui_queue_cancel_btn.setToolTip("Remove the selected dream from the queue or stop it on the server "
+                                              "(the images already generated are kept)")
+        self.__ui_queue_cancel_btn.clicked.connect(self.__on_cancel_queued_dream)
+        lyt_queue_btn.addWidget(self.__ui_queue_cancel_btn)
+        lyt_queue.addLayout(lyt_queue_btn)
+        main_lyt.addLayout(lyt_queue)
+
         lyt_bottom = QGridLayout()
         lyt_bottom.setColumnStretch(0, 1)
         lyt_bottom.setColumnStretch(1, 1)
@@ -476,10 +503,18 @@ class StyleDreamer(QDialog):
         self.__render_btn.setFixedHeight(30)
         self.__render_btn.clicked.connect(self.__on_render)
         lyt_bottom.addWidget(self.__render_btn, 0, 3, 1, 1)
+        lyt_dream = QHBoxLayout()
+        lyt_dream.setSpacing(4)
         self.__dream_btn = QPushButton("Dream Style")
         self.__dream_btn.setFixedHeight(30)
         self.__dream_btn.clicked.connect(self.__on_dream)
-        lyt_bottom.addWidget(self.__dream_btn, 1, 3, 1, 1)
+        lyt_dream.addWidget(self.__dream_btn, 3)
+        self.__sweep_btn = QPushButton("Sweep")
+        self.__sweep_btn.setFixedHeight(30)
+        self.__sweep_btn.setToolTip("Dream a grid of variations of the parameters")
+        self.__sweep_btn.clicked.connect(self.__on_sweep)
+        lyt_dream.addWidget(self.__sweep_btn, 1)
+        lyt_bottom.addLayout(lyt_dream, 1, 3, 1, 1)
         main_lyt.addLayout(lyt_bottom)
 
     def __refresh_ui(self):
@@ -492,6 +527,7 @@ class StyleDreamer(QDialog):
         self.__refresh_sliders()
         self.__refresh_depth_type()
         self.__refresh_btn()
+        self.__refresh_queue()
 
     def __refresh_prompt(self):
         """
@@ -533,6 +569,68 @@ class StyleDreamer(QDialog):
         """
         self.__render_btn.setEnabled(not self.__block_new_request)
         self.__dream_btn.setEnabled(not self.__block_new_request)
+        self.__sweep_btn.setEnabled(not self.__block_new_request)
+
+    def __refresh_queue(self):
+        """
+        Refresh the list of queued dreams
+        :return:
+        """
+        selected_ids = [item.data(Qt.UserRole) for item in self.__ui_queue_list.selectedItems()]
+        self.__ui_queue_list.clear()
+        for job in self.__controlnet_manager.get_dream_jobs():
+            item = QListWidgetItem("#%d  [%s]  %s" % (job.get_id(), job.get_status().value, job.get_label()))
+            item.setData(Qt.UserRole, job.get_id())
+            if job.get_status() == DreamJobStatus.Running:
+                item.setForeground(QColor(120, 200, 125))
+            self.__ui_queue_list.addItem(item)
+            if job.get_id() in selected_ids:
+                item.setSelected(True)
+        self.__refresh_queue_btn()
+
+    def __refresh_queue_btn(self):
+        """
+        Refresh the buttons of the queue (only the pending dreams can be moved)
+        :return:
+        """
+        job = self.__get_selected_queued_job()
+        pending = job is not None and job.get_status() == DreamJobStatus.Pending
+        self.__ui_queue_up_btn.setEnabled(pending)
+        self.__ui_queue_down_btn.setEnabled(pending)
+        self.__ui_queue_cancel_btn.setEnabled(job is not None)
+
+    def __get_selected_queued_job(self):
+        """
+        Get the job selected in the queue
+        :return: job (None if no job is selected)
+        """
+        selected_items = self.__ui_queue_list.selectedItems()
+        if len(selected_items) != 1:
+            return None
+        job_id = selected_items[0].data(Qt.UserRole)
+        for job in self.__controlnet_manager.get_dream_jobs():
+            if job.get_id() == job_id:
+                return job
+        return None
+
+    def __on_move_queued_dream(self, offset):
+        """
+        Move the selected dream in the queue
+        :param offset
+        :return:
+        """
+        job = self.__get_selected_queued_job()
+        if job is not None:
+            self.__controlnet_manager.move_dream_job(job.get_id(), offset)
+
+    def __on_cancel_queued_dream(self):
+        """
+        Cancel the selected dream
+        :return:
+        """
+        job = self.__get_selected_queued_job()
+        if job is not None:
+            self.__controlnet_manager.cancel_dream_job(job.get_id())
 
     def __refresh_depth_type(self):
         """
@@ -682,16 +780,7 @@ class StyleDreamer(QDialog):
         Compute the batch count and Batch size according to the number of image
         :return:
         """
-        image_count = int(self.__image_count_slider.get_value())
-        if image_count <= 8:
-            return 1, image_count
-        else:
-            batch_size = 1
-            for bs in range(8, 0, -1):
-                if image_count % bs == 0:
-                    batch_size = bs
-                    break
-            return image_count / batch_size, batch_size
+        return get_batch_param(self.__image_count_slider.get_value())
 
     def __get_datas(self):
         """
@@ -721,16 +810,30 @@ class StyleDreamer(QDialog):
 
     def __on_dream(self):
         """
-        Submit the dream request
+        Submit the dream request to the queue
+        :return:
+        """
+        with trace_span("dream clicked", "ui"):
+            self.__previous_seed = self.__seed
+            datas = self.__get_datas()
+            self.__controlnet_manager.set_datas(datas)
+            self.__controlnet_manager.display_render(not self.__controlnet_manager.is_requesting_dream())
+            self.__controlnet_manager.queue_dream()
+
+    def __on_sweep(self):
+        """
+        Ask the values to sweep and submit a dream for each combination to the queue
         :return:
         """
-        self.__previous_seed = self.__seed
-        self.__block_new_request = True
-        self.__refresh_btn()
         datas = self.__get_datas()
-        self.__controlnet_manager.set_datas(datas)
-        self.__controlnet_manager.display_render()
-        threading.Thread(target=self.__controlnet_manager.request_controlnet).start()
+        sweep_dialog = SweepDialog(datas, self)
+        if sweep_dialog.exec_() != QDialog.Accepted:
+            return
+        with trace_span("sweep clicked", "ui"):
+            self.__previous_seed = self.__seed
+            self.__controlnet_manager.set_datas(datas)
+            self.__controlnet_manager.display_render(not self.__controlnet_manager.is_requesting_dream())
+            self.__controlnet_manager.queue_sweep(sweep_dialog.get_values_by_field())
 
     def __on_open_visualizer(self):
         """
@@ -747,29 +850,29 @@ class StyleDreamer(QDialog):
         self.__block_new_request = True
         self.__refresh_btn()
 
-        datas = self.__get_datas()
-        self.__controlnet_manager.set_datas(datas)
-        self.__controlnet_manager.prepare_cn_render()
-        self.__controlnet_manager.cn_render()
-        self.__controlnet_manager.display_render()
+        with trace_span("render clicked", "ui"):
+            datas = self.__get_datas()
+            self.__controlnet_manager.set_datas(datas)
+            self.__controlnet_manager.prepare_cn_render()
+            self.__controlnet_manager.cn_render()
+            self.__controlnet_manager.display_render()
 
         self.__block_new_request = False
         self.__refresh_btn()
 
-    def __on_dream_done(self,seed):
+    def __on_dream_done(self, seed):
         """
         Callback dream request
         :param seed
         :return:
         """
         self.__previous_seed = seed
-        self.__block_new_request = False
-        self.__refresh_btn()
+        self.__refresh_queue()
 
     def __on_open_web_ui(self):
         """
         Open Web UI and the render folder
         :return:
         """
-        webbrowser.open(self.__url_server)
+        webbrowser.open(self.__controlnet_manager.get_url_server())
         subprocess.Popen('explorer "'+self.__controlnet_manager.get_render_dir().replace("/","\\")+'"')
\ No newline at end of file
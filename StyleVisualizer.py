@@ -1,3 +1,4 @@
+import collections
 import os
 import sys
 from functools import partial
@@ -15,80 +16,260 @@ from PySide2.QtGui import *
 from common.utils import *
 
 import style_dreamer.StyleDreamer as sd
+from .Tracing import traced
+from .ThumbnailCache import ThumbnailCache, THUMBNAILS_DIRNAME
+from .OutputGallery import OutputGalleryModel, OutputGalleryView
+from .ImageLoader import ImageLoader, read_image
+from .ZoomViewer import ZoomView
+
+# Images kept decoded by the current image (the displayed one and its prefetched neighbours)
+_MAX_LOADED_IMAGES = 8
+_MAX_SCALED_PIXMAPS = 4
+# Milliseconds without resize before the current image is filtered smoothly
+_RESIZE_SETTLE_DELAY = 150
+# Min size at which the current image is decoded, so it isn't decoded again at each resize
+_MIN_LOAD_SIZE = 1024
+
+
+def _get_image_version(path):
+    """
+    Get the version of an image file : its modification time and size
+    :param path
+    :return: version (None if it doesn't exist)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 
 class CurrentImageLabel(QLabel):
-    def __init__(self, path):
+    def __init__(self, path, image_cache=None):
         """
-        Constructor
+        Constructor. The images are decoded in background at the size of the label, the neighbours of the displayed
+        one are prefetched
         :param path
+        :param image_cache: ImageBytesCache of the last written images
         """
         super(CurrentImageLabel, self).__init__()
         self.setFrameStyle(QFrame.StyledPanel)
-        self.__pixmap = QPixmap(path)
+        self.__image_cache = image_cache
+        self.__path = None
+        # path -> (version, QImage, size requested) of the last displayed and prefetched images
+        self.__images = collections.OrderedDict()
+        self.__requested = set()
+        self.__pixmap = None
+        # (width, height) -> displayed pixmap scaled smoothly at this size
+        self.__scaled_pixmaps = collections.OrderedDict()
+        self.__resizing = False
+        self.__resize_timer = QTimer(self)
+        self.__resize_timer.setSingleShot(True)
+        self.__resize_timer.setInterval(_RESIZE_SETTLE_DELAY)
+        self.__resize_timer.timeout.connect(self.__on_resize_settled)
+        self.__loader = ImageLoader(self.__load, self.__on_image_loaded, name="current image")
         self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
+        self.set_path(path)
+
+    def release(self):
+        """
+        Stop loading the images
+        :return:
+        """
+        self.__loader.shutdown()
 
     def paintEvent(self, event):
         """
-        Paint function
+        Paint function, the scaled pixmap is reused until the size changes and filtered smoothly once the resize ends
         :param event
         :return:
         """
+        if self.__pixmap is None:
+            return
         size = self.size()
+        scaled_pixmap = self.__scaled_pixmaps.get((size.width(), size.height()))
+        if scaled_pixmap is None:
+            if self.__resizing:
+                scaled_pixmap = self.__pixmap.scaled(size, Qt.KeepAspectRatio, Qt.FastTransformation)
+            else:
+                scaled_pixmap = self.__pixmap.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                self.__scaled_pixmaps[(size.width(), size.height())] = scaled_pixmap
+                while len(self.__scaled_pixmaps) > _MAX_SCALED_PIXMAPS:
+                    self.__scaled_pixmaps.popitem(last=False)
         painter = QPainter(self)
-        point = QtCore.QPoint(0, 0)
-        scaledPix = self.__pixmap.scaled(size, QtCore.Qt.KeepAspectRatio,
-                                         transformMode=QtCore.Qt.SmoothTransformation)
-        point.setX((size.width() - scaledPix.width()) / 2)
-        point.setY((size.height() - scaledPix.height()) / 2)
-        painter.drawPixmap(point, scaledPix)
+        painter.drawPixmap(QPoint((size.width() - scaled_pixmap.width()) // 2,
+                                  (size.height() - scaled_pixmap.height()) // 2), scaled_pixmap)
 
-    def set_path(self, path):
+    def resizeEvent(self, event):
         """
-        Change path of the Image and repaint it
-        :param path:
+        On resize paint with a fast filtering until the size settles
+        :param event
         :return:
         """
-        self.__pixmap = QPixmap(path)
-        self.repaint()
+        self.__resizing = True
+        self.__resize_timer.start()
+        super(CurrentImageLabel, self).resizeEvent(event)
+
+    def __on_resize_settled(self):
+        """
+        On resize settled repaint smoothly, and decode the image again if the label got bigger than it
+        :return:
+        """
+        self.__resizing = False
+        if self.__path is not None and self.__needs_load(self.__path):
+            self.__request(self.__path)
+        self.update()
+
+    def __get_load_size(self):
+        """
+        Get the size at which the images are decoded
+        :return: QSize
+        """
+        ratio = self.devicePixelRatioF()
+        return QSize(int(max(self.width(), _MIN_LOAD_SIZE) * ratio), int(max(self.height(), _MIN_LOAD_SIZE) * ratio))
+
+    def __needs_load(self, path):
+        """
+        Getter of whether an image has to be decoded : not loaded yet, modified since, or decoded smaller than
+        the label
+        :param path
+        :return: needs load
+        """
+        entry = self.__images.get(path)
+        if entry is None or entry[0] != _get_image_version(path):
+            return True
+        _, image, requested_size = entry
+        load_size = self.__get_load_size()
+        downscaled = image.width() >= requested_size.width() or image.height() >= requested_size.height()
+        return downscaled and (load_size.width() > requested_size.width() or
+                               load_size.height() > requested_size.height())
+
+    def __request(self, path):
+        """
+        Ask for an image to be decoded in background at the size of the label
+        :param path
+        :return:
+        """
+        load_size = self.__get_load_size()
+        key = (path, load_size.width(), load_size.height())
+        if key not in self.__requested:
+            self.__requested.add(key)
+            self.__loader.request(key)
+
+    def __load(self, key):
+        """
+        Decode an image (called on a worker thread)
+        :param key: path, width, height
+        :return: version, QImage
+        """
+        path, width, height = key
+        return _get_image_version(path), read_image(path, QSize(width, height), self.__image_cache)
+
+    def __on_image_loaded(self, key, result):
+        """
+        On image loaded display it if it is the current one
+        :param key: path, width, height
+        :param result: version, QImage
+        :return:
+        """
+        self.__requested.discard(key)
+        path, width, height = key
+        version, image = result
+        if image.isNull():
+            return
+        self.__images.pop(path, None)
+        self.__images[path] = (version, image, QSize(width, height))
+        while len(self.__images) > _MAX_LOADED_IMAGES:
+            self.__images.popitem(last=False)
+        if path == self.__path:
+            self.__display(image)
+
+    def __display(self, image):
+        """
+        Display a decoded image
+        :param image: QImage
+        :return:
+        """
+        self.__pixmap = QPixmap.fromImage(image)
+        self.__scaled_pixmaps.clear()
+        self.update()
+
+    @traced("load current image", "visualizer")
+    def set_path(self, path, neighbour_paths=()):
+        """
+        Change path of the Image, the previous one stays displayed until it is decoded
+        :param path
+        :param neighbour_paths: images likely displayed next, decoded in advance
+        :return:
+        """
+        # The last request is loaded first
+        for neighbour_path in reversed(neighbour_paths):
+            if self.__needs_load(neighbour_path):
+                self.__request(neighbour_path)
+        self.__path = path
+        if self.__needs_load(path):
+            self.__request(path)
+        if path in self.__images:
+            self.__images.move_to_end(path)
+            self.__display(self.__images[path][1])
 
 
 class CurrentImageLabelWidget(QWidget):
-    def __init__(self, path):
+    def __init__(self, path, image_cache=None):
         """
         Constructor
         :param path
+        :param image_cache: ImageBytesCache of the last written images
         """
         QWidget.__init__(self)
-        self.__label = CurrentImageLabel(path)
+        self.__label = CurrentImageLabel(path, image_cache)
 
         vb_layout = QVBoxLayout()
         vb_layout.setContentsMargins(4, 4, 4, 4)
         vb_layout.addWidget(self.__label)
         self.setLayout(vb_layout)
 
-    def set_path(self, path):
+    def set_path(self, path, neighbour_paths=()):
         """
         Change the Image path
         :param path
+        :param neighbour_paths: images likely displayed next, decoded in advance
         :return:
         """
-        self.__label.set_path(path)
+        self.__label.set_path(path, neighbour_paths)
+
+    def release(self):
+        """
+        Stop loading the images
+        :return:
+        """
+        self.__label.release()
 
 
 class StyleVisualizer(QDialog):
 
-    def __init__(self, controlnet_manager, prnt=wrapInstance(int(omui.MQtUtil.mainWindow()), QWidget)):
+    def __init__(self, controlnet_manager, image_cache=None, thumbnail_cache=None,
+                 prnt=wrapInstance(int(omui.MQtUtil.mainWindow()), QWidget)):
         """
         Constructor
         :param controlnet_manager
+        :param image_cache: ImageBytesCache of the last written images, displayed without reading the disk
+        :param thumbnail_cache: ThumbnailCache of the strips
         :param prnt
         """
         super(StyleVisualizer, self).__init__(prnt)
         # Model attributes
         self.__controlnet_manager = controlnet_manager
+        self.__image_cache = image_cache
+        self.__thumbnail_cache = thumbnail_cache or ThumbnailCache(
+            os.path.join(os.path.expanduser("~"), "style_dreamer", THUMBNAILS_DIRNAME), image_cache=image_cache)
         self.__current_image = None
+        # Images around the current one in its list, prefetched
+        self.__current_neighbours = []
         self.__input_files = []
+        # Items of the input list by file path, and the version of their icon
+        self.__input_items = {}
+        self.__input_versions = {}
         self.__input_used_files = []
         self.__output_files = []
         self.__request_eta = 0
@@ -168,12 +349,54 @@ class StyleVisualizer(QDialog):
         main_lyt.setSpacing(2)
         self.setLayout(main_lyt)
 
-        self.__ui_current_img = CurrentImageLabelWidget(os.path.dirname(__file__) + "/assets/place_holder_img.png")
-        main_lyt.addWidget(self.__ui_current_img, 6)
-
+        # Current image, fitted or inspected with zoom and pan
+        self.__ui_current_stack = QStackedWidget()
+        self.__ui_current_img = CurrentImageLabelWidget(os.path.dirname(__file__) + "/assets/place_holder_img.png",
+                                                        self.__image_cache)
+        self.__ui_current_stack.addWidget(self.__ui_current_img)
+        self.__ui_zoom_view = ZoomView(self.__image_cache)
+        self.__ui_zoom_view.flipped_changed.connect(self.__on_zoom_view_flipped)
+        self.__ui_current_stack.addWidget(self.__ui_zoom_view)
+        main_lyt.addWidget(self.__ui_current_stack, 6)
+
+        lyt_zoom = QHBoxLayout()
+        lyt_zoom.setSpacing(4)
+        self.__ui_zoom_btn = QPushButton("Zoom")
+        self.__ui_zoom_btn.setCheckable(True)
+        self.__ui_zoom_btn.setFixedHeight(20)
+        self.__ui_zoom_btn.setToolTip("Inspect the image at its full resolution with zoom and pan")
+        self.__ui_zoom_btn.toggled.connect(self.__on_zoom_toggled)
+        lyt_zoom.addWidget(self.__ui_zoom_btn)
+        lyt_zoom.addWidget(QLabel("Compare with"))
+        self.__ui_compare_cbb = QComboBox()
+        self.__ui_compare_cbb.setToolTip("Image displayed on the right of the split line")
+        self.__ui_compare_cbb.currentIndexChanged.connect(self.__on_compare_changed)
+        lyt_zoom.addWidget(self.__ui_compare_cbb)
+        self.__ui_split_slider = QSlider(Qt.Horizontal)
+        self.__ui_split_slider.setRange(0, 100)
+        self.__ui_split_slider.setValue(50)
+        self.__ui_split_slider.setToolTip("Position of the split line between the image and the compared one")
+        self.__ui_split_slider.valueChanged.connect(self.__on_split_changed)
+        lyt_zoom.addWidget(self.__ui_split_slider, 1)
+        self.__ui_flip_btn = QPushButton("Flip")
+        self.__ui_flip_btn.setCheckable(True)
+        self.__ui_flip_btn.setFixedHeight(20)
+        self.__ui_flip_btn.setToolTip("Display the compared image instead of the image (F)")
+        self.__ui_flip_btn.toggled.connect(self.__ui_zoom_view.set_flipped)
+        lyt_zoom.addWidget(self.__ui_flip_btn)
+        main_lyt.addLayout(lyt_zoom)
+
+        lyt_progress = QHBoxLayout()
+        lyt_progress.setSpacing(4)
         self.__progress_bar = QProgressBar()
         self.__progress_bar.setFixedHeight(15)
-        main_lyt.addWidget(self.__progress_bar)
+        lyt_progress.addWidget(self.__progress_bar)
+        self.__cancel_btn = QPushButton("Cancel")
+        self.__cancel_btn.setFixedHeight(20)
+        self.__cancel_btn.setToolTip("Stop the dream on the server (the images already generated are kept)")
+        self.__cancel_btn.clicked.connect(self.__on_cancel)
+        lyt_progress.addWidget(self.__cancel_btn)
+        main_lyt.addLayout(lyt_progress)
 
         # Input Files List
         lyt_input_files = QVBoxLayout()
@@ -204,16 +427,22 @@ class StyleVisualizer(QDialog):
         title_output_lbl.setSizePolicy(QSizePolicy.Maximum, QSizePolicy.Maximum)
         title_output_lyt.addWidget(title_output_lbl)
         title_output_lyt.addWidget(sd.StyleDreamer.get_separator())
+        self.__ui_grid_btn = QPushButton("Grid")
+        self.__ui_grid_btn.setCheckable(True)
+        self.__ui_grid_btn.setFixedHeight(20)
+        self.__ui_grid_btn.setToolTip("Display the output images in a grid")
+        self.__ui_grid_btn.toggled.connect(self.__on_grid_toggled)
+        title_output_lyt.addWidget(self.__ui_grid_btn)
         main_lyt.addLayout(title_output_lyt)
 
-        # Output files
-        self.__ui_list_output_file = QListWidget()
-        self.__ui_list_output_file.setIconSize(QSize(self.__ui_height_output_files_part + 36, 200))
-        self.__ui_list_output_file.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
-        self.__ui_list_output_file.setSpacing(2)
-        self.__ui_list_output_file.setFlow(QListWidget.LeftToRight)
-        self.__ui_list_output_file.setFixedHeight(self.__ui_height_output_files_part)
-        self.__ui_list_output_file.itemSelectionChanged.connect(self.__on_output_file_selected)
+        # Output files : only the thumbnails of the displayed images are loaded
+        icon_size = QSize(self.__ui_height_output_files_part + 36, 200)
+        self.__ui_list_output_file = OutputGalleryView(self.__ui_height_output_files_part, icon_size)
+        self.__output_model = OutputGalleryModel(self.__thumbnail_cache, icon_size, parent=self)
+        self.__ui_list_output_file.setModel(self.__output_model)
+        self.__ui_list_output_file.selectionModel().selectionChanged.connect(self.__on_output_file_selected)
+        self.__ui_list_output_file.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.__ui_list_output_file.customContextMenuRequested.connect(self.__on_output_context_menu)
         main_lyt.addWidget(self.__ui_list_output_file)
 
     def __refresh_ui(self):
@@ -225,6 +454,16 @@ class StyleVisualizer(QDialog):
         self.refresh_input_files()
         self.refresh_output_files()
         self.refresh_progress_bar()
+        self.__refresh_zoom_ui()
+
+    def release(self):
+        """
+        Stop loading the thumbnails of the output images and the current image
+        :return:
+        """
+        self.__output_model.shutdown()
+        self.__ui_current_img.release()
+        self.__ui_zoom_view.release()
 
     def set_focus_input(self):
         """
@@ -242,7 +481,8 @@ class StyleVisualizer(QDialog):
         """
         self.raise_()
         self.__ui_list_output_file.setFocus()
-        self.__ui_list_output_file.setCurrentItem(self.__ui_list_output_file.item(0))
+        if self.__output_model.rowCount() > 0:
+            self.__ui_list_output_file.setCurrentIndex(self.__output_model.index(0))
 
     def __refresh_current_img(self):
         """
@@ -250,37 +490,93 @@ class StyleVisualizer(QDialog):
         :return:
         """
         if self.__current_image is not None:
-            self.__ui_current_img.set_path(self.__current_image)
+            self.__ui_current_img.set_path(self.__current_image, self.__current_neighbours)
+            if self.__ui_zoom_btn.isChecked():
+                self.__ui_zoom_view.set_images(self.__current_image, self.__ui_compare_cbb.currentData())
 
-    def refresh_input_files(self):
+    def __refresh_zoom_ui(self):
+        """
+        Refresh the comparison controls, only enabled with the zoom
+        :return:
+        """
+        zoom = self.__ui_zoom_btn.isChecked()
+        compared = self.__ui_compare_cbb.currentData() is not None
+        self.__ui_compare_cbb.setEnabled(zoom)
+        self.__ui_split_slider.setEnabled(zoom and compared)
+        self.__ui_flip_btn.setEnabled(zoom and compared)
+
+    def __refresh_compare_files(self):
         """
-        Refresh the list of input images
+        Refresh the images the current one can be compared with : the beauty and the control maps
         :return:
         """
-        self.__ui_list_input_file.clear()
+        compared_path = self.__ui_compare_cbb.currentData()
+        self.__ui_compare_cbb.blockSignals(True)
+        self.__ui_compare_cbb.clear()
+        self.__ui_compare_cbb.addItem("Nothing", None)
         for name, file_path in self.__input_files:
-            item = QListWidgetItem()
+            self.__ui_compare_cbb.addItem(name, file_path)
+        index = self.__ui_compare_cbb.findData(compared_path)
+        self.__ui_compare_cbb.setCurrentIndex(max(index, 0))
+        self.__ui_compare_cbb.blockSignals(False)
+        if self.__ui_compare_cbb.currentData() != compared_path:
+            self.__on_compare_changed()
+
+    @traced("input thumbnails", "visualizer")
+    def refresh_input_files(self):
+        """
+        Refresh the list of input images : the items are only added, removed, recoloured or given a new icon when
+        their image was rendered again, so the selection is kept
+        :return:
+        """
+        file_paths = [file_path for _, file_path in self.__input_files]
+        for file_path in list(self.__input_items):
+            if file_path not in file_paths:
+                item = self.__input_items.pop(file_path)
+                del self.__input_versions[file_path]
+                self.__ui_list_input_file.takeItem(self.__ui_list_input_file.row(item))
+
+        for row, (name, file_path) in enumerate(self.__input_files):
+            item = self.__input_items.get(file_path)
+            if item is None:
+                item = QListWidgetItem()
+                item.setData(Qt.UserRole, file_path)
+                self.__input_items[file_path] = item
+                self.__input_versions[file_path] = None
+                self.__ui_list_input_file.insertItem(row, item)
+            elif self.__ui_list_input_file.row(item) != row:
+                self.__ui_list_input_file.insertItem(row, self.__ui_list_input_file.takeItem(
+                    self.__ui_list_input_file.row(item)))
             if file_path in self.__input_used_files:
-                item.setBackgroundColor(QColor(51, 120, 56))
-                item.setToolTip("<b>" + name + "</b> used")
+                tooltip = "<b>" + name + "</b> used"
+                color = QColor(51, 120, 56)
             else:
-                item.setBackgroundColor(QColor(169, 64, 64))
-                item.setToolTip("<b>" + name + "</b> rendered but not used")
-            item.setIcon(QIcon(file_path))
-            item.setData(Qt.UserRole, file_path)
-            self.__ui_list_input_file.addItem(item)
-
+                tooltip = "<b>" + name + "</b> rendered but not used"
+                color = QColor(169, 64, 64)
+            if item.toolTip() != tooltip:
+                item.setBackgroundColor(color)
+                item.setToolTip(tooltip)
+            version = _get_image_version(file_path)
+            if self.__input_versions[file_path] != version:
+                self.__input_versions[file_path] = version
+                item.setIcon(self.__get_icon(file_path))
+        self.__refresh_compare_files()
+
+    @traced("output thumbnails", "visualizer")
     def refresh_output_files(self):
         """
         Refresh the list of output images
         :return:
         """
-        self.__ui_list_output_file.clear()
-        for file_path in self.__output_files:
-            item = QListWidgetItem()
-            item.setIcon(QIcon(file_path))
-            item.setData(Qt.UserRole, file_path)
-            self.__ui_list_output_file.addItem(item)
+        self.__output_model.set_files(self.__output_files)
+
+    def __get_icon(self, file_path):
+        """
+        Get the icon of an image of the strips from its thumbnail
+        :param file_path
+        :return: QIcon
+        """
+        return QIcon(QPixmap.fromImage(self.__thumbnail_cache.get(file_path)))
 
     def refresh_progress_bar(self):
         """
@@ -289,6 +585,78 @@ class StyleVisualizer(QDialog):
         """
         self.__progress_bar.setEnabled(self.__controlnet_manager.is_requesting_dream())
         self.__progress_bar.setValue(self.__request_eta)
+        self.__cancel_btn.setEnabled(self.__controlnet_manager.is_displayed_dream_running())
+
+    def __on_cancel(self):
+        """
+        On Cancel clicked stop the displayed dream
+        :return:
+        """
+        self.__controlnet_manager.cancel_displayed_dream()
+
+    def __on_zoom_toggled(self, zoom):
+        """
+        On Zoom toggled inspect the current image with zoom and pan, or display it fitted
+        :param zoom
+        :return:
+        """
+        self.__ui_current_stack.setCurrentWidget(self.__ui_zoom_view if zoom else self.__ui_current_img)
+        self.__refresh_zoom_ui()
+        self.__refresh_current_img()
+        if zoom:
+            self.__ui_zoom_view.setFocus()
+
+    def __on_compare_changed(self):
+        """
+        On compared image changed display it on the right of the split line
+        :return:
+        """
+        if self.__ui_compare_cbb.currentData() is None:
+            self.__ui_flip_btn.setChecked(False)
+        self.__refresh_zoom_ui()
+        self.__refresh_current_img()
+
+    def __on_split_changed(self, value):
+        """
+        On split slider changed move the split line
+        :param value
+        :return:
+        """
+        self.__ui_zoom_view.set_split(value / 100)
+
+    def __on_zoom_view_flipped(self, flipped):
+        """
+        On zoom view flipped with its shortcut update the Flip button
+        :param flipped
+        :return:
+        """
+        self.__ui_flip_btn.blockSignals(True)
+        self.__ui_flip_btn.setChecked(flipped)
+        self.__ui_flip_btn.blockSignals(False)
+
+    def __on_grid_toggled(self, grid_mode):
+        """
+        On Grid toggled display the output images in a grid or in a strip
+        :param grid_mode
+        :return:
+        """
+        self.__ui_list_output_file.set_grid_mode(grid_mode)
+
+    def __on_output_context_menu(self, pos):
+        """
+        On right click on an output, pin or unpin its dream
+        :param pos
+        :return:
+        """
+        index = self.__ui_list_output_file.indexAt(pos)
+        if not index.isValid():
+            return
+        file_path = index.data(Qt.UserRole)
+        pinned = self.__controlnet_manager.is_output_pinned(file_path)
+        menu = QMenu(self)
+        pin_action = menu.addAction("Unpin the dream" if pinned else "Pin the dream (never removed by the quota)")
+        if menu.exec_(self.__ui_list_output_file.mapToGlobal(pos)) == pin_action:
+            self.__controlnet_manager.set_output_pinned(file_path, not pinned)
 
     def __on_input_file_selected(self):
         """
@@ -303,6 +671,9 @@ class StyleVisualizer(QDialog):
         :return:
         """
         self.__on_file_selected(self.__ui_list_output_file, self.__ui_list_input_file)
+        selected_indexes = self.__ui_list_output_file.selectionModel().selectedIndexes()
+        if len(selected_indexes) == 1:
+            self.__controlnet_manager.mark_output_used(selected_indexes[0].data(Qt.UserRole))
 
     def __on_file_selected(self, list_selection, list_unselection):
         """
@@ -311,10 +682,20 @@ class StyleVisualizer(QDialog):
         :param list_unselection
         :return:
         """
-        selected_items = list_selection.selectedItems()
+        selected_indexes = list_selection.selectionModel().selectedIndexes()
+        if len(selected_indexes) == 0:
+            # Selection cleared by the other list
+            return
         list_unselection.clearSelection()
-        if len(selected_items) == 1:
-            self.__current_image = selected_items[0].data(Qt.UserRole)
+        self.__current_neighbours = []
+        if len(selected_indexes) == 1:
+            self.__current_image = selected_indexes[0].data(Qt.UserRole)
+            # Next images browsed with the arrow keys
+            row = selected_indexes[0].row()
+            model = list_selection.model()
+            for neighbour_row in (row + 1, row - 1, row + 2, row - 2):
+                if 0 <= neighbour_row < model.rowCount():
+                    self.__current_neighbours.append(model.index(neighbour_row, 0).data(Qt.UserRole))
         else:
             self.__current_image = os.path.dirname(__file__) + "/assets/place_holder_img.png"
         self.__refresh_current_img()
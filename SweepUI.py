@@ -0,0 +1,224 @@
+from functools import partial
+from shiboken2 import wrapInstance
+
+import maya.OpenMayaUI as omui
+
+from PySide2 import QtCore
+from PySide2.QtWidgets import *
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+
+from .DreamSweep import *
+from .ImageLoader import ImageLoader
+
+
+class SweepDialog(QDialog):
+    def __init__(self, datas, prnt=wrapInstance(int(omui.MQtUtil.mainWindow()), QWidget)):
+        """
+        Constructor
+        :param datas: current datas, used to count the dreams of the sweep
+        :param prnt
+        """
+        super(SweepDialog, self).__init__(prnt)
+        self.__datas = datas
+        self.__values_by_field = []
+        self.__ui_fields = {}
+
+        self.setWindowTitle("Style Dreamer Sweep")
+        self.setMinimumWidth(450)
+        self.__create_ui()
+        self.__on_values_changed()
+
+    def __create_ui(self):
+        """
+        Create the ui
+        :return:
+        """
+        main_lyt = QVBoxLayout()
+        main_lyt.setContentsMargins(8, 10, 8, 10)
+        self.setLayout(main_lyt)
+
+        help_lbl = QLabel("Values of the fields to sweep, the other fields keep their value.\n"
+                          "Numbers : \"5, 7, 9\" or \"4:12:2\" (start:stop:step)    Texts : \"a cat | a dog\"")
+        help_lbl.setWordWrap(True)
+        main_lyt.addWidget(help_lbl)
+
+        form_lyt = QFormLayout()
+        for field in SWEEPABLE_FIELDS:
+            line_edit = QLineEdit()
+            line_edit.setPlaceholderText(str(self.__datas.get(field, "")))
+            line_edit.textChanged.connect(self.__on_values_changed)
+            form_lyt.addRow(field, line_edit)
+            self.__ui_fields[field] = line_edit
+        main_lyt.addLayout(form_lyt)
+
+        self.__ui_status_lbl = QLabel()
+        main_lyt.addWidget(self.__ui_status_lbl)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.__ui_ok_btn = buttons.button(QDialogButtonBox.Ok)
+        self.__ui_ok_btn.setText("Sweep")
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        main_lyt.addWidget(buttons)
+
+    def __on_values_changed(self):
+        """
+        Parse the values and display the number of dreams
+        :return:
+        """
+        try:
+            self.__values_by_field = [(field, parse_sweep_values(field, line_edit.text()))
+                                      for field, line_edit in self.__ui_fields.items()
+                                      if len(line_edit.text().strip()) > 0]
+            combinations = expand_sweep(self.__datas, self.__values_by_field) if self.__values_by_field else []
+            nb_dreams = len(combinations)
+            self.__ui_status_lbl.setText("%d dreams in %d server jobs" % (
+                nb_dreams, len(batch_sweep(self.__datas, combinations))))
+            self.__ui_ok_btn.setEnabled(nb_dreams > 0)
+        except ValueError as e:
+            self.__values_by_field = []
+            self.__ui_status_lbl.setText(str(e))
+            self.__ui_ok_btn.setEnabled(False)
+
+    def get_values_by_field(self):
+        """
+        Getter of the values of each swept field
+        :return: list of (field, values)
+        """
+        return self.__values_by_field
+
+
+class SweepGridWindow(QDialog):
+    def __init__(self, title, column_labels, row_labels, callback_select, thumbnail_cache,
+                 prnt=wrapInstance(int(omui.MQtUtil.mainWindow()), QWidget)):
+        """
+        Constructor. The thumbnails of the cells are loaded off the GUI thread
+        :param title
+        :param column_labels
+        :param row_labels
+        :param callback_select: function(output filepaths) called when a cell is clicked
+        :param thumbnail_cache: ThumbnailCache
+        :param prnt
+        """
+        super(SweepGridWindow, self).__init__(prnt)
+        self.__callback_select = callback_select
+        self.__thumbnail_cache = thumbnail_cache
+        self.__cells = {}
+        self.__cell_files = {}
+        # (row, column) -> path of the image displayed in the cell
+        self.__cell_thumbnail_paths = {}
+        self.__ui_icon_size = 128
+        self.__loader = ImageLoader(thumbnail_cache.get, self.__on_thumbnail_loaded, name="sweep_thumbnails")
+
+        self.setWindowTitle(title)
+        self.setWindowFlags(QtCore.Qt.Tool)
+        self.resize(800, 600)
+        self.__create_ui(column_labels, row_labels)
+
+    def __create_ui(self, column_labels, row_labels):
+        """
+        Create the ui
+        :param column_labels
+        :param row_labels
+        :return:
+        """
+        main_lyt = QVBoxLayout()
+        main_lyt.setContentsMargins(4, 4, 4, 4)
+        self.setLayout(main_lyt)
+        scroll_area = QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        main_lyt.addWidget(scroll_area)
+        grid_widget = QWidget()
+        grid_lyt = QGridLayout(grid_widget)
+        grid_lyt.setSpacing(4)
+        scroll_area.setWidget(grid_widget)
+
+        for column, label in enumerate(column_labels):
+            column_lbl = QLabel("<b>" + label + "</b>")
+            column_lbl.setAlignment(Qt.AlignCenter)
+            grid_lyt.addWidget(column_lbl, 0, column + 1)
+        for row, label in enumerate(row_labels):
+            row_lbl = QLabel("<b>" + label + "</b>")
+            row_lbl.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            grid_lyt.addWidget(row_lbl, row + 1, 0)
+            for column in range(len(column_labels)):
+                cell_btn = QToolButton()
+                cell_btn.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+                cell_btn.setIconSize(QSize(self.__ui_icon_size, self.__ui_icon_size))
+                cell_btn.setFixedSize(self.__ui_icon_size + 16, self.__ui_icon_size + 32)
+                cell_btn.setEnabled(False)
+                cell_btn.clicked.connect(partial(self.__on_cell_clicked, row, column))
+                grid_lyt.addWidget(cell_btn, row + 1, column + 1)
+                self.__cells[(row, column)] = cell_btn
+        grid_lyt.setRowStretch(len(row_labels) + 1, 1)
+        grid_lyt.setColumnStretch(len(column_labels) + 1, 1)
+
+    def set_cell_status(self, row, column, status):
+        """
+        Display the status of a dream in its cell
+        :param row
+        :param column
+        :param status
+        :return:
+        """
+        cell_btn = self.__cells[(row, column)]
+        if len(self.__cell_files.get((row, column), [])) == 0:
+            cell_btn.setText(status)
+        cell_btn.setToolTip(status)
+
+    def set_cell_files(self, row, column, output_filepaths, status):
+        """
+        Display the images of a dream in its cell
+        :param row
+        :param column
+        :param output_filepaths
+        :param status
+        :return:
+        """
+        cell_btn = self.__cells[(row, column)]
+        self.__cell_files[(row, column)] = list(output_filepaths)
+        if len(output_filepaths) > 0:
+            path = output_filepaths[0]
+            if self.__cell_thumbnail_paths.get((row, column)) != path:
+                self.__cell_thumbnail_paths[(row, column)] = path
+                thumbnail = self.__thumbnail_cache.get_cached(path)
+                if thumbnail is not None:
+                    cell_btn.setIcon(QIcon(QPixmap.fromImage(thumbnail)))
+                else:
+                    self.__loader.request(path)
+            cell_btn.setText("%d images" % len(output_filepaths))
+            cell_btn.setEnabled(True)
+        else:
+            cell_btn.setText(status)
+        cell_btn.setToolTip(status)
+
+    def __on_thumbnail_loaded(self, path, thumbnail):
+        """
+        On thumbnail loaded display it in the cells of its image
+        :param path
+        :param thumbnail: QImage
+        :return:
+        """
+        if thumbnail.isNull():
+            return
+        icon = QIcon(QPixmap.fromImage(thumbnail))
+        for cell, cell_path in self.__cell_thumbnail_paths.items():
+            if cell_path == path:
+                self.__cells[cell].setIcon(icon)
+
+    def release(self):
+        """
+        Stop loading the thumbnails
+        :return:
+        """
+        self.__loader.shutdown()
+
+    def __on_cell_clicked(self, row, column):
+        """
+        On cell clicked display its images in the visualizer
+        :param row
+        :param column
+        :return:
+        """
+        self.__callback_select(self.__cell_files.get((row, column), []))
@@ -0,0 +1,250 @@
+"""
+History of the dream jobs : one JSON record by job appended to a rotating file
+
+Summary : python -m style_dreamer.Telemetry [telemetry.jsonl] [--group-by width height steps ...]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+TELEMETRY_FILENAME = "telemetry.jsonl"
+# Size of the file before it is rotated, and number of rotated files kept
+DEFAULT_MAX_FILE_SIZE = 5 * 1024 ** 2
+DEFAULT_NB_ROTATED_FILES = 5
+
+# Settings grouping the records in the summary by default
+DEFAULT_GROUP_BY = ["endpoint", "width", "height", "nb_images", "steps", "controlnet_units"]
+# Durations summarized
+_SUMMARIZED_FIELDS = ["queue_wait", "generation", "generation_summed", "download", "decode", "write", "duration",
+                      "images_per_s"]
+_PERCENTILES = [50, 90, 99]
+
+
+def get_controlnet_units(params):
+    """
+    Get the names of the ControlNet models used by a dream
+    :param params
+    :return: list of model names
+    """
+    return [unit["model"] for unit in params.get("alwayson_scripts", {}).get("controlnet", {}).get("args", [])]
+
+
+def make_job_record(job_id, params, request_path, queue_wait, duration, requests_stats, nb_cached_images,
+                    nb_images, outcome, error_msg):
+    """
+    Build the record of a dream job
+    :param job_id
+    :param params: request parameters of the whole job
+    :param request_path
+    :param queue_wait: seconds between the submission and the start of the job
+    :param duration: seconds between the start and the end of the job
+    :param requests_stats: stats of each server call (see DreamClient.request_dream)
+    :param nb_cached_images: number of images taken from the result cache
+    :param nb_images: number of images received
+    :param outcome: "success", "partial", "failed" or "cancelled"
+    :param error_msg
+    :return: record
+    """
+    sent_stats = [stats for stats in requests_stats if "response" in stats]
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "job": job_id,
+        "endpoint": request_path.rsplit("/", 1)[-1],
+        "width": params["width"],
+        "height": params["height"],
+        "batch_count": int(params["n_iter"]),
+        "batch_size": int(params["batch_size"]),
+        "nb_images": int(params["n_iter"]) * int(params["batch_size"]),
+        "steps": params["steps"],
+        "cfg_scale": params["cfg_scale"],
+        "sampler": params["sampler_name"],
+        "controlnet_units": get_controlnet_units(params),
+        "servers": sorted(set(stats["url"].split("/sdapi/")[0] for stats in requests_stats)),
+        "nb_requests": len(requests_stats),
+        "queue_wait": queue_wait,
+        # Upload, server queue and generation until the response headers : wall clock from the first call to the
+        # last response (the chunks run in parallel on several servers), and server time summed over the calls
+        "generation": max(stats["response"] for stats in sent_stats) - min(stats["start"] for stats in sent_stats)
+        if len(sent_stats) > 0 else 0.0,
+        "generation_summed": sum(stats["response"] - stats["start"] for stats in sent_stats),
+        # Summed over the server calls
+        "download": sum(stats["end"] - stats["response"] for stats in sent_stats),
+        "decode": sum(stats["decode"] for stats in requests_stats),
+        "write": sum(stats["write"] for stats in requests_stats),
+        "duration": duration,
+        "images_per_s": nb_images / duration if duration > 0 else 0.0,
+        "bytes_sent": sum(stats.get("bytes_sent", 0) for stats in requests_stats),
+        "bytes_received": sum(stats["bytes_received"] for stats in requests_stats),
+        "nb_images_received": nb_images,
+        "nb_images_cached": nb_cached_images,
+        "outcome": outcome,
+        "error": error_msg,
+    }
+
+
+class TelemetryLog:
+    def __init__(self, filepath, max_file_size=DEFAULT_MAX_FILE_SIZE, nb_rotated_files=DEFAULT_NB_ROTATED_FILES):
+        """
+        Constructor
+        :param filepath: path of the JSONL file, the rotated files are suffixed by .1, .2...
+        :param max_file_size: size of the file before it is rotated
+        :param nb_rotated_files: number of rotated files kept
+        """
+        self.__filepath = filepath
+        self.__max_file_size = max_file_size
+        self.__nb_rotated_files = nb_rotated_files
+        self.__lock = threading.Lock()
+
+    def get_filepath(self):
+        """
+        Getter of the path of the current file
+        :return: filepath
+        """
+        return self.__filepath
+
+    def __rotate(self):
+        """
+        Shift the rotated files and the current one, the oldest is removed
+        :return:
+        """
+        for index in range(self.__nb_rotated_files - 1, 0, -1):
+            src = "%s.%d" % (self.__filepath, index)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (self.__filepath, index + 1))
+        if self.__nb_rotated_files > 0:
+            os.replace(self.__filepath, self.__filepath + ".1")
+        else:
+            os.remove(self.__filepath)
+
+    def append(self, record):
+        """
+        Append a record (may be called from several threads), an error is only logged
+        :param record
+        :return:
+        """
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.__lock:
+            try:
+                os.makedirs(os.path.dirname(self.__filepath), exist_ok=True)
+                if os.path.exists(self.__filepath) and \
+                        os.path.getsize(self.__filepath) + len(line) > self.__max_file_size:
+                    self.__rotate()
+                with open(self.__filepath, "a") as file:
+                    file.write(line)
+            except OSError as e:
+                _LOGGER.warning("Couldn't write the telemetry %s : %s", self.__filepath, e)
+
+
+def read_records(filepath):
+    """
+    Read the records of a telemetry file and of its rotated files, the oldest first
+    :param filepath
+    :return: records
+    """
+    filepaths = []
+    index = 1
+    while os.path.exists("%s.%d" % (filepath, index)):
+        filepaths.insert(0, "%s.%d" % (filepath, index))
+        index += 1
+    if os.path.exists(filepath):
+        filepaths.append(filepath)
+    records = []
+    for path in filepaths:
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Line cut by a crash
+                    continue
+    return records
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Get a percentile by linear interpolation
+    :param sorted_values
+    :param percentile: 0 to 100
+    :return: value
+    """
+    if len(sorted_values) == 0:
+        return None
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_records(records, group_by=None, outcomes=("success",)):
+    """
+    Compute the percentiles of the durations of the records grouped by settings
+    :param records
+    :param group_by: fields of the records grouping them
+    :param outcomes: outcomes of the records summarized
+    :return: list of (group dict, number of records, dict field -> dict percentile -> value)
+    """
+    group_by = group_by or DEFAULT_GROUP_BY
+    groups = {}
+    for record in records:
+        if record.get("outcome") not in outcomes:
+            continue
+        key = json.dumps([record.get(field) for field in group_by])
+        groups.setdefault(key, []).append(record)
+
+    summary = []
+    for key, group_records in groups.items():
+        percentiles = {}
+        for field in _SUMMARIZED_FIELDS:
+            values = sorted(record[field] for record in group_records if record.get(field) is not None)
+            percentiles[field] = {percentile: get_percentile(values, percentile) for percentile in _PERCENTILES}
+        summary.append((dict(zip(group_by, json.loads(key))), len(group_records), percentiles))
+    summary.sort(key=lambda group: -group[1])
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print a summary
+    :param summary: see summarize_records
+    :return:
+    """
+    for group, nb_records, percentiles in summary:
+        print(", ".join("%s=%s" % (field, value) for field, value in group.items()) + " : %d jobs" % nb_records)
+        for field, values in percentiles.items():
+            if values[_PERCENTILES[0]] is None:
+                continue
+            print("    %-17s " % field + "  ".join("p%d %8.2f" % (percentile, value)
+                                                   for percentile, value in values.items()))
+
+
+def main(argv=None):
+    """
+    Print the percentiles of the jobs grouped by settings
+    :param argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Summarize the history of the Style Dreamer jobs")
+    parser.add_argument("filepath", nargs="?",
+                        default=os.path.join(os.path.expanduser("~"), "style_dreamer", TELEMETRY_FILENAME))
+    parser.add_argument("--group-by", nargs="+", default=DEFAULT_GROUP_BY, help="fields grouping the jobs")
+    parser.add_argument("--all", action="store_true", help="also summarize the failed and cancelled jobs")
+    args = parser.parse_args(argv)
+
+    records = read_records(args.filepath)
+    if len(records) == 0:
+        print("No job in %s" % args.filepath)
+        return 1
+    outcomes = ("success", "partial", "failed", "cancelled") if args.all else ("success",)
+    print_summary(summarize_records(records, args.group_by, outcomes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+
+from PySide2.QtCore import QBuffer, QByteArray, QIODevice
+from PySide2.QtGui import QImage
+
+from .ImageLoader import read_image
+from .ImageWriter import write_file_atomic
+from .Tracing import trace_span
+
+_LOGGER = logging.getLogger(__name__)
+
+THUMBNAILS_DIRNAME = "thumbnails"
+# Longest side of the thumbnails in pixels (the strips of the visualizer display them at about 130 px)
+DEFAULT_THUMBNAIL_SIZE = 256
+# Max size of the decoded thumbnails kept in memory and of the thumbnails on the disk
+DEFAULT_THUMBNAIL_MEMORY_SIZE = 64 * 1024 ** 2
+DEFAULT_THUMBNAIL_DISK_SIZE = 512 * 1024 ** 2
+
+
+def make_thumbnail_key(path):
+    """
+    Compute the key of the thumbnail of an image : hash of its path, modification time and size
+    :param path
+    :return: key (None if the image doesn't exist)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return hashlib.sha1(("%s|%d|%d" % (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)).encode()).hexdigest()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, size=DEFAULT_THUMBNAIL_SIZE, max_memory_size=DEFAULT_THUMBNAIL_MEMORY_SIZE,
+                 max_disk_size=DEFAULT_THUMBNAIL_DISK_SIZE, image_cache=None):
+        """
+        Constructor. Thumbnails are kept in memory (the least recently used are dropped above the max memory size)
+        and on the disk, so an image is only decoded in full once
+        :param cache_dir: folder of the thumbnails on the disk
+        :param size: longest side of the thumbnails in pixels
+        :param max_memory_size: max size in bytes of the decoded thumbnails in memory
+        :param max_disk_size: max size in bytes of the thumbnails on the disk, the oldest are removed above it
+        :param image_cache: ImageBytesCache of the last written images, read instead of the disk
+        """
+        self.__cache_dir = cache_dir
+        self.__size = size
+        self.__max_memory_size = max_memory_size
+        self.__max_disk_size = max_disk_size
+        self.__image_cache = image_cache
+        self.__memory_size = 0
+        # path -> (key, QImage)
+        self.__thumbnails = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__nb_memory_hits = 0
+        self.__nb_disk_hits = 0
+        self.__nb_misses = 0
+        threading.Thread(target=self.prune, name="style_dreamer_thumbnails_prune", daemon=True).start()
+
+    def get_size(self):
+        """
+        Getter of the longest side of the thumbnails in pixels
+        :return: size
+        """
+        return self.__size
+
+    def get_stats(self):
+        """
+        Getter of the number of thumbnails found in memory, on the disk, and generated
+        :return: dict of the counters
+        """
+        with self.__lock:
+            return {"memory_hits": self.__nb_memory_hits, "disk_hits": self.__nb_disk_hits,
+                    "misses": self.__nb_misses, "memory_size": self.__memory_size}
+
+    def __get_thumbnail_path(self, key):
+        """
+        Get the path of a thumbnail on the disk
+        :param key
+        :return: path
+        """
+        return os.path.join(self.__cache_dir, key[:2], key + ".png")
+
+    def get_cached(self, path):
+        """
+        Get the thumbnail of an image only if it is in memory and up to date (cheap enough for the GUI thread)
+        :param path
+        :return: QImage or None
+        """
+        key = make_thumbnail_key(path)
+        with self.__lock:
+            entry = self.__thumbnails.get(path)
+            if entry is None or entry[0] != key:
+                return None
+            self.__thumbnails.move_to_end(path)
+            self.__nb_memory_hits += 1
+            return entry[1]
+
+    def get(self, path):
+        """
+        Get the thumbnail of an image, from the memory, the disk or by decoding the image (may be called from
+        several threads)
+        :param path
+        :return: QImage (null if the image couldn't be read)
+        """
+        key = make_thumbnail_key(path)
+        if key is None:
+            return QImage()
+        with self.__lock:
+            entry = self.__thumbnails.get(path)
+            if entry is not None and entry[0] == key:
+                self.__thumbnails.move_to_end(path)
+                self.__nb_memory_hits += 1
+                return entry[1]
+
+        thumbnail_path = self.__get_thumbnail_path(key)
+        thumbnail = QImage(thumbnail_path) if os.path.isfile(thumbnail_path) else QImage()
+        if not thumbnail.isNull():
+            with self.__lock:
+                self.__nb_disk_hits += 1
+        else:
+            with trace_span("make thumbnail", "visualizer"):
+                thumbnail = read_image(path, self.__size, self.__image_cache)
+            if thumbnail.isNull():
+                return thumbnail
+            self.__save_thumbnail(thumbnail, thumbnail_path)
+            with self.__lock:
+                self.__nb_misses += 1
+        self.__put(path, key, thumbnail)
+        return thumbnail
+
+    def __save_thumbnail(self, thumbnail, thumbnail_path):
+        """
+        Write a thumbnail on the disk, an error is only logged
+        :param thumbnail
+        :param thumbnail_path
+        :return:
+        """
+        byte_array = QByteArray()
+        buffer = QBuffer(byte_array)
+        buffer.open(QIODevice.WriteOnly)
+        thumbnail.save(buffer, "PNG")
+        buffer.close()
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            write_file_atomic(thumbnail_path, bytes(byte_array.data()))
+        except OSError as e:
+            _LOGGER.warning("Couldn't write the thumbnail %s : %s", thumbnail_path, e)
+
+    def __put(self, path, key, thumbnail):
+        """
+        Keep a thumbnail in memory
+        :param path
+        :param key
+        :param thumbnail
+        :return:
+        """
+        with self.__lock:
+            previous = self.__thumbnails.pop(path, None)
+            if previous is not None:
+                self.__memory_size -= previous[1].sizeInBytes()
+            self.__thumbnails[path] = (key, thumbnail)
+            self.__memory_size += thumbnail.sizeInBytes()
+            while self.__memory_size > self.__max_memory_size and len(self.__thumbnails) > 1:
+                _, (_, dropped) = self.__thumbnails.popitem(last=False)
+                self.__memory_size -= dropped.sizeInBytes()
+
+    def clear_memory(self):
+        """
+        Forget the thumbnails kept in memory
+        :return:
+        """
+        with self.__lock:
+            self.__thumbnails.clear()
+            self.__memory_size = 0
+
+    def prune(self):
+        """
+        Remove the oldest thumbnails of the disk above the max disk size
+        :return:
+        """
+        thumbnails = []
+        for dir_path, _, filenames in os.walk(self.__cache_dir):
+            for filename in filenames:
+                path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                thumbnails.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in thumbnails)
+        for _, size, path in sorted(thumbnails):
+            if total_size <= self.__max_disk_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
@@ -0,0 +1,325 @@
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Set to 1 to write a trace of each dream next to its images
+TRACE_ENV_VAR = "STYLE_DREAMER_TRACE"
+
+# Max number of events kept in memory, the oldest ones are dropped
+_MAX_EVENTS = 200000
+
+# Dream of the events of each thread, kept while the tracing is disabled and enabled again
+_local = threading.local()
+
+
+# Span returned while the tracing is disabled, it does nothing
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_args(self, **args):
+        """
+        Ignore the values
+        :param args
+        :return:
+        """
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        """
+        Constructor
+        :param tracer
+        :param name
+        :param category
+        :param args: values displayed with the span
+        """
+        self.__tracer = tracer
+        self.__name = name
+        self.__category = category
+        self.__args = args
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = trace_clock()
+        self.__tracer.push_open_span(self.__start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__tracer.pop_open_span()
+        if exc_type is not None:
+            self.__args["error"] = exc_type.__name__
+        self.__tracer.add_span(self.__name, self.__category, self.__start, trace_clock(), self.__args)
+        return False
+
+    def set_args(self, **args):
+        """
+        Add values displayed with the span (known once the span started)
+        :param args
+        :return:
+        """
+        self.__args.update(args)
+
+
+class Tracer:
+    def __init__(self):
+        """
+        Constructor. Keeps the events of all the threads in the Chrome trace event format
+        """
+        self.__events = collections.deque(maxlen=_MAX_EVENTS)
+        self.__thread_names = {}
+        self.__local = threading.local()
+
+    def __add_event(self, event):
+        """
+        Add an event of the current thread, tagged with the dream of the thread (see trace_dream)
+        :param event
+        :return:
+        """
+        dream = getattr(_local, "dream", None)
+        if dream is not None:
+            event["args"].setdefault("dream", dream)
+        thread = threading.current_thread()
+        event["pid"] = os.getpid()
+        event["tid"] = thread.ident
+        self.__thread_names[thread.ident] = thread.name
+        self.__events.append(event)
+
+    def add_span(self, name, category, start, end, args=None):
+        """
+        Add a span with known bounds
+        :param name
+        :param category
+        :param start: trace_clock() at the start
+        :param end: trace_clock() at the end
+        :param args: values displayed with the span
+        :return:
+        """
+        self.__add_event({"name": name, "cat": category, "ph": "X", "ts": start, "dur": end - start,
+                          "args": args or {}})
+
+    def add_instant(self, name, category, args=None):
+        """
+        Add an instant event
+        :param name
+        :param category
+        :param args: values displayed with the event
+        :return:
+        """
+        self.__add_event({"name": name, "cat": category, "ph": "i", "s": "t", "ts": trace_clock(),
+                          "args": args or {}})
+
+    def push_open_span(self, start):
+        """
+        Stack a span opened on the current thread
+        :param start
+        :return:
+        """
+        if not hasattr(self.__local, "open_spans"):
+            self.__local.open_spans = []
+        self.__local.open_spans.append(start)
+
+    def pop_open_span(self):
+        """
+        Unstack the last span opened on the current thread
+        :return:
+        """
+        self.__local.open_spans.pop()
+
+    def get_outer_span_start(self):
+        """
+        Get the start of the outermost span opened on the current thread
+        :return: start, None if no span is open
+        """
+        open_spans = getattr(self.__local, "open_spans", [])
+        return open_spans[0] if len(open_spans) > 0 else None
+
+    def get_events(self, start, dream=None):
+        """
+        Get the events ending after a time, with the names of their threads
+        :param start: trace_clock() value
+        :param dream: only the events of this dream and the untagged ones before its first event (the render of its
+        maps for instance), so that the dreams running at the same time don't mix their events. None for all
+        :return: events
+        """
+        events = [event for event in list(self.__events) if event["ts"] + event.get("dur", 0) >= start]
+        if dream is not None:
+            dream_events = [event for event in events if event["args"].get("dream") == dream]
+            first_ts = min([event["ts"] for event in dream_events], default=start)
+            events = [event for event in events if event["args"].get("dream") == dream or
+                      ("dream" not in event["args"] and event["ts"] < first_ts)]
+        tids = set(event["tid"] for event in events)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                     "args": {"name": self.__thread_names.get(tid, str(tid))}} for tid in tids]
+        return metadata + events
+
+
+_tracer = Tracer() if os.environ.get(TRACE_ENV_VAR, "0") not in ("", "0") else None
+
+
+def trace_clock():
+    """
+    Clock of the trace events
+    :return: time in microseconds
+    """
+    return time.perf_counter() * 1e6
+
+
+def set_tracing_enabled(enabled):
+    """
+    Enable or disable the tracing, the events recorded are dropped when it is disabled
+    :param enabled
+    :return:
+    """
+    global _tracer
+    if not enabled:
+        _tracer = None
+    elif _tracer is None:
+        _tracer = Tracer()
+
+
+def is_tracing_enabled():
+    """
+    Getter of whether the tracing is enabled
+    :return: is tracing enabled
+    """
+    return _tracer is not None
+
+
+def trace_span(name, category, **args):
+    """
+    Get a context manager timing a span of the current thread
+    :param name
+    :param category
+    :param args: values displayed with the span
+    :return: span
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def traced(name, category):
+    """
+    Decorator timing each call of a function in a span
+    :param name
+    :param category
+    :return: decorator
+    """
+    def decorator(fct):
+        @functools.wraps(fct)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fct(*args, **kwargs)
+            with trace_span(name, category):
+                return fct(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def trace_dream(dream):
+    """
+    Tag the events of the current thread with a dream
+    :param dream: id of the dream
+    :return: context manager
+    """
+    previous_dream = getattr(_local, "dream", None)
+    _local.dream = dream
+    try:
+        yield
+    finally:
+        _local.dream = previous_dream
+
+
+def bind_trace_dream(fct):
+    """
+    Get a function tagging its events with the dream of the current thread, to run on another thread
+    :param fct
+    :return: function
+    """
+    dream = getattr(_local, "dream", None)
+    if dream is None:
+        return fct
+
+    @functools.wraps(fct)
+    def wrapper(*args, **kwargs):
+        with trace_dream(dream):
+            return fct(*args, **kwargs)
+    return wrapper
+
+
+def add_trace_span(name, category, start, end, args=None):
+    """
+    Add a span with known bounds (a wait measured elsewhere for instance)
+    :param name
+    :param category
+    :param start: trace_clock() at the start
+    :param end: trace_clock() at the end
+    :param args: values displayed with the span
+    :return:
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_span(name, category, start, end, args)
+
+
+def add_trace_instant(name, category, args=None):
+    """
+    Add an instant event
+    :param name
+    :param category
+    :param args: values displayed with the event
+    :return:
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_instant(name, category, args)
+
+
+def get_trace_start():
+    """
+    Get the start of the outermost span opened on the current thread, the current time if there is none
+    :return: trace_clock() value
+    """
+    tracer = _tracer
+    start = tracer.get_outer_span_start() if tracer is not None else None
+    return start if start is not None else trace_clock()
+
+
+def write_trace(filepath, start, dream=None):
+    """
+    Write the events since a time in a Chrome trace file (chrome://tracing or https://ui.perfetto.dev)
+    :param filepath
+    :param start: trace_clock() value
+    :param dream: id of the dream whose events are written, None for all
+    :return: whether the file was written
+    """
+    # Imported here, the image writer is traced itself
+    from .ImageWriter import write_file_atomic
+    tracer = _tracer
+    if tracer is None:
+        return False
+    trace = {"traceEvents": tracer.get_events(start, dream), "displayTimeUnit": "ms"}
+    try:
+        write_file_atomic(filepath, json.dumps(trace).encode())
+    except OSError as e:
+        _LOGGER.warning("Couldn't write the trace %s : %s", filepath, e)
+        return False
+    _LOGGER.info("Trace written : %s", filepath)
+    return True
@@ -0,0 +1,451 @@
+import collections
+import math
+import os
+
+from PySide2.QtWidgets import *
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+
+from .ImageLoader import ImageLoader, read_image
+
+# Side in pixels of the tiles of the pyramids
+DEFAULT_TILE_SIZE = 256
+# Tiles converted to pixmaps kept by the view, and pyramids kept built
+_MAX_TILE_PIXMAPS = 512
+_MAX_PYRAMIDS = 4
+# Size read for the full resolution images
+_FULL_SIZE = QSize(1 << 15, 1 << 15)
+_MIN_ZOOM = 1 / 64
+_MAX_ZOOM = 32
+_WHEEL_ZOOM_FACTOR = 1.25
+
+
+class TilePyramid:
+    def __init__(self, image, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Constructor. Cuts an image in tiles, at its full resolution then halved until it fits in a tile (called on a
+        worker thread)
+        :param image: QImage
+        :param tile_size
+        """
+        self.__width = image.width()
+        self.__height = image.height()
+        self.__tile_size = tile_size
+        # level -> (width, height), tiles by (column, row)
+        self.__levels = []
+        level_image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        while True:
+            tiles = {}
+            for row in range(int(math.ceil(level_image.height() / tile_size))):
+                for column in range(int(math.ceil(level_image.width() / tile_size))):
+                    x = column * tile_size
+                    y = row * tile_size
+                    tiles[(column, row)] = level_image.copy(x, y, min(tile_size, level_image.width() - x),
+                                                            min(tile_size, level_image.height() - y))
+            self.__levels.append(((level_image.width(), level_image.height()), tiles))
+            if max(level_image.width(), level_image.height()) <= tile_size:
+                break
+            level_image = level_image.scaled(max(1, level_image.width() // 2), max(1, level_image.height() // 2),
+                                             Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    def get_width(self):
+        """
+        Getter of the width of the full resolution image
+        :return: width
+        """
+        return self.__width
+
+    def get_height(self):
+        """
+        Getter of the height of the full resolution image
+        :return: height
+        """
+        return self.__height
+
+    def get_tile_size(self):
+        """
+        Getter of the side of the tiles
+        :return: tile size
+        """
+        return self.__tile_size
+
+    def get_nb_levels(self):
+        """
+        Getter of the number of levels, the level 0 being the full resolution
+        :return: number of levels
+        """
+        return len(self.__levels)
+
+    def get_level_size(self, level):
+        """
+        Getter of the size of the image at a level
+        :param level
+        :return: width, height
+        """
+        return self.__levels[level][0]
+
+    def get_tile(self, level, column, row):
+        """
+        Getter of a tile
+        :param level
+        :param column
+        :param row
+        :return: QImage or None
+        """
+        return self.__levels[level][1].get((column, row))
+
+
+class ZoomView(QWidget):
+    flipped_changed = Signal(bool)
+
+    def __init__(self, image_cache=None, parent=None):
+        """
+        Constructor. Displays an image with zoom and pan, only the tiles visible at the level of the zoom are drawn.
+        A second image can be compared with a split line or flipped with the first one
+        :param image_cache: ImageBytesCache of the last written images
+        :param parent
+        """
+        super(ZoomView, self).__init__(parent)
+        self.__image_cache = image_cache
+        self.__paths = [None, None]
+        # (path, version) -> TilePyramid
+        self.__pyramids = collections.OrderedDict()
+        self.__requested = set()
+        # Last pyramids drawn, kept displayed while the next ones are built
+        self.__drawn_pyramids = [None, None]
+        self.__tile_pixmaps = collections.OrderedDict()
+        # Top left of the view in the coordinates of the first image, and displayed pixels by image pixel
+        self.__offset = QPointF(0, 0)
+        self.__zoom = 1.0
+        self.__fitted = True
+        self.__split = 0.5
+        self.__flipped = False
+        self.__drag_pos = None
+        self.__loader = ImageLoader(self.__build_pyramid, self.__on_pyramid_built, nb_workers=1, name="tiles")
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.setMouseTracking(False)
+        self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
+        self.setToolTip("Wheel : zoom, drag : pan, double click : fit, 1 : 100%, F : flip the compared images")
+
+    def release(self):
+        """
+        Stop building the pyramids and drop them
+        :return:
+        """
+        self.__loader.shutdown()
+        self.__pyramids.clear()
+        self.__drawn_pyramids = [None, None]
+        self.__tile_pixmaps.clear()
+
+    def set_images(self, path, compared_path=None):
+        """
+        Setter of the displayed image and of the one compared with it, the zoom is kept if the size doesn't change
+        :param path
+        :param compared_path: None for no comparison
+        :return:
+        """
+        previous_pyramid = self.__get_pyramid(self.__paths[0])
+        self.__paths = [path, compared_path]
+        for image_path in (compared_path, path):
+            if image_path is not None and self.__get_pyramid(image_path) is None:
+                self.__request(image_path)
+        pyramid = self.__get_pyramid(path)
+        if pyramid is not None and (previous_pyramid is None or self.__fitted or
+                                    previous_pyramid.get_width() != pyramid.get_width() or
+                                    previous_pyramid.get_height() != pyramid.get_height()):
+            self.fit()
+        self.update()
+
+    def set_split(self, split):
+        """
+        Setter of the position of the split line
+        :param split: 0 to 1, fraction of the width displaying the first image
+        :return:
+        """
+        self.__split = min(max(split, 0.0), 1.0)
+        self.update()
+
+    def set_flipped(self, flipped):
+        """
+        Swap the displayed image and the compared one
+        :param flipped
+        :return:
+        """
+        if flipped != self.__flipped:
+            self.__flipped = flipped
+            self.flipped_changed.emit(flipped)
+        self.update()
+
+    def is_flipped(self):
+        """
+        Getter of whether the displayed image and the compared one are swapped
+        :return: is flipped
+        """
+        return self.__flipped
+
+    def fit(self):
+        """
+        Zoom to display the whole image
+        :return:
+        """
+        pyramid = self.__get_pyramid(self.__paths[0])
+        if pyramid is None:
+            return
+        self.__zoom = min(self.width() / pyramid.get_width(), self.height() / pyramid.get_height())
+        self.__offset = QPointF((pyramid.get_width() - self.width() / self.__zoom) / 2,
+                                (pyramid.get_height() - self.height() / self.__zoom) / 2)
+        self.__fitted = True
+        self.update()
+
+    def zoom_at(self, zoom, pos):
+        """
+        Zoom keeping a point of the view still
+        :param zoom: new zoom
+        :param pos: QPointF in the view
+        :return:
+        """
+        zoom = min(max(zoom, _MIN_ZOOM), _MAX_ZOOM)
+        image_pos = self.__offset + pos / self.__zoom
+        self.__zoom = zoom
+        self.__offset = image_pos - pos / zoom
+        self.__fitted = False
+        self.update()
+
+    def __get_version(self, path):
+        """
+        Get the version of an image file : its modification time and size
+        :param path
+        :return: version (None if it doesn't exist)
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def __get_pyramid(self, path):
+        """
+        Get the pyramid of an image if it is built
+        :param path
+        :return: TilePyramid or None
+        """
+        if path is None:
+            return None
+        key = (path, self.__get_version(path))
+        pyramid = self.__pyramids.get(key)
+        if pyramid is not None:
+            self.__pyramids.move_to_end(key)
+        return pyramid
+
+    def __request(self, path):
+        """
+        Ask for the pyramid of an image to be built in background
+        :param path
+        :return:
+        """
+        key = (path, self.__get_version(path))
+        if key not in self.__requested:
+            self.__requested.add(key)
+            self.__loader.request(key)
+
+    def __build_pyramid(self, key):
+        """
+        Read an image at its full resolution and build its pyramid (called on a worker thread)
+        :param key: path, version
+        :return: TilePyramid or None
+        """
+        image = read_image(key[0], _FULL_SIZE, self.__image_cache)
+        return TilePyramid(image) if not image.isNull() else None
+
+    def __on_pyramid_built(self, key, pyramid):
+        """
+        On pyramid built display it
+        :param key: path, version
+        :param pyramid
+        :return:
+        """
+        self.__requested.discard(key)
+        if pyramid is None:
+            return
+        self.__pyramids[key] = pyramid
+        while len(self.__pyramids) > _MAX_PYRAMIDS:
+            _, dropped = self.__pyramids.popitem(last=False)
+            for tile_key in [tile_key for tile_key in self.__tile_pixmaps if tile_key[0] is dropped]:
+                del self.__tile_pixmaps[tile_key]
+        reference = self.__drawn_pyramids[0]
+        if key[0] == self.__paths[0] and (self.__fitted or reference is None or
+                                          reference.get_width() != pyramid.get_width() or
+                                          reference.get_height() != pyramid.get_height()):
+            self.fit()
+        self.update()
+
+    def __get_tile_pixmap(self, pyramid, level, column, row):
+        """
+        Get a tile as a pixmap, the least recently drawn are dropped
+        :param pyramid
+        :param level
+        :param column
+        :param row
+        :return: QPixmap or None
+        """
+        key = (pyramid, level, column, row)
+        pixmap = self.__tile_pixmaps.get(key)
+        if pixmap is not None:
+            self.__tile_pixmaps.move_to_end(key)
+            return pixmap
+        tile = pyramid.get_tile(level, column, row)
+        if tile is None:
+            return None
+        pixmap = QPixmap.fromImage(tile)
+        self.__tile_pixmaps[key] = pixmap
+        while len(self.__tile_pixmaps) > _MAX_TILE_PIXMAPS:
+            self.__tile_pixmaps.popitem(last=False)
+        return pixmap
+
+    def __draw_pyramid(self, painter, pyramid, reference, clip_rect):
+        """
+        Draw the visible tiles of a pyramid at the level of the zoom
+        :param painter
+        :param pyramid
+        :param reference: pyramid of the displayed image, whose coordinates the view uses
+        :param clip_rect: QRectF of the view to draw
+        :return:
+        """
+        # Pixels of the reference image by pixel of the pyramid
+        ratio = reference.get_width() / pyramid.get_width()
+        scale = self.__zoom * ratio
+        level = int(math.floor(math.log2(1 / scale))) if scale < 1 else 0
+        level = min(max(level, 0), pyramid.get_nb_levels() - 1)
+        level_scale = scale * (2 ** level)
+        level_width, level_height = pyramid.get_level_size(level)
+        tile_size = pyramid.get_tile_size()
+
+        # Visible part of the level
+        left = (self.__offset.x() + clip_rect.left() / self.__zoom) / ratio / (2 ** level)
+        top = (self.__offset.y() + clip_rect.top() / self.__zoom) / ratio / (2 ** level)
+        right = left + clip_rect.width() / level_scale
+        bottom = top + clip_rect.height() / level_scale
+        first_column = max(0, int(left // tile_size))
+        last_column = min(int(math.ceil(level_width / tile_size)) - 1, int(right // tile_size))
+        first_row = max(0, int(top // tile_size))
+        last_row = min(int(math.ceil(level_height / tile_size)) - 1, int(bottom // tile_size))
+
+        painter.save()
+        painter.setClipRect(clip_rect)
+        painter.scale(self.__zoom, self.__zoom)
+        painter.translate(-self.__offset)
+        painter.scale(ratio * (2 ** level), ratio * (2 ** level))
+        # Smooth when the tiles are reduced, pixels visible when they are enlarged to inspect them
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, level_scale < 1)
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                pixmap = self.__get_tile_pixmap(pyramid, level, column, row)
+                if pixmap is not None:
+                    painter.drawPixmap(column * tile_size, row * tile_size, pixmap)
+        painter.restore()
+
+    def paintEvent(self, event):
+        """
+        Paint function
+        :param event
+        :return:
+        """
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        for index, path in enumerate(self.__paths):
+            pyramid = self.__get_pyramid(path)
+            if pyramid is not None or path is None:
+                self.__drawn_pyramids[index] = pyramid
+        reference = self.__drawn_pyramids[0]
+        if reference is None:
+            painter.setPen(QColor(200, 200, 200))
+            painter.drawText(self.rect(), Qt.AlignCenter, "Loading..." if self.__paths[0] is not None else "")
+            return
+        pyramids = list(self.__drawn_pyramids)
+        if self.__flipped and pyramids[1] is not None:
+            pyramids.reverse()
+        view_rect = QRectF(self.rect())
+        if pyramids[1] is None or self.__flipped:
+            self.__draw_pyramid(painter, pyramids[0], reference, view_rect)
+        else:
+            split_x = view_rect.width() * self.__split
+            self.__draw_pyramid(painter, pyramids[0], reference, QRectF(0, 0, split_x, view_rect.height()))
+            self.__draw_pyramid(painter, pyramids[1], reference,
+                                QRectF(split_x, 0, view_rect.width() - split_x, view_rect.height()))
+            painter.setPen(QPen(QColor(255, 255, 255), 1))
+            painter.drawLine(QPointF(split_x, 0), QPointF(split_x, view_rect.height()))
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(self.rect().adjusted(6, 4, -6, -4), Qt.AlignRight | Qt.AlignTop,
+                         "%d%%" % round(self.__zoom * 100))
+
+    def resizeEvent(self, event):
+        """
+        On resize keep the whole image displayed if it was fitted
+        :param event
+        :return:
+        """
+        super(ZoomView, self).resizeEvent(event)
+        if self.__fitted:
+            self.fit()
+
+    def wheelEvent(self, event):
+        """
+        On wheel zoom around the cursor
+        :param event
+        :return:
+        """
+        steps = event.angleDelta().y() / 120
+        self.zoom_at(self.__zoom * _WHEEL_ZOOM_FACTOR ** steps, QPointF(event.pos()))
+
+    def mousePressEvent(self, event):
+        """
+        On press start panning
+        :param event
+        :return:
+        """
+        self.__drag_pos = QPointF(event.pos())
+
+    def mouseMoveEvent(self, event):
+        """
+        On drag pan the image
+        :param event
+        :return:
+        """
+        if self.__drag_pos is None:
+            return
+        pos = QPointF(event.pos())
+        self.__offset -= (pos - self.__drag_pos) / self.__zoom
+        self.__drag_pos = pos
+        self.__fitted = False
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        """
+        On release stop panning
+        :param event
+        :return:
+        """
+        self.__drag_pos = None
+
+    def mouseDoubleClickEvent(self, event):
+        """
+        On double click display the whole image
+        :param event
+        :return:
+        """
+        self.fit()
+
+    def keyPressEvent(self, event):
+        """
+        1 : 100%, 0 : fit, F : flip the compared images
+        :param event
+        :return:
+        """
+        if event.key() == Qt.Key_1:
+            self.zoom_at(1.0, QPointF(self.width() / 2, self.height() / 2))
+        elif event.key() == Qt.Key_0:
+            self.fit()
+        elif event.key() == Qt.Key_F:
+            self.set_flipped(not self.__flipped)
+        else:
+            super(ZoomView, self).keyPressEvent(event)
@@ -0,0 +1,292 @@
+"""
+Offline benchmark of the dream pipeline against a mock Automatic1111 server, without Maya nor a GPU
+
+Usage : python -m style_dreamer.benchmark.Benchmark [--image-counts 1 8 64 512] [--resolutions 512 1024 1920]
+                                                    [--save-baseline baseline.json] [--compare baseline.json]
+
+Each case runs a headless dream (DreamBatch) in its own process, so that its peak memory is its own. It shares the
+payload, chunks, backend pool, streamed request and response and image writer pool with the Style Dreamer window, but
+not what only runs in Maya : result cache, dream queue, output index, telemetry and thumbnails.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from ..DreamBatch import DreamBatch, DEFAULT_DATAS
+from ..DreamParams import DEPTH_NAME
+from ..DreamPlanner import DEFAULT_CHUNK_SIZE, get_batch_param
+from ..ImageWriter import write_file_atomic
+from ..RequestBody import get_peak_memory
+from .MockServer import *
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_COUNTS = [1, 8, 64, 512]
+DEFAULT_RESOLUTIONS = [512, 1024, 1920]
+# Resolution of the image count cases and image count of the resolution cases
+DEFAULT_RESOLUTION = 512
+DEFAULT_IMAGE_COUNT = 8
+
+# Relative change from the baseline considered as a regression
+DEFAULT_TOLERANCE = 0.1
+
+# Size of the synthetic depth map by pixel
+_MAP_BYTES_PER_PIXEL = 0.5
+
+# Metrics compared to the baseline, True if higher is better
+_COMPARED_METRICS = {
+    "images_per_s": True,
+    "time_to_first_image": False,
+    "peak_rss": False,
+}
+
+
+def get_cases(image_counts, resolutions):
+    """
+    Get the cases of the benchmark : every image count at the default resolution, every resolution with the
+    default image count
+    :param image_counts
+    :param resolutions
+    :return: list of (image count, resolution)
+    """
+    cases = [(image_count, DEFAULT_RESOLUTION) for image_count in image_counts]
+    cases += [(DEFAULT_IMAGE_COUNT, resolution) for resolution in resolutions]
+    return list(dict.fromkeys(cases))
+
+
+def get_case_name(image_count, resolution):
+    """
+    Get the name of a case
+    :param image_count
+    :param resolution
+    :return: name
+    """
+    return "%d images %dx%d" % (image_count, resolution, resolution)
+
+
+def run_case(url_server, work_dir, image_count, resolution, chunk_size, stream_response, optimize_maps):
+    """
+    Run a dream and measure it (called in the process of the case)
+    :param url_server
+    :param work_dir: folder of the control map and of the images
+    :param image_count
+    :param resolution
+    :param chunk_size
+    :param stream_response
+    :param optimize_maps
+    :return: result dict
+    """
+    map_path = os.path.join(work_dir, "depth.png")
+    write_file_atomic(map_path, make_png(resolution, resolution, int(resolution ** 2 * _MAP_BYTES_PER_PIXEL)))
+    datas = dict(DEFAULT_DATAS, prompt="benchmark", seed=1, image_count=image_count, width=resolution,
+                 height=resolution, weight_depth=1.0)
+    datas["batch_count"], datas["batch_size"] = get_batch_param(image_count)
+
+    requests_stats = []
+    dream_batch = DreamBatch(url_server, os.path.join(work_dir, "dreams"), chunk_size, stream_response,
+                             optimize_maps=optimize_maps, stats_callback=requests_stats.append)
+    start = time.perf_counter()
+    try:
+        entry = dream_batch.run_dream("benchmark", datas, {DEPTH_NAME: map_path})
+    finally:
+        duration = time.perf_counter() - start
+        dream_batch.close()
+
+    first_images = [stats["first_image"] for stats in requests_stats if stats["first_image"] is not None]
+    nb_images = len(entry["images"])
+    return {
+        "name": get_case_name(image_count, resolution),
+        "image_count": image_count,
+        "resolution": resolution,
+        "nb_images": nb_images,
+        "nb_requests": len(requests_stats),
+        "duration": duration,
+        "images_per_s": nb_images / duration if duration > 0 else 0.0,
+        "time_to_first_image": min(first_images) - start if len(first_images) > 0 else None,
+        "peak_rss": get_peak_memory(),
+        "bytes_sent": sum(stats.get("bytes_sent", 0) for stats in requests_stats),
+        "bytes_received": sum(stats["bytes_received"] for stats in requests_stats),
+        # Summed over the requests, the decode and write stages overlap the download in the writer threads
+        "stages": {
+            "request": sum(stats["response"] - stats["start"] for stats in requests_stats if "response" in stats),
+            "response": sum(stats["end"] - stats["response"] for stats in requests_stats if "response" in stats),
+            "decode": sum(stats["decode"] for stats in requests_stats),
+            "write": sum(stats["write"] for stats in requests_stats),
+        },
+        "error": entry["error"],
+    }
+
+
+def run_case_process(url_server, image_count, resolution, args):
+    """
+    Run a case in its own process
+    :param url_server
+    :param image_count
+    :param resolution
+    :param args: arguments of the benchmark
+    :return: result dict
+    """
+    if args.work_dir is not None:
+        os.makedirs(args.work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="style_dreamer_benchmark_", dir=args.work_dir)
+    try:
+        command = [sys.executable, "-m", __spec__.name, "--run-case", url_server, work_dir, str(image_count),
+                   str(resolution), "--chunk-size", str(args.chunk_size)]
+        if args.no_stream:
+            command.append("--no-stream")
+        if args.no_optimize:
+            command.append("--no-optimize")
+        # The package must be importable from the child process as it is from this one
+        package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_dir,
+                                                                         os.environ.get("PYTHONPATH")])))
+        process = subprocess.run(command, stdout=subprocess.PIPE, env=env)
+        if process.returncode != 0:
+            return {"name": get_case_name(image_count, resolution), "image_count": image_count,
+                    "resolution": resolution, "error": "The case process failed (code %d)" % process.returncode}
+        return json.loads(process.stdout.decode().strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_results(results):
+    """
+    Print the results in a table
+    :param results
+    :return:
+    """
+    print("%-22s %9s %9s %9s %10s %9s %9s %9s %9s" % ("case", "images/s", "ttfi (s)", "total (s)", "rss (MB)",
+                                                     "request", "response", "decode", "write"))
+    for result in results:
+        if result.get("error") is not None:
+            print("%-22s %s" % (result["name"], result["error"]))
+            continue
+        stages = result["stages"]
+        print("%-22s %9.1f %9.3f %9.2f %10.1f %9.2f %9.2f %9.2f %9.2f" % (
+            result["name"], result["images_per_s"], result["time_to_first_image"], result["duration"],
+            (result["peak_rss"] or 0) / 1024 ** 2, stages["request"], stages["response"], stages["decode"],
+            stages["write"]))
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare the results to a baseline and print the changes
+    :param results
+    :param baseline: baseline dict (see main)
+    :param tolerance: relative change considered as a regression
+    :return: list of the regressions
+    """
+    baseline_results = {result["name"]: result for result in baseline["cases"]}
+    regressions = []
+    print("\nComparison to the baseline of %s" % baseline["created"])
+    for result in results:
+        baseline_result = baseline_results.get(result["name"])
+        if baseline_result is None or result.get("error") is not None or baseline_result.get("error") is not None:
+            continue
+        changes = []
+        for metric, higher_is_better in _COMPARED_METRICS.items():
+            value, baseline_value = result.get(metric), baseline_result.get(metric)
+            if not value or not baseline_value:
+                continue
+            change = (value - baseline_value) / baseline_value
+            regressed = (change < -tolerance) if higher_is_better else (change > tolerance)
+            changes.append("%s %+.1f%%%s" % (metric, 100 * change, " REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((result["name"], metric, change))
+        print("%-22s %s" % (result["name"], ", ".join(changes)))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Run the benchmark
+    :param argv
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Style Dreamer dreams against a mock server")
+    parser.add_argument("--image-counts", type=int, nargs="*", default=DEFAULT_IMAGE_COUNTS,
+                        help="image counts benchmarked at %dx%d" % (DEFAULT_RESOLUTION, DEFAULT_RESOLUTION))
+    parser.add_argument("--resolutions", type=int, nargs="*", default=DEFAULT_RESOLUTIONS,
+                        help="resolutions benchmarked with %d images" % DEFAULT_IMAGE_COUNT)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds before each server job")
+    parser.add_argument("--latency-per-image", type=float, default=DEFAULT_LATENCY_PER_IMAGE,
+                        help="seconds to generate an image")
+    parser.add_argument("--bytes-per-pixel", type=float, default=DEFAULT_BYTES_PER_PIXEL,
+                        help="size of the generated images")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="max number of images by server call (0 for a single call)")
+    parser.add_argument("--no-stream", action="store_true", help="parse the responses all at once")
+    parser.add_argument("--no-optimize", action="store_true", help="send the control maps as generated")
+    parser.add_argument("--work-dir", help="folder of the temporary images (system temp folder by default)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results to a baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change considered as a regression")
+    parser.add_argument("--run-case", nargs=4, metavar=("URL", "WORK_DIR", "IMAGE_COUNT", "RESOLUTION"),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s : %(message)s")
+
+    if args.run_case is not None:
+        url_server, work_dir, image_count, resolution = args.run_case
+        result = run_case(url_server, work_dir, int(image_count), int(resolution), args.chunk_size,
+                          not args.no_stream, not args.no_optimize)
+        print(json.dumps(result))
+        return 0
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+
+    settings = {
+        "latency": args.latency,
+        "latency_per_image": args.latency_per_image,
+        "bytes_per_pixel": args.bytes_per_pixel,
+        "chunk_size": args.chunk_size,
+        "stream_response": not args.no_stream,
+        "optimize_maps": not args.no_optimize,
+    }
+    server = MockServer(latency=args.latency, latency_per_image=args.latency_per_image,
+                        bytes_per_pixel=args.bytes_per_pixel)
+    server.start()
+    results = []
+    try:
+        for image_count, resolution in get_cases(args.image_counts, args.resolutions):
+            print("Running %s..." % get_case_name(image_count, resolution), file=sys.stderr)
+            results.append(run_case_process(server.get_url(), image_count, resolution, args))
+    finally:
+        server.stop()
+    print_results(results)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "cases": results,
+    }
+    if args.save_baseline is not None:
+        write_file_atomic(args.save_baseline, json.dumps(report, indent=4).encode())
+        print("\nBaseline saved : %s" % args.save_baseline)
+    if baseline is not None:
+        if baseline.get("settings") != settings:
+            print("\nThe baseline was measured with other settings : %s" % baseline.get("settings"))
+        if len(compare_results(results, baseline, args.tolerance)) > 0:
+            return 1
+    return 1 if any(result.get("error") is not None for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
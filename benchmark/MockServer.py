@@ -0,0 +1,252 @@
+import base64
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_LOGGER = logging.getLogger(__name__)
+
+# Size of a generated PNG by pixel, close to the images returned by Stable Diffusion
+DEFAULT_BYTES_PER_PIXEL = 1.5
+# Time spent before the generation of a server job (model loading, ControlNet preprocessing...)
+DEFAULT_LATENCY = 0.2
+# Generation time of an image
+DEFAULT_LATENCY_PER_IMAGE = 0.02
+
+# Interval of the checks of an interruption during the fake generation
+_SLEEP_STEP = 0.01
+
+
+def _png_chunk(chunk_type, data):
+    """
+    Build a PNG chunk
+    :param chunk_type
+    :param data
+    :return: bytes
+    """
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def make_png(width, height, nb_bytes):
+    """
+    Build a valid grayscale PNG of the given resolution, padded with a private chunk to weigh about nb_bytes
+    :param width
+    :param height
+    :param nb_bytes
+    :return: bytes
+    """
+    header = _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+    image_data = _png_chunk(b"IDAT", zlib.compress(b"\x00" * ((width + 1) * height), 9))
+    end = _png_chunk(b"IEND", b"")
+    png = b"\x89PNG\r\n\x1a\n" + header + image_data
+    padding = nb_bytes - len(png) - len(end) - 12
+    if padding > 0:
+        # Random bytes so that the transfer can't be compressed
+        png += _png_chunk(b"prVt", os.urandom(padding))
+    return png + end
+
+
+class _MockState:
+    def __init__(self, latency, latency_per_image, bytes_per_pixel):
+        """
+        Constructor
+        :param latency
+        :param latency_per_image
+        :param bytes_per_pixel
+        """
+        self.latency = latency
+        self.latency_per_image = latency_per_image
+        self.bytes_per_pixel = bytes_per_pixel
+        # A single job at a time, like a GPU
+        self.gpu_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.images = {}
+        self.job_count = 0
+        self.job_timestamp = "0"
+        self.progress = 0.0
+        self.interrupted = False
+        self.nb_requests = 0
+        self.nb_images = 0
+
+    def get_base64_image(self, width, height):
+        """
+        Get the base64 synthetic image of a resolution (built once)
+        :param width
+        :param height
+        :return: base64 bytes
+        """
+        with self.lock:
+            key = (width, height)
+            if key not in self.images:
+                png = make_png(width, height, int(width * height * self.bytes_per_pixel))
+                self.images[key] = base64.b64encode(png)
+            return self.images[key]
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """
+        Quiet the default logs
+        :return:
+        """
+        _LOGGER.debug(format, *args)
+
+    def __send_json(self, obj, status=200):
+        """
+        Send a small JSON response
+        :param obj
+        :param status
+        :return:
+        """
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """
+        Progress endpoint
+        :return:
+        """
+        state = self.server.mock_state
+        if self.path != "/sdapi/v1/progress":
+            self.__send_json({"detail": "Not Found"}, 404)
+            return
+        with state.lock:
+            self.__send_json({
+                "progress": state.progress,
+                "eta_relative": 0,
+                "state": {"job_count": state.job_count, "job_timestamp": state.job_timestamp},
+            })
+
+    def do_POST(self):
+        """
+        Dream, interrupt and skip endpoints
+        :return:
+        """
+        state = self.server.mock_state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path in ("/sdapi/v1/interrupt", "/sdapi/v1/skip"):
+            with state.lock:
+                state.interrupted = True
+            self.__send_json({})
+            return
+        if self.path not in ("/sdapi/v1/txt2img", "/sdapi/v1/img2img"):
+            self.__send_json({"detail": "Not Found"}, 404)
+            return
+        params = json.loads(body)
+        nb_images = int(params["n_iter"]) * int(params["batch_size"])
+        with state.lock:
+            state.job_count += 1
+            state.nb_requests += 1
+        nb_generated = self.__generate(state, nb_images)
+        base64_img = state.get_base64_image(int(params["width"]), int(params["height"]))
+        self.__send_images(base64_img, nb_generated, params.get("seed", -1))
+
+    def __generate(self, state, nb_images):
+        """
+        Wait like the generation of the images
+        :param state
+        :param nb_images
+        :return: number of images generated before an interruption
+        """
+        with state.gpu_lock:
+            with state.lock:
+                state.interrupted = False
+                state.progress = 0.0
+                state.job_timestamp = time.strftime("%Y%m%d%H%M%S")
+            duration = state.latency + state.latency_per_image * nb_images
+            start = time.perf_counter()
+            nb_generated = nb_images
+            while time.perf_counter() - start < duration:
+                with state.lock:
+                    state.progress = (time.perf_counter() - start) / duration
+                    if state.interrupted:
+                        elapsed = time.perf_counter() - start - state.latency
+                        nb_generated = max(0, min(nb_images, int(elapsed / max(state.latency_per_image, 1e-6))))
+                        break
+                time.sleep(_SLEEP_STEP)
+            with state.lock:
+                state.progress = 0.0
+                state.job_count -= 1
+                state.nb_images += nb_generated
+        return nb_generated
+
+    def __send_images(self, base64_img, nb_images, seed):
+        """
+        Stream the images without building the whole body
+        :param base64_img
+        :param nb_images
+        :param seed
+        :return:
+        """
+        head = b'{"images": ['
+        tail = (b'], "parameters": {}, "info": ' + json.dumps(json.dumps({"seed": seed})).encode() + b"}")
+        length = len(head) + nb_images * (len(base64_img) + 2) + max(nb_images - 1, 0) * 2 + len(tail)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        self.wfile.write(head)
+        for index in range(nb_images):
+            if index > 0:
+                self.wfile.write(b", ")
+            self.wfile.write(b'"' + base64_img + b'"')
+        self.wfile.write(tail)
+
+
+class MockServer:
+    def __init__(self, port=0, latency=DEFAULT_LATENCY, latency_per_image=DEFAULT_LATENCY_PER_IMAGE,
+                 bytes_per_pixel=DEFAULT_BYTES_PER_PIXEL):
+        """
+        Constructor of a local stand-in of an Automatic1111 server
+        :param port: 0 to pick a free port
+        :param latency: time spent before the generation of each server job
+        :param latency_per_image: generation time of an image
+        :param bytes_per_pixel: size of the generated PNG by pixel
+        """
+        self.__server = ThreadingHTTPServer(("127.0.0.1", port), _MockHandler)
+        self.__server.daemon_threads = True
+        self.__server.mock_state = _MockState(latency, latency_per_image, bytes_per_pixel)
+        self.__thread = None
+
+    def get_url(self):
+        """
+        Getter of the url of the server
+        :return: url
+        """
+        return "http://127.0.0.1:%d/" % self.__server.server_address[1]
+
+    def get_stats(self):
+        """
+        Get the number of requests and images served
+        :return: dict of stats
+        """
+        state = self.__server.mock_state
+        with state.lock:
+            return {"requests": state.nb_requests, "images": state.nb_images}
+
+    def start(self):
+        """
+        Serve on a daemon thread
+        :return:
+        """
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="style_dreamer_mock_server",
+                                         daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop serving
+        :return:
+        """
+        self.__server.shutdown()
+        self.__server.server_close()